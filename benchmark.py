@@ -0,0 +1,175 @@
+import time
+from pathlib import Path
+from argparse import ArgumentParser
+import numpy as np
+import torch
+from PIL import Image
+
+from src.datasets.custom_crop import data_transforms, batch_transforms
+from src.datasets.batch_augment import BatchAugment
+
+
+def load_samples(folder: Path, num_images: int, size: int = 256) -> list:
+    """
+    Carga imágenes de una carpeta, o genera imágenes aleatorias si no se da una carpeta.
+
+    Args:
+        folder (Path): Carpeta con imágenes (recortes). Puede ser None.
+        num_images (int): Número de imágenes a cargar.
+        size (int): Tamaño de las imágenes generadas.
+
+    Returns:
+        list: Lista de imágenes PIL.
+    """
+    if folder is None:
+        return [Image.fromarray(np.random.randint(0, 256, (size, size, 3), dtype=np.uint8)) for _ in range(num_images)]
+    paths = sorted(p for p in folder.rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))[:num_images]
+    return [Image.open(p).convert("RGB") for p in paths]
+
+
+def benchmark_augment(folder: Path, num_images: int, batch_size: int, device: str) -> None:
+    """
+    Compara imágenes/s de data_transforms['train'] (PIL, una imagen a la vez) contra BatchAugment (lotes de tensores).
+
+    Ambas rutas parten de imágenes ya decodificadas, por lo que solo se mide el costo del aumento de datos.
+
+    Args:
+        folder (Path): Carpeta con imágenes. Si es None se usan imágenes aleatorias.
+        num_images (int): Número de imágenes a procesar.
+        batch_size (int): Tamaño de lote para BatchAugment.
+        device (str): Dispositivo para BatchAugment (cpu o cuda).
+    """
+    samples = load_samples(folder, num_images)
+    print(f"Imágenes: {len(samples)} | torch threads: {torch.get_num_threads()}")
+
+    start = time.perf_counter()
+    for img in samples:
+        data_transforms['train'](img)
+    pil_rate = len(samples) / (time.perf_counter() - start)
+    print(f"PIL (por imagen):            {pil_rate:10.1f} img/s")
+
+    # Los workers solo redimensionan y convierten a uint8; el costo del collate no se incluye en el aumento
+    tensors = [batch_transforms['train'](img) for img in samples]
+    batches = [torch.stack(tensors[i:i + batch_size]) for i in range(0, len(tensors), batch_size)]
+    augment = BatchAugment().to(device)
+    augment(batches[0].to(device))  # Calentamiento
+    if device == "cuda":
+        torch.cuda.synchronize()
+    start = time.perf_counter()
+    for batch in batches:
+        augment(batch.to(device, non_blocking=True))
+    if device == "cuda":
+        torch.cuda.synchronize()
+    batch_rate = len(samples) / (time.perf_counter() - start)
+    print(f"BatchAugment ({device}, bs={batch_size}): {batch_rate:10.1f} img/s ({batch_rate / pil_rate:.1f}x)")
+
+
+def benchmark_detector(folder: Path, detectors: list, batch_sizes: list, num_images: int, device: str) -> None:
+    """
+    Mide imágenes/s de cada variante de MegaDetectorV6 de detection_only.DETECTORS para varios tamaños de lote.
+
+    Las imágenes se decodifican antes de medir, por lo que solo se mide el detector (letterbox, inferencia y NMS).
+
+    Args:
+        folder (Path): Carpeta con imágenes originales de cámaras trampa.
+        detectors (list): Nombres de los detectores (llaves de DETECTORS).
+        batch_sizes (list): Tamaños de lote a medir.
+        num_images (int): Número de imágenes a procesar.
+        device (str): Dispositivo del detector (cpu o cuda).
+    """
+    from PytorchWildlife.models import detection as pw_detection
+    from detection_only import DETECTORS
+    from utils import batched, get_images_from_folder, load_image
+
+    images = [load_image(p) for p in get_images_from_folder(folder)[:num_images]]
+    print(f"Imágenes: {len(images)} | dispositivo: {device} | torch threads: {torch.get_num_threads()}")
+    print(f"{'Detector':<18}" + "".join(f"{'bs=' + str(bs):>10}" for bs in batch_sizes) + "  (img/s)")
+
+    for name in detectors:
+        detector = pw_detection.MegaDetectorV6(device=device, pretrained=True, version=DETECTORS[name])
+        rates = []
+        for bs in batch_sizes:
+            def detect(batch):
+                return detector.predictor(batch if bs > 1 else batch[0])
+            detect(images[:bs])  # Calentamiento
+            if device == "cuda":
+                torch.cuda.synchronize()
+            start = time.perf_counter()
+            for batch in batched(images, bs):
+                detect(batch)
+            if device == "cuda":
+                torch.cuda.synchronize()
+            rates.append(len(images) / (time.perf_counter() - start))
+        print(f"{name:<18}" + "".join(f"{rate:>10.1f}" for rate in rates))
+        del detector
+
+
+def benchmark_motion(folder: Path, labels_csv: Path, empty_label: str, thresholds: list) -> None:
+    """
+    Reporta, para varios umbrales del pre-filtro de movimiento, cuántas llamadas al detector se evitan y,
+    con un conjunto etiquetado, el recall de imágenes con animales que conserva el filtro.
+
+    Args:
+        folder (Path): Carpeta con imágenes originales (subcarpetas = cámaras).
+        labels_csv (Path): CSV con columnas path (relativa a folder, o absoluta) y label. Puede ser None.
+        empty_label (str): Etiqueta de las imágenes vacías en labels_csv.
+        thresholds (list): Umbrales (fracción de píxeles que cambian) a evaluar.
+    """
+    import pandas as pd
+    from src.utils.motion_filter import MotionFilter
+
+    paths = sorted(p for p in folder.rglob("*") if p.suffix.lower() in (".jpg", ".jpeg", ".png"))
+    has_animal = None
+    if labels_csv is not None:
+        labels = pd.read_csv(labels_csv)
+        # Se indexa por la ruta relativa a folder: los nombres se repiten entre cámaras (IMG_0001.JPG en cada una)
+        root = folder.resolve()
+        key = lambda x: (Path(x).relative_to(root) if Path(x).is_absolute() else Path(x)).as_posix()
+        animal = dict(zip(labels["path"].map(key), labels["label"] != empty_label))
+        paths = [p for p in paths if p.relative_to(folder).as_posix() in animal]
+        has_animal = {p: animal[p.relative_to(folder).as_posix()] for p in paths}
+
+    motion_filter = MotionFilter()
+    start = time.perf_counter()
+    motion_filter.score(paths)
+    rate = len(paths) / (time.perf_counter() - start)
+    print(f"Imágenes: {len(paths)} | filtro: {rate:.1f} img/s")
+    for threshold in thresholds:
+        motion_filter.threshold = threshold
+        print(f"umbral={threshold:<6} " + motion_filter.summary(motion_filter.report(paths, has_animal)))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="benchmark",
+        description="Mide el rendimiento (imágenes/s) de las distintas etapas del pipeline."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_augment = subparsers.add_parser("augment", help="Aumento de datos PIL contra BatchAugment")
+    parser_augment.add_argument("--folder", type=Path, default=None, help="Carpeta con recortes (default: imágenes aleatorias)")
+    parser_augment.add_argument("--num-images", type=int, default=512, help="Número de imágenes")
+    parser_augment.add_argument("--batch-size", type=int, default=64, help="Tamaño de lote para BatchAugment")
+    parser_augment.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="cpu o cuda")
+
+    parser_detector = subparsers.add_parser("detector", help="Detectores MegaDetectorV6 a distintos tamaños de lote")
+    parser_detector.add_argument("folder", type=Path, help="Carpeta con imágenes originales")
+    parser_detector.add_argument("--detectors", nargs="+", default=None, help="Detectores a medir (default: todos los de DETECTORS)")
+    parser_detector.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16], help="Tamaños de lote")
+    parser_detector.add_argument("--num-images", type=int, default=128, help="Número de imágenes")
+    parser_detector.add_argument("--device", default="cuda" if torch.cuda.is_available() else "cpu", help="cpu o cuda")
+
+    parser_motion = subparsers.add_parser("motion", help="Llamadas al detector evitadas y recall del pre-filtro de movimiento")
+    parser_motion.add_argument("folder", type=Path, help="Carpeta con imágenes originales")
+    parser_motion.add_argument("--labels", type=Path, default=None, help="CSV con columnas path (relativa a la carpeta) y label para medir el recall")
+    parser_motion.add_argument("--empty-label", default="empty", help="Etiqueta de las imágenes vacías en --labels")
+    parser_motion.add_argument("--thresholds", type=float, nargs="+", default=[0.005, 0.01, 0.02, 0.05], help="Umbrales a evaluar")
+
+    args = parser.parse_args()
+    if args.command == "augment":
+        benchmark_augment(args.folder, args.num_images, args.batch_size, args.device)
+    elif args.command == "detector":
+        from detection_only import DETECTORS_OPTS
+        benchmark_detector(args.folder, args.detectors or DETECTORS_OPTS, args.batch_sizes, args.num_images, args.device)
+    elif args.command == "motion":
+        benchmark_motion(args.folder, args.labels, args.empty_label, args.thresholds)
@@ -3,6 +3,8 @@ from argparse import ArgumentParser
 from PytorchWildlife.models import detection as pw_detection
 import torch
 from utils import process_detection_only, process_folder_detection_only
+from src.utils.detection_cache import DetectionCache
+from src.utils.motion_filter import MotionFilter
 
 # Detectores probados basados en los disponibles en https://microsoft.github.io/CameraTraps/model_zoo/megadetector/
 DETECTORS = {
@@ -28,6 +30,13 @@ if __name__ == "__main__":
     parser.add_argument("path", type=Path, help="Ruta de la imagen o carpeta a procesar")
     parser.add_argument("--detector", default=DETECTORS_OPTS[0], choices=DETECTORS_OPTS, help="Modelo de detección que se desea usar")
     parser.add_argument("--margin", type=int, default=5, help="Tamaño del margen alrededor de la detección")
+    parser.add_argument("--num-workers", type=int, default=4, help="Hilos de decodificación y de escritura de recortes")
+    parser.add_argument("--batch-size", type=int, default=1, help="Imágenes por llamada al detector (lotes con letterbox)")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Cache de detecciones por hash de imagen y versión del detector")
+    parser.add_argument("--motion-threshold", type=float, default=None,
+                        help="Activa el pre-filtro de movimiento: fracción mínima de píxeles que cambian respecto a las imágenes vecinas de la secuencia")
+    parser.add_argument("--motion-mode", default="skip", choices=["skip", "last"],
+                        help="Las imágenes sin movimiento se omiten (skip) o se procesan al final (last)")
     args = parser.parse_args()
     device = get_device()
     # Cargaremos el modelo y se imprimirá la elección
@@ -42,13 +51,17 @@ if __name__ == "__main__":
         print(f" Error cargando el modelo: {e}")
         sys.exit(1) 
         
+    cache = DetectionCache(args.cache_dir, model_version) if args.cache_dir is not None else None
+    motion_filter = MotionFilter(threshold=args.motion_threshold) if args.motion_threshold is not None else None
+
     # Si path es directorio se procesan todas las imagenes en el directorio
     if args.path.is_dir():
         # process_folder_detection_only ya se encarga de crear la carpeta de salida internamente
-        process_folder_detection_only(args.path, detector, args.margin)
+        process_folder_detection_only(args.path, detector, args.margin, args.num_workers, batch_size=args.batch_size,
+                                      cache=cache, motion_filter=motion_filter, motion_mode=args.motion_mode)
     elif args.path.is_file():
         output_folder = args.path.parent / "recortes_sin_clasificar_single"
         output_folder.mkdir(exist_ok=True)
-        process_detection_only(args.path, output_folder, detector, args.margin)
+        process_detection_only(args.path, output_folder, detector, args.margin, cache=cache)
     else:
         raise ValueError(f"{args.path} no es un valor válido")
@@ -1,11 +1,114 @@
 import os
+import json
 import shutil
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
+import pandas as pd
+
+# Output modes: real copies, links to the originals, or only a manifest of the partition
+OUTPUT_MODES = ("copy", "hardlink", "symlink", "csv", "json")
+
+
+def cattle_probabilities(logits: np.ndarray, positive_class: int = 1) -> np.ndarray:
+    """
+    Maps the raw model logits to the probability of the Cattle class.
+
+    Args:
+        logits (np.ndarray): Logits of shape (N, C), (N, 1) or (N,).
+        positive_class (int): Label id of the Cattle class. With a single logit, it is the probability of class 1.
+
+    Returns:
+        np.ndarray: Probability of the Cattle class of each image, shape (N,).
+    """
+    # Handling both binary (1D) and multiclass (2D) logit shapes gracefully
+    if len(logits.shape) == 2 and logits.shape[1] > 1:
+        # Numerically stable Softmax for (N, 2) shape
+        exp_logits = np.exp(logits - np.max(logits, axis=1, keepdims=True))
+        probabilities = exp_logits / np.sum(exp_logits, axis=1, keepdims=True)
+        return probabilities[:, positive_class]
+    # Sigmoid for (N, 1) or (N,) shape
+    probabilities = 1 / (1 + np.exp(-np.asarray(logits).reshape(-1)))
+    return probabilities if positive_class == 1 else 1 - probabilities
+
+
+def place_file(src: str, dst: str, mode: str) -> None:
+    """
+    Places one image in its partition folder as a copy, a hardlink or a symlink (replacing any existing file).
+
+    Args:
+        src (str): Path to the original image.
+        dst (str): Destination path.
+        mode (str): copy, hardlink or symlink.
+    """
+    if mode == "copy":
+        shutil.copy(src, dst)
+        return
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "hardlink":
+        os.link(src, dst)
+    else:
+        os.symlink(os.path.abspath(src), dst)
+
+
+def partition_paths(file_ids: np.ndarray, is_cattle: np.ndarray, cattle_dir: str, wildlife_dir: str,
+                    predict_root: str = None) -> list:
+    """
+    Destination of every image in its partition folder, keeping its path relative to the predict root.
+
+    The predict root is walked recursively and camera folders often repeat names like IMG_0001.JPG, so the
+    relative path (unique per image) is kept instead of the bare file name.
+
+    Args:
+        file_ids (np.ndarray): Paths to the images.
+        is_cattle (np.ndarray): Whether each image passed the threshold.
+        cattle_dir (str): Folder of the cattle partition.
+        wildlife_dir (str): Folder of the native wildlife partition.
+        predict_root (str, optional): Root the paths are made relative to. Default: the deepest folder shared
+            by all the images.
+
+    Returns:
+        list: Destination path of every image.
+    """
+    paths = [str(f) for f in file_ids]
+    if predict_root is None:
+        predict_root = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths]) if paths else ""
+    return [os.path.join(cattle_dir if cattle else wildlife_dir, os.path.relpath(os.path.abspath(p), predict_root))
+            for p, cattle in zip(paths, is_cattle)]
+
+
+def write_manifest(manifest_path: str, file_ids: np.ndarray, cattle_probs: np.ndarray, is_cattle: np.ndarray, mode: str) -> None:
+    """
+    Writes the partition as a manifest instead of placing any file.
+
+    Args:
+        manifest_path (str): Path to the manifest (without extension).
+        file_ids (np.ndarray): Paths to the images.
+        cattle_probs (np.ndarray): Probability of the Cattle class of each image.
+        is_cattle (np.ndarray): Whether each image passed the threshold.
+        mode (str): csv or json.
+    """
+    manifest = pd.DataFrame({
+        "path": file_ids.astype(str),
+        "cattle_prob": cattle_probs,
+        "partition": np.where(is_cattle, "cattle_detected", "native_wildlife"),
+    })
+    if mode == "csv":
+        manifest.to_csv(manifest_path + ".csv", index=False)
+    else:
+        with open(manifest_path + ".json", "w") as f:
+            json.dump(manifest.to_dict(orient="records"), f, indent=1)
+    print(f"Partition manifest saved to {manifest_path}.{mode}")
+
 
 def filter_with_custom_threshold(
     npz_file_path: str, 
     output_directory: str = "strict_filtered_results", 
-    threshold: float = 0.85
+    threshold: float = 0.85,
+    mode: str = "copy",
+    num_workers: int = 16,
+    predict_root: str = None
 ):
     """
     Filters images by applying a custom probability threshold to the raw model logits.
@@ -15,7 +118,15 @@ def filter_with_custom_threshold(
         npz_file_path (str): Path to the .npz file containing 'logits' and 'file_ids'.
         output_directory (str): Root directory for the separated images.
         threshold (float): Minimum probability [0, 1] required to classify as Cattle.
+        mode (str): copy (parallel copies), hardlink, symlink (links to the originals, no extra storage),
+            csv or json (only a partition manifest in output_directory, no files are placed).
+        num_workers (int): Number of threads copying or linking the files.
+        predict_root (str, optional): Root of the predicted images; their paths relative to it are kept inside
+            the partition folders. Default: the deepest folder shared by all the images.
     """
+    if mode not in OUTPUT_MODES:
+        raise ValueError(f"Invalid output mode: {mode}. Available options: {', '.join(OUTPUT_MODES)}.")
+
     print(f"Loading logits from: {npz_file_path}")
     print(f"Applying strict decision threshold: P(Y=Cattle) >= {threshold}")
     
@@ -27,39 +138,38 @@ def filter_with_custom_threshold(
         print(f"Error loading the .npz file: {e}")
         return
 
-    # Map logits to probabilities
-    # Handling both binary (1D) and multiclass (2D) logit shapes gracefully
-    if len(logits.shape) == 2 and logits.shape[1] > 1:
-        # Numerically stable Softmax for (N, 2) shape
-        exp_logits = np.exp(logits - np.max(logits, axis=1, keepdims=True))
-        probabilities = exp_logits / np.sum(exp_logits, axis=1, keepdims=True)
-        # Assuming class 1 is Cattle
-        cattle_probs = probabilities[:, 1] 
+    cattle_probs = cattle_probabilities(logits)
+
+    # Apply the custom threshold logic
+    is_cattle = cattle_probs >= threshold
+    cattle_count = int(is_cattle.sum())
+    wildlife_count = len(is_cattle) - cattle_count
+
+    os.makedirs(output_directory, exist_ok=True)
+    if mode in ("csv", "json"):
+        write_manifest(os.path.join(output_directory, "partition"), file_ids, cattle_probs, is_cattle, mode)
     else:
-        # Sigmoid for (N, 1) or (N,) shape
-        cattle_probs = 1 / (1 + np.exp(-logits.squeeze()))
+        cattle_dir = os.path.join(output_directory, "cattle_detected")
+        wildlife_dir = os.path.join(output_directory, "native_wildlife")
+
+        os.makedirs(cattle_dir, exist_ok=True)
+        os.makedirs(wildlife_dir, exist_ok=True)
+
+        destinations = partition_paths(file_ids, is_cattle, cattle_dir, wildlife_dir, predict_root)
+        for folder in sorted(set(os.path.dirname(dst) for dst in destinations)):
+            os.makedirs(folder, exist_ok=True)
+
+        # File operations are I/O bound, so a thread pool overlaps them
+        with ThreadPoolExecutor(max_workers=num_workers) as executor:
+            futures = deque()
+            for filepath, dst in zip(file_ids, destinations):
+                futures.append(executor.submit(place_file, str(filepath), dst, mode))
+                # Bound the pending operations, so large archives do not queue one future per file
+                while len(futures) > 64 * num_workers:
+                    futures.popleft().result()
+            for future in futures:
+                future.result()
 
-    cattle_dir = os.path.join(output_directory, "cattle_detected")
-    wildlife_dir = os.path.join(output_directory, "native_wildlife")
-    
-    os.makedirs(cattle_dir, exist_ok=True)
-    os.makedirs(wildlife_dir, exist_ok=True)
-    
-    cattle_count = 0
-    wildlife_count = 0
-
-    for prob, filepath in zip(cattle_probs, file_ids):
-        filepath = str(filepath)
-        filename = os.path.basename(filepath)
-        
-        # Apply the custom threshold logic
-        if prob >= threshold: 
-            shutil.copy(filepath, os.path.join(cattle_dir, filename))
-            cattle_count += 1
-        else:
-            shutil.copy(filepath, os.path.join(wildlife_dir, filename))
-            wildlife_count += 1
-            
     print("-" * 50)
     print("Threshold filtering completed successfully.")
     print(f"Cattle images (High Confidence >= {threshold}): {cattle_count}")
@@ -73,11 +183,15 @@ if __name__ == "__main__":
     # You can tune this parameter. 0.50 is the default. 
     # 0.85 to 0.95 is recomended to minimize false positives (e.g., misclassified pumas).
     DECISION_THRESHOLD = 0.85
+
+    # copy, hardlink, symlink, csv or json. Links and manifests avoid duplicating the archive.
+    OUTPUT_MODE = "copy"
     
     if os.path.exists(PREDICTION_NPZ_PATH):
         filter_with_custom_threshold(
             npz_file_path=PREDICTION_NPZ_PATH, 
-            threshold=DECISION_THRESHOLD
+            threshold=DECISION_THRESHOLD,
+            mode=OUTPUT_MODE
         )
     else:
         print(f"Error: The specified file was not found at {PREDICTION_NPZ_PATH}")
\ No newline at end of file
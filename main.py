@@ -1,10 +1,36 @@
 # %%
 # Importing libraries
 import os
+import sys
 import yaml
 import typer
 from munch import Munch
 # %%
+# Thread configuration. The thread variables are only read when torch/numpy are imported,
+# so --np_threads is parsed here, before importing them.
+def resolve_threads(np_threads):
+    """
+    Resolve the number of threads from the --np_threads option ('auto' uses all the cores).
+    """
+    return os.cpu_count() if np_threads == 'auto' else int(np_threads)
+
+def threads_from_argv(argv, default='auto'):
+    """
+    Read the value of --np_threads (or --np-threads) from the command line arguments.
+    """
+    for i, arg in enumerate(argv):
+        for opt in ('--np_threads', '--np-threads'):
+            if arg == opt and i + 1 < len(argv):
+                return argv[i + 1]
+            if arg.startswith(opt + '='):
+                return arg.split('=', 1)[1]
+    return default
+
+NUM_THREADS = resolve_threads(threads_from_argv(sys.argv))
+# Environment variable setup for numpy multi-threading. It is important to avoid cpu and ram issues.
+for var in ("OMP_NUM_THREADS", "OPENBLAS_NUM_THREADS", "MKL_NUM_THREADS", "VECLIB_MAXIMUM_THREADS", "NUMEXPR_NUM_THREADS"):
+    os.environ[var] = str(NUM_THREADS)
+# %%
 import torch
 import pytorch_lightning as pl
 from pytorch_lightning.callbacks import ModelCheckpoint
@@ -14,8 +40,9 @@ from pytorch_lightning.loggers import CSVLogger, CometLogger, TensorBoardLogger,
 from src import algorithms
 from src import datasets
 # %%
-from src.utils import batch_detection_cropping
+from src.utils.batch_detection import batch_detection_cropping
 from src.utils import data_splitting
+from src.utils.callbacks import ThroughputMonitor
 
 app = typer.Typer(pretty_exceptions_short=True, pretty_exceptions_show_locals=False)
 # %%
@@ -26,14 +53,15 @@ def main(
         gpus:str='0', 
         logger_type:str='csv',
         evaluate:str=None,
-        np_threads:str='32',
+        np_threads:str='auto',
         session:int=0,
         seed:int=0,
         dev:bool=False,
         val:bool=False,
         test:bool=False,
         predict:bool=False,
-        predict_root:str=""
+        predict_root:str="",
+        incremental:bool=False
     ):
     """
     Main function for training or evaluating a ResNet model (50 or 18) using PyTorch Lightning.
@@ -42,36 +70,45 @@ def main(
     Args:
         config (str): Path to the configuration file.
         project (str): Name of the project for logging.
-        gpus (str): Comma-separated GPU ids for training.
+        gpus (str): Comma-separated GPU ids for training. Ignored if no GPU is available (CPU mode).
         logger_type (str): Type of logger to use (wandb, comet, tensorboard, csv).
         evaluate (str): Path to the model checkpoint for evaluation.
-        np_threads (str): Number of numpy threads to use.
+        np_threads (str): Number of threads to use ('auto' for all the cores). In CPU mode they are split
+            between the DataLoader workers and the compute threads.
         session (int): Session number for logging purposes.
         seed (int): Random seed for reproducibility.
         dev (bool): Development mode flag.
         val (bool): Validation mode flag.
         predict (bool): Prediction mode flag.
         predict_root (str): Root directory for prediction outputs.
+        incremental (bool): Only score the files of predict_root that are new or changed since the last
+            prediction run with the same checkpoint, and merge them into the existing outputs.
     """
 
-    # GPU configuration: set up GPUs based on availability and user specification
-    gpus = gpus if torch.cuda.is_available() else None
-    gpus = [int(i) for i in gpus.split(',')]
-
-    # Environment variable setup for numpy multi-threading. It is important to avoid cpu and ram issues.
-    os.environ["OMP_NUM_THREADS"] = str(np_threads)
-    os.environ["OPENBLAS_NUM_THREADS"] = str(np_threads)
-    os.environ["MKL_NUM_THREADS"] = str(np_threads)
-    os.environ["VECLIB_MAXIMUM_THREADS"] = str(np_threads)
-    os.environ["NUMEXPR_NUM_THREADS"] = str(np_threads)
     # Load and set configurations from the YAML file
     with open(config) as f:
         conf = Munch(yaml.load(f, Loader=yaml.FullLoader))
+
+    # Device configuration: use the requested GPUs if available, otherwise run on CPU
+    if torch.cuda.is_available():
+        accelerator = 'gpu'
+        devices = [int(i) for i in gpus.split(',')]
+    else:
+        accelerator = 'cpu'
+        devices = 1
+        # Split the cores between the DataLoader workers (decoding) and the compute threads, so they
+        # do not fight over the same cores. Workers run single-threaded torch.
+        conf.num_workers = min(conf.num_workers, max(1, NUM_THREADS // 4))
+        compute_threads = max(1, NUM_THREADS - conf.num_workers)
+        torch.set_num_threads(compute_threads)
+        torch.set_num_interop_threads(1)
+        print('CPU mode: {} compute threads, {} DataLoader workers.'.format(compute_threads, conf.num_workers))
     conf.evaluate = evaluate
     conf.val = val
     conf.test = test
     conf.predict = predict
     conf.predict_root = predict_root
+    conf.incremental = incremental
 
     # Set a global seed for reproducibility
     pl.seed_everything(seed)
@@ -82,11 +119,11 @@ def main(
         conf.annotation_dir = os.path.dirname(conf.split_path)
         # Split the data according to the split type
         if conf.split_type == 'location':
-            data_splitting.split_by_location(conf.split_path, conf.annotation_dir, conf.test_size, conf.val_size)
+            data_splitting.split_by_location(conf.split_path, conf.annotation_dir, conf.test_size, conf.val_size, fmt=conf.get('annotation_format', 'csv'))
         elif conf.split_type == 'sequence':
-            data_splitting.split_by_seq(conf.split_path, conf.annotation_dir, conf.test_size, conf.val_size)
+            data_splitting.split_by_seq(conf.split_path, conf.annotation_dir, conf.test_size, conf.val_size, fmt=conf.get('annotation_format', 'csv'))
         elif conf.split_type == 'random':
-            data_splitting.create_splits(conf.split_path, conf.annotation_dir, conf.test_size, conf.val_size)
+            data_splitting.create_splits(conf.split_path, conf.annotation_dir, conf.test_size, conf.val_size, fmt=conf.get('annotation_format', 'csv'))
         else:
             raise ValueError('Invalid split type: {}. Available options: random, location, sequence.'.format(conf.split_type))
         
@@ -155,10 +192,10 @@ def main(
         max_epochs=conf.num_epochs,
         check_val_every_n_epoch=1, 
         log_every_n_steps = conf.log_interval, 
-        accelerator='gpu',
-        devices=gpus,
+        accelerator=accelerator,
+        devices=devices,
         logger=None if evaluate is not None else logger,
-        callbacks=[lr_monitor, checkpoint_callback],
+        callbacks=[lr_monitor, checkpoint_callback, ThroughputMonitor()],
         strategy='auto',
         num_sanity_val_steps=0,
         profiler=None
@@ -168,7 +205,8 @@ def main(
         if val:
             trainer.validate(learner, dataloaders=[dataset.val_dataloader()], ckpt_path=evaluate)
         elif predict:
-            trainer.predict(learner, dataloaders=[dataset.predict_dataloader()], ckpt_path=evaluate)
+            # The datamodule is passed so the sequence predict mode can feed predictions back to its sampler
+            trainer.predict(learner, datamodule=dataset, ckpt_path=evaluate)
         elif test:
             trainer.test(learner, dataloaders=[dataset.test_dataloader()], ckpt_path=evaluate)
         else:
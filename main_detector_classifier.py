@@ -1,8 +1,12 @@
+import sys
 from pathlib import Path
 from argparse import ArgumentParser
+import torch
 from PytorchWildlife.models import detection as pw_detection
 from PytorchWildlife.models import classification as pw_classification 
-from utils import process_image, process_folder 
+from utils import process_image, process_folder, get_images_from_folder
+from src.utils.fused_pipeline import FusedCattlePipeline
+from src.utils.detection_cache import DetectionCache
 
 # Detectores probados basados en los disponibles en https://microsoft.github.io/CameraTraps/model_zoo/megadetector/
 DETECTORS = {
@@ -33,23 +37,50 @@ if __name__ == "__main__":
                         help="Modelo de detección que se desea usará")
     parser.add_argument("--classifier", default=CLASSIFIERS_OPTS[0], choices=CLASSIFIERS_OPTS,
                         help="Modelo de clasificación que se desea usará")
-    parser.add_argument("--margin", type=int, default=5, help="Tamaño del margen alrededor de la detección")
+    parser.add_argument("--margin", type=int, default=None,
+                        help="Tamaño del margen alrededor de la detección (default: 5, o 0 con --checkpoint como los "
+                             "recortes de entrenamiento)")
+    parser.add_argument("--num-workers", type=int, default=4, help="Hilos de decodificación y de escritura de recortes")
+    parser.add_argument("--batch-size", type=int, default=1, help="Imágenes por llamada al detector (lotes con letterbox)")
+    parser.add_argument("--cache-dir", type=Path, default=None, help="Cache de detecciones por hash de imagen y versión del detector")
+    parser.add_argument("--checkpoint", type=Path, default=None,
+                        help="Checkpoint del clasificador Plain (main.py). Si se indica, se usa el pipeline en memoria "
+                             "detección -> recorte -> clasificación en lugar de --classifier")
+    parser.add_argument("--crop-batch-size", type=int, default=64, help="Recortes por lote del clasificador")
+    parser.add_argument("--save-crops", action="store_true", help="Guarda también los recortes en disco (con --checkpoint)")
 
     args = parser.parse_args()
 
     # Cargaremos los modelos y se imprimirá la elección
     print(f"\nCargando detector: {args.detector}")
     detector = pw_detection.MegaDetectorV6(version=DETECTORS[args.detector])
+    cache = DetectionCache(args.cache_dir, DETECTORS[args.detector]) if args.cache_dir is not None else None
+
+    if args.checkpoint is not None:
+        # Pipeline en memoria: los recortes se cortan de la imagen ya decodificada y se clasifican por lotes,
+        # sin escribir ni volver a leer JPEG intermedios
+        print(f"Cargando clasificador: {args.checkpoint}")
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+        images = get_images_from_folder(args.path) if args.path.is_dir() else [args.path]
+        output_dir = args.path if args.path.is_dir() else args.path.parent
+        crops_dir = output_dir / "recortes" if args.save_crops else None
+        pipeline = FusedCattlePipeline(detector, args.checkpoint, device=device, batch_size=args.crop_batch_size,
+                                       margin=0 if args.margin is None else args.margin, crops_dir=crops_dir, det_batch_size=args.batch_size, cache=cache)
+        pipeline.run(images, output_dir / "detecciones_clasificadas.csv")
+        sys.exit(0)
 
     print(f"Cargando clasificador: {args.classifier}")
+    margin = 5 if args.margin is None else args.margin
     classifier = getattr(pw_classification, CLASSIFIERS[args.classifier])()
 
     # Si path es directorio se clasifican todos las imagenes en el directorio
     if args.path.is_dir():
-        process_folder(args.path, detector, classifier, args.margin)
+        process_folder(args.path, detector, classifier, margin, args.num_workers, batch_size=args.batch_size,
+                       classify_batch_size=args.crop_batch_size, cache=cache)
     elif args.path.is_file():
         output_folder = args.path.parent / "recortes_single"
         output_folder.mkdir(exist_ok=True)
-        process_image(args.path, output_folder, detector, classifier, args.margin)
+        process_image(args.path, output_folder, detector, classifier, margin, classify_batch_size=args.crop_batch_size,
+                      cache=cache)
     else:
         raise ValueError(f"{args.path} no es un valor válido")
@@ -0,0 +1,142 @@
+import os
+import time
+from argparse import ArgumentParser
+import numpy as np
+import torch
+from torch.utils.data import DataLoader, Subset
+
+from src.models.export import export_model, load_classifier, InferenceWrapper
+from src.models.inference_engine import InferenceEngine, softmax
+from src.models.quantization import quantize_classifier, benchmark_model, save_quantized
+from src.utils.metrics import acc
+from src.datasets.crop_dataset import Custom_Crop_DS, data_transforms
+from src.utils.output_writers import ChunkedArrayWriter, FeatureEncoder, JsonLinesWriter, prediction_records
+
+
+def predict(model_path: str, predict_root: str, output_prefix: str = None, batch_size: int = 64,
+            num_workers: int = 4, num_threads: int = None, output_feats: str = "fp32", output_feats_dim: int = 128) -> None:
+    """
+    Clasifica todas las imágenes de predict_root con un modelo exportado (ONNX o TorchScript), sin Lightning.
+    Escribe las mismas salidas que main.py --predict: <prefijo>_predict.npz y <prefijo>_predict.json.
+
+    Args:
+        model_path (str): Ruta del modelo exportado (.onnx o .pt).
+        predict_root (str): Directorio con las imágenes a clasificar (se recorre recursivamente).
+        output_prefix (str): Prefijo de los archivos de salida. Default: la ruta del modelo sin extensión.
+        batch_size (int): Tamaño de lote.
+        num_workers (int): Número de workers del DataLoader (decodificación).
+        num_threads (int): Número de hilos de cómputo del motor.
+        output_feats (str): Política de guardado de las features (none, fp32, fp16, int8, pca).
+        output_feats_dim (int): Dimensiones de la proyección pca.
+    """
+    output_prefix = output_prefix or os.path.splitext(model_path)[0]
+    engine = InferenceEngine(model_path, num_threads=num_threads)
+    dataset = Custom_Crop_DS(rootdir=predict_root, dset="predict", transform=data_transforms["val"], draft_size=(224, 224))
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers, drop_last=False)
+
+    encoders = {} if output_feats == "none" else {"feats": FeatureEncoder(output_feats, dim=output_feats_dim)}
+    writer = ChunkedArrayWriter(output_prefix + "_predict.npz", encoders=encoders, overwrite=True)
+    json_writer = JsonLinesWriter(output_prefix + "_predict.json")
+    writer.on_flush.append(json_writer.flush)
+
+    start = time.perf_counter()
+    for data, file_ids in loader:
+        feats, logits = engine(data)
+        probs = softmax(logits)
+        preds = probs.argmax(axis=1)
+        columns = {} if output_feats == "none" else {"feats": feats}
+        # JSON first: a chunk flushed by append also flushes the JSON records of this batch
+        json_writer.write(prediction_records(file_ids, preds, probs.max(axis=1)))
+        writer.append(preds=preds, logits=logits, file_ids=file_ids, **columns)
+    elapsed = time.perf_counter() - start
+
+    writer.close()
+    json_writer.close()
+    print(f"Predict output saved to {writer.output_path}.")
+    print(f"Predict output json saved to {json_writer.output_path}.")
+    print(f"{len(dataset)} imágenes en {elapsed:.1f} s ({len(dataset) / max(elapsed, 1e-9):.1f} img/s).")
+
+
+def quantize(checkpoint: str, dataset_root: str, output_path: str = None, calib_images: int = 512,
+             batch_size: int = 64, num_workers: int = 4, num_threads: int = None, backend: str = "x86",
+             annotation_format: str = "csv") -> None:
+    """
+    Cuantiza un checkpoint a INT8 (cuantización estática post-entrenamiento) calibrando con una muestra del split val,
+    y reporta la exactitud macro/micro y las imágenes/s en CPU del modelo fp32 contra el int8 sobre todo el split val.
+    El modelo int8 se guarda en TorchScript y se puede usar directamente con el subcomando predict.
+
+    Args:
+        checkpoint (str): Ruta del checkpoint .ckpt.
+        dataset_root (str): Raíz del dataset (la misma dataset_root de la configuración).
+        output_path (str): Ruta del modelo cuantizado. Default: junto al checkpoint con sufijo _int8.pt.
+        calib_images (int): Número de imágenes del split val usadas para calibrar.
+        batch_size (int): Tamaño de lote.
+        num_workers (int): Número de workers del DataLoader.
+        num_threads (int): Número de hilos de cómputo.
+        backend (str): Motor de cuantización (x86, fbgemm o qnnpack).
+        annotation_format (str): Formato de las anotaciones de los recortes (csv o parquet).
+    """
+    if num_threads:
+        torch.set_num_threads(num_threads)
+    output_path = output_path or checkpoint.replace(".ckpt", "_int8.pt")
+    dataset = Custom_Crop_DS(rootdir=dataset_root, dset="val", transform=data_transforms["val"], draft_size=(224, 224),
+                             annotation_format=annotation_format)
+    calib_idx = np.random.RandomState(0).permutation(len(dataset))[:calib_images]
+    calib_loader = DataLoader(Subset(dataset, calib_idx), batch_size=batch_size, num_workers=num_workers)
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, num_workers=num_workers)
+
+    net = load_classifier(checkpoint)
+    print(f"Calibrando con {len(calib_idx)} imágenes del split val...")
+    quantized = quantize_classifier(net, calib_loader, backend=backend)
+    save_quantized(quantized, output_path)
+
+    print(f"{'Modelo':<8}{'Macro Acc':>12}{'Micro Acc':>12}{'img/s':>10}")
+    for name, model in (("fp32", InferenceWrapper(net).eval()), ("int8", quantized)):
+        preds, labels, rate = benchmark_model(model, loader)
+        _, mac_acc, mic_acc = acc(preds, labels)
+        print(f"{name:<8}{mac_acc * 100:>12.2f}{mic_acc * 100:>12.2f}{rate:>10.1f}")
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="predict_engine",
+        description="Exporta o cuantiza un checkpoint y clasifica imágenes con el modelo exportado, sin Lightning."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    parser_export = subparsers.add_parser("export", help="Exporta un checkpoint (feature + classifier) a un solo grafo")
+    parser_export.add_argument("checkpoint", help="Ruta del checkpoint .ckpt entrenado con main.py")
+    parser_export.add_argument("--format", default="onnx", choices=["onnx", "torchscript"], help="Formato de exportación")
+    parser_export.add_argument("--output", default=None, help="Ruta del modelo exportado (default: junto al checkpoint)")
+
+    parser_predict = subparsers.add_parser("predict", help="Clasifica un directorio con un modelo exportado")
+    parser_predict.add_argument("model", help="Ruta del modelo exportado (.onnx o .pt)")
+    parser_predict.add_argument("predict_root", help="Directorio con las imágenes a clasificar")
+    parser_predict.add_argument("--output-prefix", default=None, help="Prefijo de las salidas (default: ruta del modelo)")
+    parser_predict.add_argument("--batch-size", type=int, default=64, help="Tamaño de lote")
+    parser_predict.add_argument("--num-workers", type=int, default=4, help="Workers del DataLoader")
+    parser_predict.add_argument("--num-threads", type=int, default=None, help="Hilos de cómputo del motor")
+    parser_predict.add_argument("--output-feats", default="fp32", choices=list(FeatureEncoder.policies), help="Features guardadas")
+    parser_predict.add_argument("--output-feats-dim", type=int, default=128, help="Dimensiones de la proyección pca")
+
+    parser_quantize = subparsers.add_parser("quantize", help="Cuantiza un checkpoint a INT8 y compara exactitud e img/s contra fp32")
+    parser_quantize.add_argument("checkpoint", help="Ruta del checkpoint .ckpt entrenado con main.py")
+    parser_quantize.add_argument("dataset_root", help="Raíz del dataset con cropped_resized/val_annotations_cropped.csv (o .parquet)")
+    parser_quantize.add_argument("--output", default=None, help="Ruta del modelo int8 (default: <checkpoint>_int8.pt)")
+    parser_quantize.add_argument("--calib-images", type=int, default=512, help="Imágenes del split val para calibrar")
+    parser_quantize.add_argument("--batch-size", type=int, default=64, help="Tamaño de lote")
+    parser_quantize.add_argument("--num-workers", type=int, default=4, help="Workers del DataLoader")
+    parser_quantize.add_argument("--num-threads", type=int, default=None, help="Hilos de cómputo")
+    parser_quantize.add_argument("--backend", default="x86", choices=["x86", "fbgemm", "qnnpack"], help="Motor de cuantización")
+    parser_quantize.add_argument("--annotation-format", default="csv", choices=["csv", "parquet"], help="Formato de las anotaciones")
+
+    args = parser.parse_args()
+    if args.command == "export":
+        extension = ".onnx" if args.format == "onnx" else ".pt"
+        export_model(args.checkpoint, args.output or args.checkpoint.replace(".ckpt", extension), fmt=args.format)
+    elif args.command == "predict":
+        predict(args.model, args.predict_root, args.output_prefix, args.batch_size, args.num_workers,
+                args.num_threads, args.output_feats, args.output_feats_dim)
+    elif args.command == "quantize":
+        quantize(args.checkpoint, args.dataset_root, args.output, args.calib_images, args.batch_size,
+                 args.num_workers, args.num_threads, args.backend, args.annotation_format)
@@ -8,8 +8,10 @@ import torch
 import torch.optim as optim
 import pytorch_lightning as pl
 
-from .utils import acc
+from .utils import acc_from_confusion, update_confusion
 from src import models
+from src.utils.output_writers import ChunkedArrayWriter, FeatureEncoder, JsonLinesWriter, prediction_records
+from src.utils.predict_manifest import merge_predict_outputs
 
 
 __all__ = [
@@ -42,7 +44,8 @@ class Plain(pl.LightningModule):
         self.train_class_counts = train_class_counts
         self.id_to_labels = id_to_labels
         self.net = models.__dict__[self.hparams.model_name](num_cls=self.hparams.num_classes, 
-                                                            num_layers=self.hparams.num_layers)
+                                                            num_layers=self.hparams.num_layers,
+                                                            weights_dir=self.hparams.get('weights_dir'))
         for param in self.net.feature.parameters():
             param.requires_grad = False
 
@@ -66,13 +69,71 @@ class Plain(pl.LightningModule):
         scheduler = optim.lr_scheduler.StepLR(optimizer, step_size=self.hparams.step_size, gamma=self.hparams.gamma)   
         return [optimizer], [scheduler]
 
+    def setup(self, stage):
+        """
+        Hook function called before the dataloaders are created. Initializes the network for training.
+
+        The pre-trained weights are loaded here rather than at the start of training so that the feature
+        cache (see Custom_Base.feature_dataset) is extracted with the final backbone weights.
+
+        Args:
+            stage (str): Stage being set up (fit, validate, test or predict).
+        """
+        if stage == 'fit':
+            self.net.feat_init()
+            self.net.setup_criteria()
+        if self.hparams.get('frozen_fast_path', False):
+            self.net.feature.to(memory_format=torch.channels_last)
+
+    def train(self, mode=True):
+        """
+        Sets the training mode of the module. In the frozen-backbone fast path, the backbone always stays in
+        eval mode so its BatchNorm layers keep the pre-trained statistics.
+
+        Args:
+            mode (bool): Whether to set training mode (True) or evaluation mode (False).
+
+        Returns:
+            Plain: The module itself.
+        """
+        super().train(mode)
+        if self.hparams.get('frozen_fast_path', False):
+            self.net.feature.eval()
+        return self
+
     def on_train_start(self):
         """
-        Hook function called at the start of training. Initializes best accuracy and the network.
+        Hook function called at the start of training. Initializes best accuracy.
         """
         self.best_acc = 0
-        self.net.feat_init()
-        self.net.setup_criteria()
+
+    def forward_features(self, data):
+        """
+        Computes the backbone features of a batch.
+
+        Batches served from the feature cache already contain the (N, D) features, so the backbone is skipped.
+        In the frozen-backbone fast path, the backbone runs without autograd and in channels_last memory format;
+        only the classifier keeps gradients. With fast_path_autocast, the training pass also runs under autocast
+        (float16 on GPU, bfloat16 on CPU). Validation, test and predict always run in float32, so the reported
+        metrics and the saved logits do not depend on it.
+
+        Args:
+            data (Tensor): Batch of images or of cached features.
+
+        Returns:
+            Tensor: The features of the batch.
+        """
+        if data.dim() == 2:
+            return data
+        if not self.hparams.get('frozen_fast_path', False):
+            return self.net.feature(data)
+
+        data = data.contiguous(memory_format=torch.channels_last)
+        autocast = self.training and self.hparams.get('fast_path_autocast', False)
+        dtype = torch.float16 if data.device.type == 'cuda' else torch.bfloat16
+        with torch.no_grad(), torch.autocast(device_type=data.device.type, dtype=dtype, enabled=autocast):
+            feats = self.net.feature(data)
+        return feats.float()
 
     def training_step(self, batch, batch_idx):
         """
@@ -88,7 +149,7 @@ class Plain(pl.LightningModule):
         data, label_ids = batch[0], batch[1]
         
         # Forward pass
-        feats = self.net.feature(data)
+        feats = self.forward_features(data)
         logits = self.net.classifier(feats)
         # Calculate loss
         loss = self.net.criterion_cls(logits, label_ids)
@@ -98,9 +159,9 @@ class Plain(pl.LightningModule):
 
     def on_validation_start(self):
         """
-        Hook function called at the start of validation. Initializes storage for validation outputs.
+        Hook function called at the start of validation. Initializes the confusion matrix on the device.
         """
-        self.val_st_outs = []
+        self.val_confusion = self.new_confusion()
 
     def validation_step(self, batch, batch_idx):
         """
@@ -112,30 +173,85 @@ class Plain(pl.LightningModule):
         """
         data, label_ids = batch[0], batch[1]
         # Forward pass
-        feats = self.net.feature(data)
+        feats = self.forward_features(data)
         logits = self.net.classifier(feats)
         preds = logits.argmax(dim=1)
         
-        self.val_st_outs.append((preds.detach().cpu().numpy(),
-                                 label_ids.detach().cpu().numpy()))
+        update_confusion(self.val_confusion, preds, label_ids)
 
     def on_validation_epoch_end(self):
         """
         Hook function called at the end of the validation epoch. Aggregates and logs validation results.
         """
-        total_preds = np.concatenate([x[0] for x in self.val_st_outs], axis=0)
-        total_label_ids = np.concatenate([x[1] for x in self.val_st_outs], axis=0)
-        self.eval_logging(total_preds, total_label_ids)
+        self.eval_logging(self.reduce_confusion(self.val_confusion))
+
+    def new_confusion(self):
+        """
+        Creates an empty confusion matrix on the device of the model.
+
+        Returns:
+            Tensor: Zero matrix of shape (num_classes, num_classes).
+        """
+        return torch.zeros((self.hparams.num_classes, self.hparams.num_classes), dtype=torch.long, device=self.device)
+
+    def reduce_confusion(self, matrix):
+        """
+        Sums a confusion matrix across the processes and moves it to the CPU.
+
+        Args:
+            matrix (Tensor): The confusion matrix of this process.
+
+        Returns:
+            ndarray: The confusion matrix of the whole dataset.
+        """
+        return self.trainer.strategy.reduce(matrix, reduce_op='sum').cpu().numpy()
+
+    def output_writer(self, output_path, overwrite=True, key=None):
+        """
+        Creates the streaming writer of the predict/test outputs, with the configured feature output policy.
+
+        Args:
+            output_path (str): Path to the .npz output.
+            overwrite (bool): Discard the parts left by an interrupted run instead of resuming after them.
+            key (str, optional): Identifier of the run, checked when resuming.
+
+        Returns:
+            ChunkedArrayWriter: The writer of the outputs.
+        """
+        policy = self.hparams.get('output_feats', 'fp32')
+        encoders = {}
+        if policy != 'none':
+            encoders['feats'] = FeatureEncoder(policy, dim=self.hparams.get('output_feats_dim', 128))
+        return ChunkedArrayWriter(output_path, encoders=encoders, overwrite=overwrite, key=key)
+
+    def output_feats(self, feats):
+        """
+        Moves the features of a batch to the CPU for the output writers, unless they are not saved.
+
+        Args:
+            feats (Tensor): The features of the batch.
+
+        Returns:
+            dict: The feats column for the output writers (empty with the none policy).
+        """
+        policy = self.hparams.get('output_feats', 'fp32')
+        if policy == 'none':
+            return {}
+        if policy == 'fp16':
+            # Halve the device-to-host copy as well
+            feats = feats.half()
+        return {'feats': feats.detach().cpu().numpy()}
 
     def on_test_start(self):
         """
-        Hook function called at the start of testing. Initializes storage for test outputs.
+        Hook function called at the start of testing. Opens the streaming writer of the test outputs.
         """
-        self.te_st_outs = []
+        self.te_writer = self.output_writer(self.hparams.evaluate.replace('.ckpt', 'eval.npz'))
+        self.te_confusion = self.new_confusion()
 
     def test_step(self, batch, batch_idx):
         """
-        Test step for each batch.
+        Test step for each batch. The outputs are appended to the test writer as soon as they are computed.
 
         Args:
             batch: The current batch of data, including metadata.
@@ -143,49 +259,57 @@ class Plain(pl.LightningModule):
         """
         data, label_ids, labels, file_ids = batch
         # Forward pass
-        feats = self.net.feature(data)
+        feats = self.forward_features(data)
         logits = self.net.classifier(feats)
         preds = logits.argmax(dim=1)
         
-        self.te_st_outs.append((preds.detach().cpu().numpy(),
-                               label_ids.detach().cpu().numpy(),
-                               feats.detach().cpu().numpy(),
-                               logits.detach().cpu().numpy(), 
-                               labels, file_ids 
-                               ))
+        update_confusion(self.te_confusion, preds, label_ids)
+        self.te_writer.append(preds=preds.detach().cpu().numpy(),
+                              label_ids=label_ids.detach().cpu().numpy(),
+                              logits=logits.detach().cpu().numpy(),
+                              labels=labels, file_ids=file_ids,
+                              **self.output_feats(feats))
     
 
     def on_test_epoch_end(self):
         """
-        Hook function called at the end of the test epoch. Aggregates and logs test results, and saves output.
+        Hook function called at the end of the test epoch. Finalizes the saved output and logs test results.
         """
-        # Concatenate outputs from all test steps
-        total_preds = np.concatenate([x[0] for x in self.te_st_outs], axis=0)
-        total_label_ids = np.concatenate([x[1] for x in self.te_st_outs], axis=0)
-        total_feats = np.concatenate([x[2] for x in self.te_st_outs], axis=0)
-        total_logits = np.concatenate([x[3] for x in self.te_st_outs], axis=0)
-        total_labels = np.concatenate([x[4] for x in self.te_st_outs], axis=0)
-        total_file_ids = np.concatenate([x[5] for x in self.te_st_outs], axis=0)
+        self.te_writer.close()
+        print('Test output saved to {}.'.format(self.te_writer.output_path))
 
-        # Calculate the metrics and save the output
-        self.eval_logging(total_preds[total_label_ids != -1],
-                          total_label_ids[total_label_ids != -1],
-                          print_class_acc=False)
-
-        output_path = self.hparams.evaluate.replace('.ckpt', 'eval.npz') 
-        np.savez(output_path, preds=total_preds, label_ids=total_label_ids, feats=total_feats,
-                 logits=total_logits, labels=total_labels, file_ids=total_file_ids)  
-        print('Test output saved to {}.'.format(output_path))
+        # Calculate the metrics (unlabeled samples were left out of the confusion matrix)
+        self.eval_logging(self.reduce_confusion(self.te_confusion), print_class_acc=False)
 
     def on_predict_start(self):
         """
-        Hook function called at the start of prediction. Initializes storage for prediction outputs.
+        Hook function called at the start of prediction. Opens the streaming writers of the prediction outputs.
+
+        In incremental mode, the outputs of the current run are written next to the existing ones and merged
+        into them at the end of the epoch, and the scored files are recorded in the predict manifest (shared
+        with the datamodule) every time a chunk of outputs is committed. The outputs of an interrupted run are
+        closed and merged by the datamodule before the predict loop, and only the files missing from the
+        manifest are scored again.
         """
-        self.pr_st_outs = []
+        incremental = self.hparams.get('incremental', False)
+        if incremental and self.hparams.get('output_feats', 'fp32') == 'pca':
+            raise ValueError('The pca feature output policy cannot be used with incremental prediction, '
+                             'since every run fits its own projection.')
+        self.pr_manifest = getattr(self.trainer.datamodule, 'predict_manifest', None) if incremental else None
+        self.pr_unsaved = []
+        suffix = '_predict_new' if incremental else '_predict'
+        self.pr_writer = self.output_writer(self.hparams.evaluate.replace('.ckpt', suffix + '.npz'), overwrite=not incremental,
+                                            key=self.pr_manifest.checkpoint if self.pr_manifest is not None else None)
+        self.pr_json_writer = JsonLinesWriter(self.hparams.evaluate.replace('.ckpt', suffix + '.json'),
+                                              keep_lines=self.pr_writer.num_rows if incremental else None)
+        # The JSON records reach the disk together with the npz chunks
+        self.pr_writer.on_flush.append(self.pr_json_writer.flush)
+        # Feedback of the sequence predict mode (see Custom_Base.predict_dataloader)
+        self.pr_tracker = getattr(self.trainer.datamodule, 'sequence_tracker', None)
 
     def predict_step(self, batch, batch_idx):
         """
-        Prediction step for each batch.
+        Prediction step for each batch. The outputs are appended to the prediction writers as soon as they are computed.
 
         Args:
             batch: The current batch of data, including metadata.
@@ -193,63 +317,80 @@ class Plain(pl.LightningModule):
         """
         data, file_ids = batch
         # Forward pass
-        feats = self.net.feature(data)
+        feats = self.forward_features(data)
         logits = self.net.classifier(feats)
-        preds = logits.argmax(dim=1)
-        probs = torch.softmax(logits, dim=1).max(dim=1)[0]
-        
-        self.pr_st_outs.append((preds.detach().cpu().numpy(),
-                                feats.detach().cpu().numpy(),
-                                logits.detach().cpu().numpy(), 
-                                probs.detach().cpu().numpy(),
-                                file_ids 
-                                ))
-    
+        softmax = torch.softmax(logits, dim=1).detach().cpu().numpy()
+        preds = softmax.argmax(axis=1)
+        probs = softmax.max(axis=1)
 
-    def on_predict_epoch_end(self):
-        """
-        Hook function called at the end of the predict epoch. Aggregates and saves prediction outputs.
-        """
-        # Concatenate outputs from all predict steps
-        total_preds = np.concatenate([x[0] for x in self.pr_st_outs], axis=0)
-        total_feats = np.concatenate([x[1] for x in self.pr_st_outs], axis=0)
-        total_logits = np.concatenate([x[2] for x in self.pr_st_outs], axis=0)
-        total_probs = np.concatenate([x[3] for x in self.pr_st_outs], axis=0)
-        total_file_ids = np.concatenate([x[4] for x in self.pr_st_outs], axis=0)
+        if self.pr_tracker is not None:
+            self.pr_tracker.update(file_ids, softmax)
 
-        json_output = []
-        for i in range(len(total_preds)):
-            json_output.append({
-                "marker_id": "",
-                "survey_pic_id": total_file_ids[i],
-                "marker_confidence": float(total_probs[i]),
-                "marker_gear_type": "ghostnet" if total_preds[i] == 1 else "neg",
-                "marker_bounding_polygon": "",
-                "marker_status": "unverified",
-                "marker_ai_model": ""
-            })
+        # JSON first: a chunk flushed by append also flushes the JSON records of this batch
+        self.pr_json_writer.write(prediction_records(file_ids, preds, probs))
 
-        output_path_full = self.hparams.evaluate.replace('.ckpt', '_predict.npz') 
-        np.savez(output_path_full, preds=total_preds, feats=total_feats,
-                 logits=total_logits, file_ids=total_file_ids)  
-        print('Predict output saved to {}.'.format(output_path_full))
+        self.pr_writer.append(preds=preds,
+                              logits=logits.detach().cpu().numpy(),
+                              file_ids=file_ids,
+                              **self.output_feats(feats))
 
-        output_path_json = self.hparams.evaluate.replace('.ckpt', '_predict.json') 
-        json.dump(json_output, open(output_path_json, 'w'))
-        print('Predict output json saved to {}.'.format(output_path_json))
+        if self.pr_manifest is not None:
+            self.pr_unsaved.extend(file_ids)
+            if self.pr_writer.buffered_rows == 0:
+                # A chunk was just committed: record its files, so an interrupted run resumes after them
+                self.save_predict_manifest()
 
+    def save_predict_manifest(self):
+        """
+        Records the files of the committed prediction outputs in the predict manifest, in incremental mode.
+        """
+        if self.pr_manifest is not None:
+            self.pr_manifest.add(self.pr_unsaved)
+            self.pr_manifest.save()
+            self.pr_unsaved = []
+    
 
-    def eval_logging(self, preds, labels, print_class_acc=False):
+    def on_predict_epoch_end(self):
+        """
+        Hook function called at the end of the predict epoch. Finalizes the saved prediction outputs.
+
+        In sequence predict mode, the images that were not scored because their sequence was already decided
+        get the prediction of their sequence in the json output (the npz output only has the scored images).
+        """
+        inferred = []
+        if self.pr_tracker is not None:
+            inferred, preds, probs = self.pr_tracker.inferred()
+            self.pr_json_writer.write(prediction_records(inferred, preds, probs))
+            print(self.pr_tracker.summary())
+
+        # Commit the last chunk first, so the manifest has every file of the outputs once they are closed
+        self.pr_writer.flush()
+        self.save_predict_manifest()
+        self.pr_writer.close()
+        self.pr_json_writer.close()
+
+        if self.pr_manifest is not None:
+            # The files that only got the prediction of their sequence are in the json output alone, so they
+            # are recorded once it is closed
+            self.pr_unsaved.extend(inferred)
+            self.save_predict_manifest()
+            merge_predict_outputs(self.hparams.evaluate)
+            self.pr_manifest.compact()
+            print('Predict manifest saved to {}.'.format(self.pr_manifest.manifest_path))
+
+        print('Predict output saved to {}.'.format(self.hparams.evaluate.replace('.ckpt', '_predict.npz')))
+        print('Predict output json saved to {}.'.format(self.hparams.evaluate.replace('.ckpt', '_predict.json')))
+
+    def eval_logging(self, confusion, print_class_acc=False):
         """
         Logs evaluation metrics such as accuracy.
 
         Args:
-            preds: Predictions from the model.
-            labels: Ground truth labels.
+            confusion (ndarray): Confusion matrix of the evaluated dataset, rows are ground truth labels.
             print_class_acc (bool): Flag to print class-wise accuracy.
         """
-        class_acc, mac_acc, mic_acc = acc(preds, labels)
-        unique_eval_labels = np.unique(labels)
+        class_acc, mac_acc, mic_acc = acc_from_confusion(confusion)
+        unique_eval_labels = np.nonzero((confusion.sum(axis=0) + confusion.sum(axis=1)) > 0)[0]
 
         self.log("valid_mac_acc", mac_acc * 100)
         self.log("valid_mic_acc", mic_acc * 100)
@@ -0,0 +1,197 @@
+import math
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+def rgb_to_hsv(img):
+    """
+    Convert a batch of RGB images in [0, 1] to HSV.
+
+    Args:
+        img (Tensor): Images of shape (B, 3, H, W).
+
+    Returns:
+        Tensor: HSV images of shape (B, 3, H, W), all channels in [0, 1].
+    """
+    r, g, b = img.unbind(dim=1)
+    maxc = img.max(dim=1).values
+    minc = img.min(dim=1).values
+    eqc = maxc == minc
+    cr = maxc - minc
+    ones = torch.ones_like(maxc)
+    s = cr / torch.where(eqc, ones, maxc)
+    cr_divisor = torch.where(eqc, ones, cr)
+    rc = (maxc - r) / cr_divisor
+    gc = (maxc - g) / cr_divisor
+    bc = (maxc - b) / cr_divisor
+    hr = (maxc == r) * (bc - gc)
+    hg = ((maxc == g) & (maxc != r)) * (2.0 + rc - bc)
+    hb = ((maxc != g) & (maxc != r)) * (4.0 + gc - rc)
+    h = torch.fmod((hr + hg + hb) / 6.0 + 1.0, 1.0)
+    return torch.stack((h, s, maxc), dim=1)
+
+
+def hsv_to_rgb(img):
+    """
+    Convert a batch of HSV images in [0, 1] to RGB.
+
+    Args:
+        img (Tensor): Images of shape (B, 3, H, W).
+
+    Returns:
+        Tensor: RGB images of shape (B, 3, H, W) in [0, 1].
+    """
+    h, s, v = img.unbind(dim=1)
+    i = torch.floor(h * 6.0)
+    f = (h * 6.0) - i
+    i = i.to(dtype=torch.int32) % 6
+    p = torch.clamp(v * (1.0 - s), 0.0, 1.0)
+    q = torch.clamp(v * (1.0 - s * f), 0.0, 1.0)
+    t = torch.clamp(v * (1.0 - s * (1.0 - f)), 0.0, 1.0)
+    mask = i.unsqueeze(dim=1) == torch.arange(6, device=i.device).view(-1, 1, 1)
+    a1 = torch.stack((v, q, p, p, t, v), dim=1)
+    a2 = torch.stack((t, v, v, q, p, p), dim=1)
+    a3 = torch.stack((p, p, t, v, v, q), dim=1)
+    a4 = torch.stack((a1, a2, a3), dim=1)
+    return torch.einsum('...ijk, ...xijk -> ...xjk', mask.to(dtype=img.dtype), a4)
+
+
+def grayscale(img):
+    """
+    Luma of a batch of RGB images, with the same weights as torchvision.
+
+    Args:
+        img (Tensor): Images of shape (B, 3, H, W).
+
+    Returns:
+        Tensor: Grayscale images of shape (B, 1, H, W).
+    """
+    r, g, b = img.unbind(dim=1)
+    return (0.2989 * r + 0.587 * g + 0.114 * b).unsqueeze(dim=1)
+
+
+class BatchAugment(nn.Module):
+    """
+    Vectorized counterpart of data_transforms['train'] applied to whole uint8 batches.
+
+    Applies RandomResizedCrop, horizontal/vertical flips, ColorJitter and Normalize with independent random
+    parameters per sample. The crop and both flips are folded into a single affine resampling (grid_sample).
+    Unlike torchvision, the order of the color jitter operations is drawn once per batch and the crop
+    parameters are clamped instead of re-sampled when they fall outside the image.
+    """
+
+    def __init__(self, size=(224, 224), scale=(0.7, 1.0), ratio=(0.8, 1.2), hflip=0.5, vflip=0.5,
+                 brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2,
+                 mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225)):
+        """
+        Initialize the BatchAugment module with the same parameters as data_transforms['train'].
+
+        Args:
+            size (tuple): Output size (height, width).
+            scale (tuple): Range of the cropped area, relative to the input image.
+            ratio (tuple): Range of the aspect ratio of the crop.
+            hflip (float): Probability of a horizontal flip.
+            vflip (float): Probability of a vertical flip.
+            brightness (float): Brightness jitter.
+            contrast (float): Contrast jitter.
+            saturation (float): Saturation jitter.
+            hue (float): Hue jitter, in [0, 0.5].
+            mean (tuple): Normalization mean.
+            std (tuple): Normalization standard deviation.
+        """
+        super().__init__()
+        self.size = size
+        self.scale = scale
+        self.log_ratio = (math.log(ratio[0]), math.log(ratio[1]))
+        self.hflip = hflip
+        self.vflip = vflip
+        self.brightness = brightness
+        self.contrast = contrast
+        self.saturation = saturation
+        self.hue = hue
+        self.register_buffer('mean', torch.tensor(mean).view(1, 3, 1, 1), persistent=False)
+        self.register_buffer('std', torch.tensor(std).view(1, 3, 1, 1), persistent=False)
+
+    def extra_repr(self):
+        return 'size={}, scale={}, log_ratio={}, hflip={}, vflip={}, jitter=({}, {}, {}, {})'.format(
+            self.size, self.scale, self.log_ratio, self.hflip, self.vflip,
+            self.brightness, self.contrast, self.saturation, self.hue)
+
+    def _uniform(self, n, low, high, device):
+        return torch.empty(n, device=device).uniform_(low, high)
+
+    def resized_crop(self, x):
+        """
+        Random resized crop and flips of a batch through one affine resampling.
+
+        Args:
+            x (Tensor): Float images of shape (B, 3, H, W).
+
+        Returns:
+            Tensor: Images of shape (B, 3, *size).
+        """
+        n, device = x.shape[0], x.device
+        area = self._uniform(n, *self.scale, device)
+        ratio = torch.exp(self._uniform(n, *self.log_ratio, device))
+        # Crop width and height relative to the image, clamped to the image
+        w = torch.sqrt(area * ratio).clamp(max=1.0)
+        h = torch.sqrt(area / ratio).clamp(max=1.0)
+        cx = (torch.rand(n, device=device) * 2 - 1) * (1 - w)
+        cy = (torch.rand(n, device=device) * 2 - 1) * (1 - h)
+        sx = torch.where(torch.rand(n, device=device) < self.hflip, -w, w)
+        sy = torch.where(torch.rand(n, device=device) < self.vflip, -h, h)
+
+        theta = torch.zeros(n, 2, 3, device=device, dtype=x.dtype)
+        theta[:, 0, 0] = sx
+        theta[:, 0, 2] = cx
+        theta[:, 1, 1] = sy
+        theta[:, 1, 2] = cy
+        grid = F.affine_grid(theta, (n, 3) + tuple(self.size), align_corners=False)
+        return F.grid_sample(x, grid, mode='bilinear', padding_mode='border', align_corners=False)
+
+    def color_jitter(self, x):
+        """
+        Random brightness, contrast, saturation and hue of a batch, with one factor per sample.
+
+        Args:
+            x (Tensor): Float images in [0, 1] of shape (B, 3, H, W).
+
+        Returns:
+            Tensor: Jittered images in [0, 1].
+        """
+        n, device = x.shape[0], x.device
+        for op in torch.randperm(4).tolist():
+            if op == 0 and self.brightness > 0:
+                f = self._uniform(n, 1 - self.brightness, 1 + self.brightness, device).view(-1, 1, 1, 1)
+                x = (x * f).clamp(0, 1)
+            elif op == 1 and self.contrast > 0:
+                f = self._uniform(n, 1 - self.contrast, 1 + self.contrast, device).view(-1, 1, 1, 1)
+                m = grayscale(x).mean(dim=(1, 2, 3), keepdim=True)
+                x = (f * x + (1 - f) * m).clamp(0, 1)
+            elif op == 2 and self.saturation > 0:
+                f = self._uniform(n, 1 - self.saturation, 1 + self.saturation, device).view(-1, 1, 1, 1)
+                x = (f * x + (1 - f) * grayscale(x)).clamp(0, 1)
+            elif op == 3 and self.hue > 0:
+                f = self._uniform(n, -self.hue, self.hue, device).view(-1, 1, 1)
+                hsv = rgb_to_hsv(x)
+                hsv = torch.stack((torch.remainder(hsv[:, 0] + f, 1.0), hsv[:, 1], hsv[:, 2]), dim=1)
+                x = hsv_to_rgb(hsv)
+        return x
+
+    @torch.no_grad()
+    def forward(self, x):
+        """
+        Augment and normalize a batch.
+
+        Args:
+            x (Tensor): uint8 images of shape (B, 3, H, W).
+
+        Returns:
+            Tensor: Normalized float images of shape (B, 3, *size).
+        """
+        x = x.float().div_(255)
+        x = self.resized_crop(x)
+        x = self.color_jitter(x)
+        return (x - self.mean) / self.std
+
@@ -0,0 +1,203 @@
+# Datasets and transformations of the cropped images. Kept free of Lightning, so the lightweight predict
+# engine (predict_engine.py) can use them without importing the training stack.
+import os
+import numpy as np
+from PIL import Image
+from torchvision import transforms
+from torch.utils.data import Dataset
+
+from src.utils.annotations import annotation_file, read_annotations
+
+# Define the allowed image extensions  
+IMG_EXTENSIONS = (".jpg", ".jpeg", ".png", ".ppm", ".bmp", ".pgm", ".tif", ".tiff", ".webp")  
+  
+def has_file_allowed_extension(filename: str, extensions: tuple) -> bool:  
+    """Checks if a file is an allowed extension."""  
+    return filename.lower().endswith(extensions if isinstance(extensions, str) else tuple(extensions))
+  
+def is_image_file(filename: str) -> bool:  
+    """Checks if a file is an allowed image extension."""  
+    return has_file_allowed_extension(filename, IMG_EXTENSIONS) 
+
+def load_image(file_dir, draft_size=None):
+    """
+    Open and decode an image as RGB.
+
+    If draft_size is given, JPEG files are decoded directly at the smallest DCT scale (1/2, 1/4 or 1/8)
+    that is still at least draft_size, which is much faster and lighter than decoding the full resolution
+    image only to resize it afterwards. Other formats are decoded at full resolution.
+
+    Args:
+        file_dir (str): Path to the image.
+        draft_size (tuple, optional): Minimum (width, height) needed after decoding.
+
+    Returns:
+        PIL.Image: The decoded RGB image.
+    """
+    with open(file_dir, 'rb') as f:
+        sample = Image.open(f)
+        if draft_size is not None:
+            sample.draft('RGB', draft_size)
+        return sample.convert('RGB')
+
+# Define normalization mean and standard deviation for image preprocessing
+mean = [0.485, 0.456, 0.406]
+std = [0.229, 0.224, 0.225]
+
+# Define data transformations for training and validation datasets
+data_transforms = {
+    'train': transforms.Compose([
+        transforms.RandomResizedCrop((224, 224), scale=(0.7, 1.0), ratio=(0.8, 1.2)),
+        transforms.RandomHorizontalFlip(p=0.5),
+        transforms.RandomVerticalFlip(p=0.5),
+        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2),
+        transforms.ToTensor(),
+        transforms.Normalize(mean, std)
+    ]),
+    'val': transforms.Compose([
+        transforms.Resize((224, 224)),
+        transforms.ToTensor(),
+        transforms.Normalize(mean, std)
+    ]),
+}
+
+# Dataset-side transformations of the batched augmentation engine: the workers only resize and return
+# uint8 tensors, the augmentation itself is applied to whole batches by BatchAugment after the transfer
+batch_transforms = {
+    'train': transforms.Compose([
+        transforms.Resize((256, 256)),
+        transforms.PILToTensor()
+    ]),
+}
+
+class Custom_Base_DS(Dataset):
+    """
+    Base dataset class for handling custom datasets.
+
+    Attributes:
+        rootdir (str): Root directory containing the dataset.
+        transform (callable, optional): Transformations to be applied to each data sample.
+        predict (bool): Flag to indicate if the dataset is used for prediction.
+    """
+
+    def __init__(self, rootdir, transform=None, predict=False, draft_size=None, manifest=None):
+        """
+        Initialize the Custom_Base_DS with the directory, transformations, and mode.
+
+        Args:
+            rootdir (str): Directory containing the dataset.
+            transform (callable, optional): Transformations to be applied to each data sample.
+            predict (bool): Flag to indicate if the dataset is used for prediction.
+            draft_size (tuple, optional): Minimum (width, height) to decode JPEG files at (see load_image).
+            manifest (PredictManifest, optional): Record of the files already scored. If given, only new or
+                changed files are loaded in prediction mode.
+        """
+        self.rootdir = rootdir
+        self.transform = transform
+        self.predict = predict
+        self.draft_size = draft_size
+        self.manifest = manifest
+        self.data = []
+        self.label_ids = []
+        self.labels = []
+        self.seq_ids = []
+        self.shards = None
+
+    def load_data(self):
+        """
+        Load data from the specified directory. Differentiates between prediction and training/validation mode.
+        """
+        if self.predict:
+            # Load data for prediction
+            # self.data = glob(os.path.join(self.img_root,"*.{}".format(self.extension)))
+            self.data = [os.path.join(dp, f) for dp, dn, filenames in os.walk(self.img_root) for f in filenames if is_image_file(f)] # dp: directory path, dn: directory name, f: filename
+            if self.manifest is not None:
+                # Incremental prediction: skip the files already scored by this checkpoint
+                num_found = len(self.data)
+                self.data = self.manifest.pending(self.data)
+                print('Images already scored: ', num_found - len(self.data))
+        else:
+            # Load data for training/validation
+            self.data = list(self.ann['path'])
+            self.label_ids = list(self.ann['classification'])
+            self.labels = list(self.ann['label'])
+        print('Number of images loaded: ', len(self.data))
+
+    def class_counts_cal(self):
+        """
+        Calculate the count of each class in the dataset.
+
+        Returns:
+            tuple: Unique label IDs and their respective counts.
+        """
+        unique_label_ids, unique_counts = np.unique(self.label_ids, return_counts=True)
+        return unique_label_ids, unique_counts
+
+    def __len__(self):
+        """
+        Return the total number of items in the dataset.
+
+        Returns:
+            int: Total number of items.
+        """
+        return len(self.data)
+
+    def __getitem__(self, index):
+        """
+        Retrieve an item by its index.
+
+        Args:
+            index (int): Index of the item to be retrieved.
+
+        Returns:
+            tuple: Depending on the mode, returns different tuples containing the image and additional information.
+        """
+        file_id = self.data[index]
+        file_dir = os.path.join(self.img_root, file_id) if not self.predict else file_id
+
+        if self.shards is not None:
+            sample = Image.fromarray(self.shards[index])
+        else:
+            sample = load_image(file_dir, self.draft_size)
+
+        if self.transform is not None:
+            sample = self.transform(sample)
+
+        if self.predict:
+            return sample, file_id
+
+        label_id = self.label_ids[index]
+        label = self.labels[index]
+
+        return sample, label_id, label, file_dir
+
+
+class Custom_Crop_DS(Custom_Base_DS):
+    """
+    Dataset class for handling custom cropped datasets.
+
+    Inherits from Custom_Base_DS and includes specific handling for cropped data.
+    """
+
+    def __init__(self, rootdir, dset='train', transform=None, draft_size=None, manifest=None, annotation_format='csv'):
+        """
+        Initialize the Custom_Crop_DS with the dataset directory, type, and transformations.
+
+        Args:
+            rootdir (str): Directory containing the dataset.
+            dset (str): Type of dataset (train, val, test, predict).
+            transform (callable, optional): Transformations to be applied to each data sample.
+            draft_size (tuple, optional): Minimum (width, height) to decode JPEG files at (see load_image).
+            manifest (PredictManifest, optional): Record of the files already scored, for incremental prediction.
+            annotation_format (str): Format of the cropped annotation files, csv or parquet.
+        """
+        self.predict = dset == 'predict'
+        super().__init__(rootdir=rootdir, transform=transform, predict=self.predict, draft_size=draft_size,
+                         manifest=manifest)
+        self.img_root = rootdir if self.predict else os.path.join(self.rootdir, 'cropped_resized')
+        if not self.predict:
+            self.ann_path = annotation_file(os.path.join(self.rootdir, 'cropped_resized', '{}_annotations_cropped'
+                                                         .format('test' if dset == 'test' else dset)), annotation_format)
+            # Only the columns used by load_data are read
+            self.ann = read_annotations(self.ann_path, columns=['path', 'classification', 'label'])
+        self.load_data()
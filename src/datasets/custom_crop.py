@@ -4,161 +4,21 @@ from glob import glob
 import numpy as np
 import pandas as pd
 import torch
-from PIL import Image
-from torchvision import transforms
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import DataLoader, SequentialSampler
 import pytorch_lightning as pl
 
+from .crop_dataset import Custom_Base_DS, Custom_Crop_DS, batch_transforms, data_transforms, is_image_file, load_image
+from .feature_store import Custom_Feature_DS, build_feature_store, feature_cache_key, is_valid_store
+from .shard_store import ShardReader, pack_shards, shard_key
+from .batch_augment import BatchAugment
+from .sequence_sampler import SequenceBatchSampler, SequenceTracker
+from src.utils.predict_manifest import PredictManifest, recover_predict_outputs
+
 # Exportable class names for external use
 __all__ = [
     'Custom_Crop'
 ]
 
-# Define the allowed image extensions  
-IMG_EXTENSIONS = (".jpg", ".jpeg", ".png", ".ppm", ".bmp", ".pgm", ".tif", ".tiff", ".webp")  
-  
-def has_file_allowed_extension(filename: str, extensions: tuple) -> bool:  
-    """Checks if a file is an allowed extension."""  
-    return filename.lower().endswith(extensions if isinstance(extensions, str) else tuple(extensions))
-  
-def is_image_file(filename: str) -> bool:  
-    """Checks if a file is an allowed image extension."""  
-    return has_file_allowed_extension(filename, IMG_EXTENSIONS) 
-
-# Define normalization mean and standard deviation for image preprocessing
-mean = [0.485, 0.456, 0.406]
-std = [0.229, 0.224, 0.225]
-
-# Define data transformations for training and validation datasets
-data_transforms = {
-    'train': transforms.Compose([
-        transforms.RandomResizedCrop((224, 224), scale=(0.7, 1.0), ratio=(0.8, 1.2)),
-        transforms.RandomHorizontalFlip(p=0.5),
-        transforms.RandomVerticalFlip(p=0.5),
-        transforms.ColorJitter(brightness=0.2, contrast=0.2, saturation=0.2, hue=0.2),
-        transforms.ToTensor(),
-        transforms.Normalize(mean, std)
-    ]),
-    'val': transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean, std)
-    ]),
-}
-
-class Custom_Base_DS(Dataset):
-    """
-    Base dataset class for handling custom datasets.
-
-    Attributes:
-        rootdir (str): Root directory containing the dataset.
-        transform (callable, optional): Transformations to be applied to each data sample.
-        predict (bool): Flag to indicate if the dataset is used for prediction.
-    """
-
-    def __init__(self, rootdir, transform=None, predict=False):
-        """
-        Initialize the Custom_Base_DS with the directory, transformations, and mode.
-
-        Args:
-            rootdir (str): Directory containing the dataset.
-            transform (callable, optional): Transformations to be applied to each data sample.
-            predict (bool): Flag to indicate if the dataset is used for prediction.
-        """
-        self.rootdir = rootdir
-        self.transform = transform
-        self.predict = predict
-        self.data = []
-        self.label_ids = []
-        self.labels = []
-        self.seq_ids = []
-
-    def load_data(self):
-        """
-        Load data from the specified directory. Differentiates between prediction and training/validation mode.
-        """
-        if self.predict:
-            # Load data for prediction
-            # self.data = glob(os.path.join(self.img_root,"*.{}".format(self.extension)))
-            self.data = [os.path.join(dp, f) for dp, dn, filenames in os.walk(self.img_root) for f in filenames if is_image_file(f)] # dp: directory path, dn: directory name, f: filename
-        else:
-            # Load data for training/validation
-            self.data = list(self.ann['path'])
-            self.label_ids = list(self.ann['classification'])
-            self.labels = list(self.ann['label'])
-        print('Number of images loaded: ', len(self.data))
-
-    def class_counts_cal(self):
-        """
-        Calculate the count of each class in the dataset.
-
-        Returns:
-            tuple: Unique label IDs and their respective counts.
-        """
-        unique_label_ids, unique_counts = np.unique(self.label_ids, return_counts=True)
-        return unique_label_ids, unique_counts
-
-    def __len__(self):
-        """
-        Return the total number of items in the dataset.
-
-        Returns:
-            int: Total number of items.
-        """
-        return len(self.data)
-
-    def __getitem__(self, index):
-        """
-        Retrieve an item by its index.
-
-        Args:
-            index (int): Index of the item to be retrieved.
-
-        Returns:
-            tuple: Depending on the mode, returns different tuples containing the image and additional information.
-        """
-        file_id = self.data[index]
-        file_dir = os.path.join(self.img_root, file_id) if not self.predict else file_id
-
-        with open(file_dir, 'rb') as f:
-            sample = Image.open(f).convert('RGB')
-
-        if self.transform is not None:
-            sample = self.transform(sample)
-
-        if self.predict:
-            return sample, file_id
-
-        label_id = self.label_ids[index]
-        label = self.labels[index]
-
-        return sample, label_id, label, file_dir
-
-
-class Custom_Crop_DS(Custom_Base_DS):
-    """
-    Dataset class for handling custom cropped datasets.
-
-    Inherits from Custom_Base_DS and includes specific handling for cropped data.
-    """
-
-    def __init__(self, rootdir, dset='train', transform=None):
-        """
-        Initialize the Custom_Crop_DS with the dataset directory, type, and transformations.
-
-        Args:
-            rootdir (str): Directory containing the dataset.
-            dset (str): Type of dataset (train, val, test, predict).
-            transform (callable, optional): Transformations to be applied to each data sample.
-        """
-        self.predict = dset == 'predict'
-        super().__init__(rootdir=rootdir, transform=transform, predict=self.predict)
-        self.img_root = rootdir if self.predict else os.path.join(self.rootdir, 'cropped_resized')
-        if not self.predict:
-            self.ann = pd.read_csv(os.path.join(self.rootdir, 'cropped_resized', '{}_annotations_cropped.csv'
-                                                .format('test' if dset == 'test' else dset)))
-        self.load_data()
-
 
 class Custom_Base(pl.LightningDataModule):
     """
@@ -180,19 +40,44 @@ class Custom_Base(pl.LightningDataModule):
         self._log_hyperparams = True
         self.id_to_labels = None # We don't need this for evaluations. We should save this in model weights in the future
         self.train_class_counts = None
+        self.sequence_tracker = None
+        self.predict_manifest = None
 
         self.conf = conf
 
+        # Augmentation engine for the training split: per-sample PIL transforms or batched tensor transforms
+        self.batch_augment = None
+        train_transform = data_transforms['train']
+        if self.conf.get('augment_engine', 'pil') == 'batch':
+            self.batch_augment = BatchAugment()
+            train_transform = batch_transforms['train']
+
+        # Format of the cropped annotation files of the annotated splits
+        annotation_format = self.conf.get('annotation_format', 'csv')
+
+        # Reduced-resolution JPEG decoding for the splits that are only resized to 224
+        draft_size = (224, 224) if self.conf.get('draft_decode', True) else None
+
         print('Loading datasets...')
         # Load datasets for different modes (training, validation, testing, prediction)
         if self.conf.predict:
-            self.dset_pr = self.ds(rootdir=self.conf.predict_root, dset='predict', transform=data_transforms['val'])
+            if self.conf.get('incremental', False):
+                # Shared with Plain, which records the scored files as their outputs are committed
+                self.predict_manifest = PredictManifest(self.conf.evaluate.replace('.ckpt', '_predict_manifest.csv'),
+                                                        self.conf.evaluate)
+                # The outputs of an interrupted run are kept and its committed files are not scored again
+                recover_predict_outputs(self.predict_manifest, self.conf.evaluate)
+            self.dset_pr = self.ds(rootdir=self.conf.predict_root, dset='predict', transform=data_transforms['val'],
+                                   draft_size=draft_size, manifest=self.predict_manifest)
         elif self.conf.test:
-            self.dset_te = self.ds(rootdir=self.conf.dataset_root, dset='test', transform=data_transforms['val'])
+            self.dset_te = self.ds(rootdir=self.conf.dataset_root, dset='test', transform=data_transforms['val'], draft_size=draft_size,
+                                   annotation_format=annotation_format)
             self.id_to_labels = {i: l for i, l in np.unique(pd.Series(zip(self.dset_te.label_ids, self.dset_te.labels)))}
         else:
-            self.dset_tr = self.ds(rootdir=self.conf.dataset_root, dset='train', transform=data_transforms['train'])
-            self.dset_val = self.ds(rootdir=self.conf.dataset_root, dset='val', transform=data_transforms['val'])
+            self.dset_tr = self.ds(rootdir=self.conf.dataset_root, dset='train', transform=train_transform,
+                                   annotation_format=annotation_format)
+            self.dset_val = self.ds(rootdir=self.conf.dataset_root, dset='val', transform=data_transforms['val'], draft_size=draft_size,
+                                    annotation_format=annotation_format)
 
             self.id_to_labels = {i: l for i, l in np.unique(pd.Series(zip(self.dset_tr.label_ids, self.dset_tr.labels)))}
             # Calculate class counts and label mappings
@@ -200,6 +85,85 @@ class Custom_Base(pl.LightningDataModule):
 
         print('Datasets loaded.')
 
+    def feature_dataset(self, dset, split, views=1):
+        """
+        Wrap a dataset with its cached backbone features, extracting them first if the cache is missing or stale.
+
+        The cache is keyed by the backbone weights, the dataset transformations and the annotation file, so
+        changing any of them triggers a new extraction.
+
+        Args:
+            dset (Custom_Base_DS): Dataset to be cached.
+            split (str): Name of the split, used for the cache directory.
+            views (int): Number of (augmented) views extracted per crop.
+
+        Returns:
+            Custom_Feature_DS: Dataset serving the cached features.
+        """
+        feature = self.trainer.lightning_module.net.feature
+        cache_dir = self.conf.get('feature_cache_dir') or os.path.join(self.conf.dataset_root, 'feature_cache')
+        store_dir = os.path.join(cache_dir, split)
+        preprocess = None
+        if split == 'train' and self.batch_augment is not None:
+            preprocess = self.batch_augment.to(self.trainer.lightning_module.device)
+        key = feature_cache_key(feature, [dset.transform, dset.draft_size, preprocess], dset.ann_path, views)
+
+        if self.trainer.global_rank == 0 and not is_valid_store(store_dir, key):
+            print('Building feature cache for the {} split in {}...'.format(split, store_dir))
+            build_feature_store(feature, dset, store_dir, key, views=views, preprocess=preprocess,
+                                batch_size=self.conf.batch_size, num_workers=self.conf.num_workers)
+        self.trainer.strategy.barrier()
+
+        return Custom_Feature_DS(store_dir, dset)
+
+    def shard_dataset(self, dset, split, size):
+        """
+        Serve a dataset from its pre-decoded uint8 shards, packing them first if they are missing or stale.
+
+        Only rank 0 packs; the other ranks wait at the barrier and then open the same shards.
+
+        Args:
+            dset (Custom_Base_DS): Dataset of an annotated split.
+            split (str): Name of the split, used for the shard directory.
+            size (int): Side of the stored images.
+
+        Returns:
+            Custom_Base_DS: The same dataset, reading its images from the shards.
+        """
+        if dset.shards is not None:
+            return dset
+        shard_root = self.conf.get('shard_root') or os.path.join(self.conf.dataset_root, 'shards')
+        shard_dir = os.path.join(shard_root, split)
+        file_dirs = [os.path.join(dset.img_root, f) for f in dset.data]
+        # Same decoding as the dataset: full resolution for train, reduced DCT scale for val/test
+        draft = dset.draft_size is not None
+
+        if self.trainer is None or self.trainer.global_rank == 0:
+            key = shard_key(dset.ann_path, file_dirs, size, draft)
+            if not is_valid_store(shard_dir, key):
+                print('Packing {} images into shards in {}...'.format(len(file_dirs), shard_dir))
+                pack_shards(file_dirs, shard_dir, key, size=size, num_workers=max(self.conf.num_workers, 1), draft=draft)
+        if self.trainer is not None:
+            self.trainer.strategy.barrier()
+
+        dset.shards = ShardReader(shard_dir)
+        return dset
+
+    def on_after_batch_transfer(self, batch, dataloader_idx):
+        """
+        Apply the batched augmentation engine to the uint8 training batches once they are on the device.
+
+        Args:
+            batch: The current batch of data.
+            dataloader_idx (int): Index of the dataloader.
+
+        Returns:
+            The batch with augmented and normalized images.
+        """
+        if self.batch_augment is not None and self.trainer.training and batch[0].dtype == torch.uint8:
+            batch[0] = self.batch_augment.to(batch[0].device)(batch[0])
+        return batch
+
     def train_dataloader(self):
         """
         Create a DataLoader for the training dataset.
@@ -207,7 +171,12 @@ class Custom_Base(pl.LightningDataModule):
         Returns:
             DataLoader: DataLoader for the training dataset.
         """
-        return DataLoader(self.dset_tr, batch_size=self.conf.batch_size, shuffle=True, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
+        dset_tr = self.dset_tr
+        if self.conf.get('use_shards', False):
+            dset_tr = self.shard_dataset(dset_tr, 'train', self.conf.get('shard_size', 256))
+        if self.conf.get('feature_cache', False):
+            dset_tr = self.feature_dataset(dset_tr, 'train', views=self.conf.get('feature_cache_views', 1))
+        return DataLoader(dset_tr, batch_size=self.conf.batch_size, shuffle=True, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
 
     def val_dataloader(self):
         """
@@ -216,7 +185,13 @@ class Custom_Base(pl.LightningDataModule):
         Returns:
             DataLoader: DataLoader for the validation dataset.
         """
-        return DataLoader(self.dset_val, batch_size=self.conf.batch_size, shuffle=False, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
+        dset_val = self.dset_val
+        if self.conf.get('use_shards', False):
+            # Stored at the final 224 resolution, so the val transform does not resize them again
+            dset_val = self.shard_dataset(dset_val, 'val', 224)
+        if self.conf.get('feature_cache', False) and self.trainer is not None and self.trainer.state.fn == 'fit':
+            dset_val = self.feature_dataset(dset_val, 'val')
+        return DataLoader(dset_val, batch_size=self.conf.batch_size, shuffle=False, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
 
     def test_dataloader(self):
         """
@@ -225,15 +200,29 @@ class Custom_Base(pl.LightningDataModule):
         Returns:
             DataLoader: DataLoader for the testing dataset.
         """
-        return DataLoader(self.dset_te, batch_size=256, shuffle=False, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
+        dset_te = self.dset_te
+        if self.conf.get('use_shards', False):
+            dset_te = self.shard_dataset(dset_te, 'test', 224)
+        return DataLoader(dset_te, batch_size=256, shuffle=False, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
 
     def predict_dataloader(self):
         """
         Create a DataLoader for the prediction dataset.
 
+        In sequence predict mode, the images are grouped into sequences (same folder, close timestamps) and
+        scored in order; the sequences already decided by Plain.predict_step are not sampled anymore.
+
         Returns:
             DataLoader: DataLoader for the prediction dataset.
         """
+        if self.conf.get('sequence_predict', False):
+            self.sequence_tracker = SequenceTracker(self.dset_pr.data, self.conf.num_classes,
+                                                    confidence=self.conf.get('sequence_confidence', 0.95),
+                                                    min_frames=self.conf.get('sequence_min_frames', 2),
+                                                    gap=self.conf.get('sequence_gap', 30))
+            batch_sampler = SequenceBatchSampler(SequentialSampler(self.dset_pr), batch_size=64, tracker=self.sequence_tracker,
+                                                 num_workers=self.conf.num_workers)
+            return DataLoader(self.dset_pr, batch_sampler=batch_sampler, pin_memory=True, num_workers=self.conf.num_workers)
         return DataLoader(self.dset_pr, batch_size=64, shuffle=False, pin_memory=True, num_workers=self.conf.num_workers, drop_last=False)
 
 
@@ -0,0 +1,174 @@
+import os
+import json
+import hashlib
+import numpy as np
+import torch
+from torch.utils.data import Dataset, DataLoader
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Compute the sha1 digest of a file's content.
+
+    Args:
+        path (str): Path to the file.
+        chunk_size (int): Number of bytes read per iteration.
+
+    Returns:
+        str: Hex digest of the file content.
+    """
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def module_digest(module):
+    """
+    Compute a digest of the weights of a module, so any change of checkpoint invalidates the cache.
+
+    Args:
+        module (nn.Module): Module whose state dict is hashed.
+
+    Returns:
+        str: Hex digest of the module weights.
+    """
+    h = hashlib.sha1()
+    for k, v in module.state_dict().items():
+        h.update(k.encode())
+        h.update(v.detach().cpu().contiguous().numpy().tobytes())
+    return h.hexdigest()
+
+
+def feature_cache_key(feature, transform, ann_path, views):
+    """
+    Build the key that identifies a feature store.
+
+    Args:
+        feature (nn.Module): Backbone used for the extraction.
+        transform (callable): Transformations applied to each crop before the backbone.
+        ann_path (str): Path to the annotation file of the split.
+        views (int): Number of views stored per crop.
+
+    Returns:
+        str: Hex digest combining the backbone weights, the transform and the annotation file.
+    """
+    h = hashlib.sha1()
+    h.update(module_digest(feature).encode())
+    h.update(repr(transform).encode())
+    h.update(file_digest(ann_path).encode())
+    h.update(str(views).encode())
+    return h.hexdigest()
+
+
+@torch.no_grad()
+def build_feature_store(feature, dataset, store_dir, key, views=1, preprocess=None, batch_size=256, num_workers=4):
+    """
+    Extract the backbone features of a dataset into a memory-mapped store.
+
+    The features are written to ``feats.npy`` with shape (views, N, D). When ``views`` is larger than one,
+    every view is a different random draw of the dataset transformations (e.g. data augmentation).
+    The metadata file is written last, so an interrupted extraction is never mistaken for a valid store.
+
+    Args:
+        feature (nn.Module): Backbone used for the extraction.
+        dataset (Custom_Base_DS): Dataset returning (image, label_id, label, file_dir).
+        store_dir (str): Directory where the store is written.
+        key (str): Cache key saved in the metadata of the store.
+        views (int): Number of views extracted per crop.
+        preprocess (callable, optional): Batched transformation applied on the device before the backbone.
+        batch_size (int): Batch size used for the extraction.
+        num_workers (int): Number of workers of the extraction DataLoader.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    meta_path = os.path.join(store_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    device = next(feature.parameters()).device
+    was_training = feature.training
+    feature.eval()
+
+    loader = DataLoader(dataset, batch_size=batch_size, shuffle=False, pin_memory=True,
+                        num_workers=num_workers, drop_last=False)
+    feats = None
+    for v in range(views):
+        print('Extracting features, view {}/{}...'.format(v + 1, views))
+        start = 0
+        for batch in loader:
+            data = batch[0].to(device, non_blocking=True)
+            if preprocess is not None:
+                data = preprocess(data)
+            out = feature(data).float().cpu().numpy()
+            if feats is None:
+                feats = np.lib.format.open_memmap(os.path.join(store_dir, 'feats.npy'), mode='w+',
+                                                  dtype=np.float32, shape=(views, len(dataset), out.shape[1]))
+            feats[v, start:start + len(out)] = out
+            start += len(out)
+    if feats is None:
+        # Empty split: no batch gives the feature size, and the store is never indexed
+        np.save(os.path.join(store_dir, 'feats.npy'), np.zeros((views, 0, 0), dtype=np.float32))
+    else:
+        feats.flush()
+        del feats
+
+    np.save(os.path.join(store_dir, 'label_ids.npy'), np.asarray(dataset.label_ids))
+    with open(meta_path, 'w') as f:
+        json.dump({'key': key, 'views': views, 'num_samples': len(dataset)}, f)
+
+    feature.train(was_training)
+
+
+def is_valid_store(store_dir, key):
+    """
+    Check whether a feature store exists and was built with the given key.
+
+    Args:
+        store_dir (str): Directory of the store.
+        key (str): Expected cache key.
+
+    Returns:
+        bool: True if the store can be reused.
+    """
+    meta_path = os.path.join(store_dir, 'meta.json')
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path) as f:
+        return json.load(f)['key'] == key
+
+
+class Custom_Feature_DS(Dataset):
+    """
+    Dataset serving pre-extracted backbone features from a memory-mapped feature store.
+
+    Returns the same tuple layout as Custom_Base_DS, with the feature vector in place of the image, so
+    the learner only needs to skip the backbone. If the store holds several views per crop, a random view
+    is drawn at every access.
+    """
+
+    def __init__(self, store_dir, dataset):
+        """
+        Initialize the Custom_Feature_DS.
+
+        Args:
+            store_dir (str): Directory of the feature store.
+            dataset (Custom_Base_DS): Dataset the store was extracted from, used for labels and file names.
+        """
+        self.store_dir = store_dir
+        self.label_ids = dataset.label_ids
+        self.labels = dataset.labels
+        self.data = dataset.data
+        self.img_root = dataset.img_root
+        self.feats = None
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, index):
+        # Open the memory map lazily so every DataLoader worker gets its own handle
+        if self.feats is None:
+            self.feats = np.load(os.path.join(self.store_dir, 'feats.npy'), mmap_mode='r')
+        view = np.random.randint(self.feats.shape[0])
+        sample = torch.from_numpy(np.array(self.feats[view, index]))
+        return sample, self.label_ids[index], self.labels[index], os.path.join(self.img_root, self.data[index])
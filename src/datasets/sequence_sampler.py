@@ -0,0 +1,143 @@
+from collections import deque
+import numpy as np
+from torch.utils.data import BatchSampler
+
+from src.utils.motion_filter import group_sequences
+
+
+class SequenceTracker:
+    """
+    Aggregated predictions of the sequences (bursts) of a prediction dataset, fed back from Plain.predict_step.
+
+    A sequence is decided once at least min_frames of its frames have been scored and the largest class of its
+    mean softmax reaches confidence; its remaining frames are then no longer scored and inherit the sequence
+    prediction.
+    """
+
+    def __init__(self, file_ids, num_classes, confidence=0.95, min_frames=2, gap=30):
+        """
+        Initialize the SequenceTracker.
+
+        Args:
+            file_ids (list): Paths to the images of the prediction dataset, in dataset order.
+            num_classes (int): Number of classes of the classifier.
+            confidence (float): Mean confidence at which a sequence is decided.
+            min_frames (int): Minimum number of scored frames before a sequence can be decided.
+            gap (float): Maximum time in seconds between consecutive frames of a sequence.
+        """
+        index_of = {f: i for i, f in enumerate(file_ids)}
+        self.file_ids = list(file_ids)
+        self.sequences = [[index_of[f] for f in seq] for seq in group_sequences(self.file_ids, gap)]
+        self.seq_of = {f: s for s, seq in enumerate(self.sequences) for f in (self.file_ids[i] for i in seq)}
+        self.confidence = confidence
+        self.min_frames = min_frames
+        self.prob_sums = np.zeros((len(self.sequences), num_classes))
+        self.counts = np.zeros(len(self.sequences), dtype=np.int64)
+        self.decided = np.zeros(len(self.sequences), dtype=bool)
+        self.scored = set()
+
+    def update(self, file_ids, probs):
+        """
+        Add the softmax outputs of a predicted batch to their sequences.
+
+        Args:
+            file_ids (list): Paths to the predicted images.
+            probs (np.ndarray): Softmax probabilities of shape (B, num_classes).
+        """
+        seqs = np.array([self.seq_of[f] for f in file_ids], dtype=np.int64)
+        np.add.at(self.prob_sums, seqs, probs)
+        np.add.at(self.counts, seqs, 1)
+        self.scored.update(file_ids)
+        seqs = np.unique(seqs)
+        mean_conf = self.prob_sums[seqs].max(axis=1) / self.counts[seqs]
+        self.decided[seqs] |= (self.counts[seqs] >= self.min_frames) & (mean_conf >= self.confidence)
+
+    def inferred(self):
+        """
+        Predictions of the frames that were skipped because their sequence was already decided.
+
+        Frames of undecided sequences that were not scored (e.g. the epoch ended early) are left out, so they
+        stay pending for the next run.
+
+        Returns:
+            tuple: File ids, predicted classes and confidences (mean softmax of the scored frames of the sequence).
+        """
+        file_ids = [f for f in self.file_ids if f not in self.scored and self.decided[self.seq_of[f]]]
+        seqs = np.array([self.seq_of[f] for f in file_ids], dtype=np.int64)
+        means = self.prob_sums[seqs] / self.counts[seqs][:, None]
+        return file_ids, means.argmax(axis=1), means.max(axis=1)
+
+    def summary(self):
+        lengths = np.array([len(seq) for seq in self.sequences], dtype=np.int64)
+        inferred = int((lengths - self.counts)[self.decided].sum())
+        return 'Sequence predict: {} sequences, {} of {} images scored ({} inferred from their sequence).'.format(
+            len(self.sequences), len(self.scored), len(self.file_ids), inferred)
+
+
+class SequenceBatchSampler(BatchSampler):
+    """
+    Batch sampler that scores the frames of each sequence in order and stops yielding frames of the sequences
+    the SequenceTracker has already decided.
+
+    Frames are taken round-robin over a window of active sequences, so consecutive frames of a sequence are
+    window / batch_size batches apart. The window is sized so that, despite the batches prefetched by the
+    DataLoader workers, the feedback of a frame usually arrives before the next frame of its sequence is sampled.
+
+    It follows the BatchSampler signature so Lightning can re-instantiate it when it wraps the predict dataloader.
+    The tracker lives in a single process, so it only supports prediction on one device.
+    """
+
+    def __init__(self, sampler, batch_size, drop_last=False, tracker=None, num_workers=0, prefetch_factor=2):
+        """
+        Initialize the SequenceBatchSampler.
+
+        Args:
+            sampler (Sampler): Sampler of the dataset. Only kept for the BatchSampler API, the order of the frames
+                comes from the sequences of the tracker. A distributed sampler over several replicas is rejected.
+            batch_size (int): Number of images per batch.
+            drop_last (bool): Kept for the BatchSampler API, the last incomplete batch is always yielded.
+            tracker (SequenceTracker): Tracker of the prediction dataset.
+            num_workers (int): Number of DataLoader workers.
+            prefetch_factor (int): Batches prefetched by each worker.
+        """
+        if tracker is None:
+            raise ValueError('SequenceBatchSampler needs the SequenceTracker of the prediction dataset.')
+        if getattr(sampler, 'num_replicas', 1) > 1:
+            # Otherwise every rank would score the whole predict set and write duplicate outputs
+            raise ValueError('Sequence predict mode runs on a single device, but the predict dataloader is distributed '
+                             'over {} processes. Predict with one device or disable sequence_predict.'
+                             .format(sampler.num_replicas))
+        super().__init__(sampler, batch_size, False)
+        self.tracker = tracker
+        self.window = batch_size * (num_workers * prefetch_factor + 2)
+
+    def __len__(self):
+        # Upper bound: decided sequences yield fewer batches
+        return (len(self.tracker.file_ids) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        sequences = self.tracker.sequences
+        next_seq = iter(range(len(sequences)))
+        positions = np.zeros(len(sequences), dtype=np.int64)
+        active = deque()
+        batch = []
+        while True:
+            while len(active) < self.window:
+                seq = next(next_seq, None)
+                if seq is None:
+                    break
+                active.append(seq)
+            if not active:
+                break
+            seq = active.popleft()
+            if self.tracker.decided[seq]:
+                continue
+            batch.append(sequences[seq][positions[seq]])
+            positions[seq] += 1
+            if positions[seq] < len(sequences[seq]):
+                active.append(seq)
+            if len(batch) == self.batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
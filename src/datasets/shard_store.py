@@ -0,0 +1,122 @@
+import os
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+from .feature_store import file_digest
+
+# Resampling filter used when packing (part of the shard key)
+RESAMPLE = Image.BILINEAR
+
+
+def decode_resized(file_dir, size, draft=True):
+    """
+    Decode an image and resize it to a fixed square size.
+
+    Args:
+        file_dir (str): Path to the image.
+        size (int): Side of the resized image.
+        draft (bool): Decode JPEG files at the smallest DCT scale that still covers the size (see load_image).
+
+    Returns:
+        np.ndarray: uint8 array of shape (size, size, 3).
+    """
+    with open(file_dir, 'rb') as f:
+        sample = Image.open(f)
+        if draft:
+            sample.draft('RGB', (size, size))
+        sample = sample.convert('RGB')
+    return np.asarray(sample.resize((size, size), RESAMPLE), dtype=np.uint8)
+
+
+def pack_shards(file_dirs, shard_dir, key, size=256, shard_len=4096, num_workers=8, draft=True):
+    """
+    Pack a list of images into fixed-size uint8 shards.
+
+    Sample ``i`` is stored at position ``i % shard_len`` of ``shard_{i // shard_len:05d}.npy``. The metadata
+    file is written last, so an interrupted packing is never mistaken for a valid store.
+
+    Args:
+        file_dirs (list): Paths to the images, in dataset order.
+        shard_dir (str): Directory where the shards are written.
+        key (str): Key saved in the metadata of the store.
+        size (int): Side of the stored images.
+        shard_len (int): Number of images per shard.
+        num_workers (int): Number of decoding threads.
+        draft (bool): Decode JPEG files at reduced DCT scale.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    meta_path = os.path.join(shard_dir, 'meta.json')
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        for s, start in enumerate(range(0, len(file_dirs), shard_len)):
+            chunk = file_dirs[start:start + shard_len]
+            shard = np.lib.format.open_memmap(os.path.join(shard_dir, 'shard_{:05d}.npy'.format(s)), mode='w+',
+                                              dtype=np.uint8, shape=(len(chunk), size, size, 3))
+            for i, img in enumerate(pool.map(lambda p: decode_resized(p, size, draft), chunk)):
+                shard[i] = img
+            shard.flush()
+            del shard
+            print('Packed {}/{} images.'.format(start + len(chunk), len(file_dirs)))
+
+    with open(meta_path, 'w') as f:
+        json.dump({'key': key, 'size': size, 'shard_len': shard_len, 'num_samples': len(file_dirs)}, f)
+
+
+class ShardReader:
+    """
+    Zero-copy reader of the images packed by pack_shards.
+
+    The shards are memory-mapped lazily, so every DataLoader worker opens its own handles.
+    """
+
+    def __init__(self, shard_dir):
+        """
+        Initialize the ShardReader.
+
+        Args:
+            shard_dir (str): Directory containing the shards and their metadata.
+        """
+        self.shard_dir = shard_dir
+        with open(os.path.join(shard_dir, 'meta.json')) as f:
+            meta = json.load(f)
+        self.size = meta['size']
+        self.shard_len = meta['shard_len']
+        self.num_samples = meta['num_samples']
+        self.shards = {}
+
+    def __len__(self):
+        return self.num_samples
+
+    def __getitem__(self, index):
+        s, i = divmod(index, self.shard_len)
+        if s not in self.shards:
+            self.shards[s] = np.load(os.path.join(self.shard_dir, 'shard_{:05d}.npy'.format(s)), mmap_mode='r')
+        return self.shards[s][i]
+
+
+def shard_key(ann_path, file_dirs, size, draft=True):
+    """
+    Build the key that identifies the shards of a split.
+
+    Args:
+        ann_path (str): Path to the annotation file of the split.
+        file_dirs (list): Paths to the images, in dataset order.
+        size (int): Side of the stored images.
+        draft (bool): Whether JPEG files are decoded at reduced DCT scale.
+
+    Returns:
+        str: Hex digest combining the annotation file content, the decode settings and the size and modification
+            time of every image, so replaced images or a new decoding mode trigger a repack.
+    """
+    h = hashlib.sha1()
+    h.update(file_digest(ann_path).encode())
+    h.update('{}-{}-{}'.format(size, 'draft' if draft else 'full', int(RESAMPLE)).encode())
+    for file_dir in file_dirs:
+        st = os.stat(file_dir)
+        h.update('{}:{}:{}\n'.format(file_dir, st.st_size, st.st_mtime_ns).encode())
+    return h.hexdigest()
@@ -0,0 +1,85 @@
+import torch
+import torch.nn as nn
+
+from .plain_resnet import PlainResNetClassifier
+
+
+class InferenceWrapper(nn.Module):
+    """
+    Inference graph of a PlainResNetClassifier: images in, (feats, logits) out.
+    """
+
+    def __init__(self, net):
+        """
+        Initialize the InferenceWrapper.
+
+        Args:
+            net (PlainResNetClassifier): Trained classifier.
+        """
+        super(InferenceWrapper, self).__init__()
+        self.feature = net.feature
+        self.classifier = net.classifier
+
+    def forward(self, x):
+        """
+        Forward pass of the inference graph.
+
+        Args:
+            x (torch.Tensor): Normalized images of shape (B, 3, 224, 224).
+
+        Returns:
+            tuple: Backbone features (B, D) and logits (B, num_classes).
+        """
+        feats = self.feature(x)
+        return feats, self.classifier(feats)
+
+
+def load_classifier(ckpt_path):
+    """
+    Build a PlainResNetClassifier from a Lightning checkpoint of the Plain learner, without Lightning.
+
+    Args:
+        ckpt_path (str): Path to the checkpoint.
+
+    Returns:
+        PlainResNetClassifier: Classifier with the trained feature extractor and head, in eval mode.
+    """
+    # Lightning checkpoints pickle their hyper-parameters (e.g. numpy scalars), which the weights-only loader
+    # rejects: only load trusted checkpoints
+    ckpt = torch.load(ckpt_path, map_location='cpu', weights_only=False)
+    hparams = ckpt['hyper_parameters']
+    net = PlainResNetClassifier(num_cls=hparams['num_classes'], num_layers=hparams['num_layers'])
+    net.load_state_dict({k[len('net.'):]: v for k, v in ckpt['state_dict'].items() if k.startswith('net.')})
+    return net.eval()
+
+
+def export_model(ckpt_path, output_path, fmt='onnx', opset=17):
+    """
+    Export a trained checkpoint (feature + classifier) into a single inference graph.
+
+    Args:
+        ckpt_path (str): Path to the Lightning checkpoint.
+        output_path (str): Path to the exported model (.onnx or .pt).
+        fmt (str): Export format, onnx or torchscript.
+        opset (int): ONNX opset version.
+
+    Returns:
+        str: Path to the exported model.
+    """
+    model = InferenceWrapper(load_classifier(ckpt_path)).eval()
+    dummy = torch.randn(1, 3, 224, 224)
+
+    if fmt == 'onnx':
+        torch.onnx.export(model, dummy, output_path, input_names=['images'], output_names=['feats', 'logits'],
+                          dynamic_axes={'images': {0: 'batch'}, 'feats': {0: 'batch'}, 'logits': {0: 'batch'}},
+                          opset_version=opset, do_constant_folding=True)
+    elif fmt == 'torchscript':
+        with torch.no_grad():
+            # Freezing folds the BatchNorm layers into the convolutions
+            traced = torch.jit.optimize_for_inference(torch.jit.freeze(torch.jit.trace(model, dummy)))
+        traced.save(output_path)
+    else:
+        raise ValueError('Invalid export format: {}. Available options: onnx, torchscript.'.format(fmt))
+
+    print('Model exported to {}.'.format(output_path))
+    return output_path
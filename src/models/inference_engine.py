@@ -0,0 +1,65 @@
+import numpy as np
+import torch
+
+
+class InferenceEngine:
+    """
+    Lightweight CPU inference engine for the models exported by export_model.
+
+    ONNX models (.onnx) run with ONNX Runtime, any other file is loaded as a TorchScript model.
+    Both return the backbone features and the logits of a batch of normalized images.
+    """
+
+    def __init__(self, model_path, num_threads=None):
+        """
+        Initialize the InferenceEngine.
+
+        Args:
+            model_path (str): Path to the exported model.
+            num_threads (int, optional): Number of intra-op threads. Default: the runtime default.
+        """
+        self.model_path = model_path
+        self.backend = 'onnx' if model_path.endswith('.onnx') else 'torchscript'
+
+        if self.backend == 'onnx':
+            import onnxruntime as ort
+            options = ort.SessionOptions()
+            options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+            if num_threads:
+                options.intra_op_num_threads = num_threads
+            self.session = ort.InferenceSession(model_path, sess_options=options, providers=['CPUExecutionProvider'])
+        else:
+            if num_threads:
+                torch.set_num_threads(num_threads)
+            self.model = torch.jit.load(model_path, map_location='cpu').eval()
+
+    def __call__(self, images):
+        """
+        Run the model on a batch.
+
+        Args:
+            images (torch.Tensor): Normalized images of shape (B, 3, 224, 224).
+
+        Returns:
+            tuple: Features (B, D) and logits (B, num_classes) as numpy arrays.
+        """
+        if self.backend == 'onnx':
+            feats, logits = self.session.run(['feats', 'logits'], {'images': images.numpy()})
+            return feats, logits
+        with torch.inference_mode():
+            feats, logits = self.model(images)
+        return feats.float().numpy(), logits.float().numpy()
+
+
+def softmax(logits):
+    """
+    Numerically stable softmax over the last axis.
+
+    Args:
+        logits (np.ndarray): Logits of shape (B, num_classes).
+
+    Returns:
+        np.ndarray: Probabilities of shape (B, num_classes).
+    """
+    exp_logits = np.exp(logits - logits.max(axis=1, keepdims=True))
+    return exp_logits / exp_logits.sum(axis=1, keepdims=True)
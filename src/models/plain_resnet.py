@@ -95,17 +95,20 @@ class PlainResNetClassifier(nn.Module):
 
     name = 'PlainResNetClassifier'
 
-    def __init__(self, num_cls=10, num_layers=18):
+    def __init__(self, num_cls=10, num_layers=18, weights_dir=None):
         """
         Initialize the PlainResNetClassifier.
 
         Args:
             num_cls (int): Number of classes for the classifier.
             num_layers (int): Number of layers in the ResNet model (e.g., 18, 50).
+            weights_dir (str, optional): Local cache of the pre-trained weights. Default: the torch hub cache.
         """
         super(PlainResNetClassifier, self).__init__()
         self.num_cls = num_cls
         self.num_layers = num_layers
+        self.weights_dir = weights_dir
+        self.weights_url = None
         self.feature = None
         self.classifier = None
         self.criterion_cls = None
@@ -120,18 +123,15 @@ class PlainResNetClassifier(nn.Module):
         kwargs = {}
 
         # Selecting the appropriate ResNet architecture and pre-trained weights
+        # (the weights themselves are only loaded by feat_init)
         if self.num_layers == 18:
             block = BasicBlock
             layers = [2, 2, 2, 2]
-            #self.pretrained_weights = ResNet18_Weights.IMAGENET1K_V1
-            self.pretrained_weights = state_dict = load_state_dict_from_url(model_urls['resnet18'],
-                                              progress=True)
+            self.weights_url = model_urls['resnet18']
         elif self.num_layers == 50:
             block = Bottleneck
             layers = [3, 4, 6, 3]
-            #self.pretrained_weights = ResNet50_Weights.IMAGENET1K_V1
-            self.pretrained_weights = state_dict = load_state_dict_from_url(model_urls['resnet50'],
-                                              progress=True)
+            self.weights_url = model_urls['resnet50']
         else:
             raise Exception('ResNet Type not supported.')
 
@@ -146,13 +146,27 @@ class PlainResNetClassifier(nn.Module):
         # Criterion for binary classification
         self.criterion_cls = nn.CrossEntropyLoss()
 
+    def load_pretrained_weights(self):
+        """
+        Load the ImageNet pre-trained weights of the backbone.
+
+        The weights are read from the local cache (weights_dir) and only downloaded if they are not there yet,
+        so runs with a populated cache never touch the network.
+
+        Returns:
+            dict: State dict of the pre-trained ResNet.
+        """
+        return load_state_dict_from_url(self.weights_url, model_dir=self.weights_dir, progress=True,
+                                        map_location='cpu')
+
     def feat_init(self):
         """
         Initialize the feature extractor with pre-trained weights.
+
+        The pre-trained state dict is not kept on the module, so it is released once it is loaded into the backbone.
         """
         # Load pre-trained weights and adjust for the current model
-        #init_weights = self.pretrained_weights.get_state_dict(progress=True)
-        init_weights = self.pretrained_weights
+        init_weights = self.load_pretrained_weights()
         init_weights = OrderedDict({k.replace('module.', '').replace('feature.', ''): init_weights[k]
                                     for k in init_weights})
 
@@ -0,0 +1,74 @@
+import time
+import numpy as np
+import torch
+from torch.ao.quantization import get_default_qconfig_mapping
+from torch.ao.quantization.quantize_fx import prepare_fx, convert_fx
+
+from .export import InferenceWrapper
+
+
+def quantize_classifier(net, calib_loader, num_batches=None, backend='x86'):
+    """
+    Post-training static INT8 quantization of a PlainResNetClassifier (backbone and linear head).
+
+    The model is traced with FX, observers are calibrated on the batches of calib_loader and the model is
+    converted to quantized CPU kernels (the BatchNorm layers are fused into the convolutions).
+
+    Args:
+        net (PlainResNetClassifier): Trained classifier.
+        calib_loader (DataLoader): Loader of calibration batches (image first).
+        num_batches (int, optional): Maximum number of calibration batches. Default: the whole loader.
+        backend (str): Quantized engine, x86 (or fbgemm) for servers, qnnpack for ARM.
+
+    Returns:
+        torch.fx.GraphModule: Quantized model returning (feats, logits).
+    """
+    torch.backends.quantized.engine = backend
+    model = InferenceWrapper(net).eval()
+    prepared = prepare_fx(model, get_default_qconfig_mapping(backend), (torch.randn(1, 3, 224, 224),))
+
+    with torch.inference_mode():
+        for i, batch in enumerate(calib_loader):
+            if num_batches is not None and i >= num_batches:
+                break
+            prepared(batch[0])
+
+    return convert_fx(prepared)
+
+
+def benchmark_model(model, loader):
+    """
+    Run a (feats, logits) model over a labeled loader on CPU.
+
+    Args:
+        model (nn.Module): Model returning (feats, logits).
+        loader (DataLoader): Loader returning (image, label_id, ...).
+
+    Returns:
+        tuple: Predictions, labels and images per second (decoding excluded).
+    """
+    preds, labels = [], []
+    elapsed = 0.0
+    with torch.inference_mode():
+        for batch in loader:
+            start = time.perf_counter()
+            _, logits = model(batch[0])
+            elapsed += time.perf_counter() - start
+            preds.append(logits.argmax(dim=1).numpy())
+            labels.append(np.asarray(batch[1]))
+    preds, labels = np.concatenate(preds), np.concatenate(labels)
+    return preds, labels, len(preds) / max(elapsed, 1e-9)
+
+
+def save_quantized(model, output_path):
+    """
+    Save a quantized model as TorchScript, so it can be loaded by InferenceEngine.
+
+    Args:
+        model (torch.fx.GraphModule): Quantized model.
+        output_path (str): Path to the TorchScript file.
+    """
+    with torch.no_grad():
+        traced = torch.jit.trace(model, torch.randn(1, 3, 224, 224))
+    torch.jit.save(torch.jit.freeze(traced), output_path)
+    print('Quantized model saved to {}.'.format(output_path))
@@ -1,2 +1 @@
-from .batch_detection_cropping import *
-from .data_splitting import * 
+from .annotations import *
@@ -0,0 +1,90 @@
+import os
+from argparse import ArgumentParser
+import pandas as pd
+
+__all__ = ['annotation_file', 'read_annotations', 'write_annotations', 'convert_annotations']
+
+# Supported annotation formats, by file extension. Parquet is columnar: readers only load the columns they
+# need, and the label names are stored dictionary-encoded (categorical) instead of once per row.
+ANNOTATION_FORMATS = {'csv': '.csv', 'parquet': '.parquet'}
+CATEGORICAL_COLUMNS = ('label', 'Location')
+
+
+def annotation_file(path, fmt='csv'):
+    """
+    Path of an annotation file in the given format (same name, format extension).
+
+    Args:
+        path (str): Path to the annotation file, with or without extension.
+        fmt (str): Annotation format, csv or parquet.
+
+    Returns:
+        str: Path with the extension of the format.
+    """
+    if fmt not in ANNOTATION_FORMATS:
+        raise ValueError('Invalid annotation format: {}. Available options: {}.'.format(fmt, ', '.join(ANNOTATION_FORMATS)))
+    root, ext = os.path.splitext(path)
+    if ext not in ANNOTATION_FORMATS.values():
+        root = path
+    return root + ANNOTATION_FORMATS[fmt]
+
+
+def read_annotations(path, columns=None):
+    """
+    Read an annotation file (CSV or Parquet, by extension), loading only the requested columns.
+
+    Args:
+        path (str): Path to the annotation file.
+        columns (list, optional): Columns to load. Default: all of them.
+
+    Returns:
+        DataFrame: The annotations, with the label names as a categorical column.
+    """
+    if path.endswith(ANNOTATION_FORMATS['parquet']):
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        dtype = {c: 'category' for c in CATEGORICAL_COLUMNS if columns is None or c in columns}
+        df = pd.read_csv(path, usecols=columns, dtype=dtype)
+    for c in CATEGORICAL_COLUMNS:
+        if c in df and df[c].dtype.name != 'category':
+            df[c] = df[c].astype('category')
+    return df
+
+
+def write_annotations(df, path):
+    """
+    Write an annotation file (CSV or Parquet, by extension).
+
+    Args:
+        df (DataFrame): The annotations.
+        path (str): Path to the annotation file.
+    """
+    if path.endswith(ANNOTATION_FORMATS['parquet']):
+        df = df.copy()
+        for c in CATEGORICAL_COLUMNS:
+            if c in df:
+                df[c] = df[c].astype('category')
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, index=False)
+
+
+def convert_annotations(src_path, dst_path):
+    """
+    Convert an annotation file between CSV and Parquet (import/export).
+
+    Args:
+        src_path (str): Path to the source annotation file.
+        dst_path (str): Path to the converted file; the format is taken from its extension.
+    """
+    write_annotations(read_annotations(src_path), dst_path)
+    print('Annotations converted to {}.'.format(dst_path))
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Convert annotation files between CSV and Parquet.')
+    parser.add_argument('src', nargs='+', help='Annotation files to convert')
+    parser.add_argument('--to', default='parquet', choices=list(ANNOTATION_FORMATS), help='Target format')
+    args = parser.parse_args()
+    for src in args.src:
+        convert_annotations(src, annotation_file(src, args.to))
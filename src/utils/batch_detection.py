@@ -4,28 +4,111 @@
 """ Demo for batch detection, cropping and resizing"""
 
 #%% 
+import os
+import tempfile
 # PyTorch imports 
 import torch
+import supervision as sv
 # Importing the model, dataset, transformations and utility functions from PytorchWildlife
 from PytorchWildlife.models import detection as pw_detection
 from PytorchWildlife.data import transforms as pw_trans
 from PytorchWildlife.data import datasets as pw_data 
 # Importing the utility function for saving cropped images
 from src.utils import utils
+from src.utils.detection_cache import DetectionCache
+from src.utils.motion_filter import MotionFilter
 
-def batch_detection_cropping(folder_path, output_path, annotation_file):
-    # Setting the device to use for computations ('cuda' indicates GPU)
-    DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Version of the detector, part of the detection cache key
+DETECTOR_VERSION = "MDV5-a"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
 
-    # Initializing the MegaDetectorV5 model for image detection
-    detection_model = pw_detection.MegaDetectorV5(device=DEVICE, pretrained=True)
+def list_images(folder_path):
+    """
+    List the images of a folder recursively, as batch_image_detection does.
 
-    """ Batch-detection demo """
-    # Performing batch detection on the images
-    results = detection_model.batch_image_detection(folder_path)
+    Args:
+        folder_path (str): Folder with the images.
 
-    # Saving the detected objects as cropped images
-    crop_annotation_path = utils.save_crop_images(results, output_path, annotation_file)
+    Returns:
+        list: Sorted paths to the images.
+    """
+    return sorted(os.path.join(root, name) for root, _, files in os.walk(folder_path)
+                  for name in files if name.lower().endswith(IMAGE_EXTENSIONS))
+
+def link_images(image_paths, folder_path, link_dir):
+    """
+    Mirror a subset of the images of a folder into link_dir with symbolic links (same relative paths and names),
+    so batch_image_detection only runs on that subset.
+
+    Args:
+        image_paths (list): Paths to the images inside folder_path.
+        folder_path (str): Folder with the images.
+        link_dir (str): Destination folder of the links.
+
+    Returns:
+        str: link_dir.
+    """
+    for image_path in image_paths:
+        link_path = os.path.join(link_dir, os.path.relpath(image_path, folder_path))
+        os.makedirs(os.path.dirname(link_path), exist_ok=True)
+        os.symlink(os.path.abspath(image_path), link_path)
+    return link_dir
+
+def cached_detections(folder_path, cache):
+    """
+    Build the batch_image_detection results of a folder from the detection cache.
+
+    Args:
+        folder_path (str): Folder with the images (walked recursively).
+        cache (DetectionCache): Detection cache.
+
+    Returns:
+        list: Results with img_id and detections (sv.Detections), or None if any image is not cached.
+    """
+    results = []
+    for image_path in list_images(folder_path):
+        entry = cache.get(image_path)
+        if entry is None:
+            return None
+        results.append({"img_id": image_path,
+                        "detections": sv.Detections(xyxy=entry["xyxy"], confidence=entry["confidence"],
+                                                    class_id=entry["class_id"])})
+    return results
+
+def batch_detection_cropping(folder_path, output_path, annotation_file, cache_dir=None, motion_threshold=None):
+    # With a cache, the detector only runs if some image of the folder has not been detected yet
+    cache = DetectionCache(cache_dir, DETECTOR_VERSION) if cache_dir is not None else None
+
+    with tempfile.TemporaryDirectory() as link_dir:
+        detection_path = folder_path
+        if motion_threshold is not None:
+            # Static frames of each sequence are considered empty and never reach the detector
+            motion_filter = MotionFilter(threshold=motion_threshold)
+            image_paths = list_images(folder_path)
+            kept, _ = motion_filter.split(image_paths)
+            print(motion_filter.summary(motion_filter.report(image_paths)))
+            detection_path = link_images(kept, folder_path, link_dir)
+
+        results = cached_detections(detection_path, cache) if cache is not None else None
+
+        if results is None:
+            # Setting the device to use for computations ('cuda' indicates GPU)
+            DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+            # Initializing the MegaDetectorV5 model for image detection
+            detection_model = pw_detection.MegaDetectorV5(device=DEVICE, pretrained=True)
+
+            """ Batch-detection demo """
+            # Performing batch detection on the images
+            results = detection_model.batch_image_detection(detection_path)
+
+            if cache is not None:
+                for entry in results:
+                    detections = entry["detections"]
+                    cache.put(entry["img_id"], detections.xyxy, detections.confidence, detections.class_id)
+
+        # Saving the detected objects as cropped images
+        crop_annotation_path = utils.save_crop_images(results, output_path, annotation_file)
     return crop_annotation_path
 
 
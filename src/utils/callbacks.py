@@ -0,0 +1,72 @@
+import time
+import pytorch_lightning as pl
+
+
+class ThroughputMonitor(pl.Callback):
+    """
+    Reports the number of images per second of every training, validation, test and predict epoch.
+
+    The time is measured from the start to the end of the epoch, so it includes data loading. The time spent
+    in validation is not counted in the training throughput.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.start = None
+        self.num_images = 0
+
+    def _start(self):
+        self.start = time.perf_counter()
+        self.num_images = 0
+
+    def _count(self, batch):
+        self.num_images += len(batch[0])
+
+    def _report(self, trainer, stage):
+        elapsed = time.perf_counter() - self.start
+        if trainer.is_global_zero and elapsed > 0:
+            print('\n{} throughput: {} images in {:.1f} s ({:.1f} images/s per process).'.format(
+                stage, self.num_images, elapsed, self.num_images / elapsed))
+
+    def on_train_epoch_start(self, trainer, pl_module):
+        self._start()
+
+    def on_train_batch_end(self, trainer, pl_module, outputs, batch, batch_idx):
+        self._count(batch)
+
+    def on_train_epoch_end(self, trainer, pl_module):
+        self._report(trainer, 'Train')
+
+    def on_validation_epoch_start(self, trainer, pl_module):
+        # Validation runs inside the training epoch, keep its own counters
+        self._train_state = (self.start, self.num_images)
+        self._start()
+
+    def on_validation_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx=0):
+        self._count(batch)
+
+    def on_validation_epoch_end(self, trainer, pl_module):
+        self._report(trainer, 'Validation')
+        # Leave the validation time out of the training throughput
+        train_start, train_images = self._train_state
+        if train_start is not None:
+            train_start += time.perf_counter() - self.start
+        self.start, self.num_images = train_start, train_images
+
+    def on_test_epoch_start(self, trainer, pl_module):
+        self._start()
+
+    def on_test_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx=0):
+        self._count(batch)
+
+    def on_test_epoch_end(self, trainer, pl_module):
+        self._report(trainer, 'Test')
+
+    def on_predict_epoch_start(self, trainer, pl_module):
+        self._start()
+
+    def on_predict_batch_end(self, trainer, pl_module, outputs, batch, batch_idx, dataloader_idx=0):
+        self._count(batch)
+
+    def on_predict_epoch_end(self, trainer, pl_module):
+        self._report(trainer, 'Predict')
@@ -1,26 +1,30 @@
 ## DATA SPLITTING
 
+import numpy as np
 import pandas as pd
 from sklearn.model_selection import train_test_split
 import os
-from tqdm import tqdm
 
-def create_splits(csv_path, output_folder, test_size=0.2, val_size=0.1):
+from src.utils.annotations import annotation_file, read_annotations, write_annotations
+from src.utils.sequences import assign_sequences
+
+def create_splits(csv_path, output_folder, test_size=0.2, val_size=0.1, fmt='csv'):
     """
     Create stratified training, validation, and testing splits.
     
     Args:
-    - csv_path (str): Path to the csv containing the annotations.
-    - output_folder (str): Destination directory to save the annotation split csv files.
+    - csv_path (str): Path to the csv (or parquet) file containing the annotations.
+    - output_folder (str): Destination directory to save the annotation split files.
     - test_size (float): Proportion of the dataset to include in the test split.
     - val_size (float): Proportion of the training dataset to include in the validation split.
+    - fmt (str): Format of the split files, csv or parquet.
     
     Returns:
     - A tuple of DataFrames: (train_set, val_set, test_set)
-    - Saves the splits into separate csv files in the output_folder.
+    - Saves the splits into separate files in the output_folder.
     """
-    # Load the data from the csv file
-    data = pd.read_csv(csv_path)
+    # Load only the columns used by the split
+    data = read_annotations(csv_path, columns=['path', 'label', 'classification'])
     # Separate the features and the targets
     X = data[['path','label']]
     y = data['classification']
@@ -42,34 +46,35 @@ def create_splits(csv_path, output_folder, test_size=0.2, val_size=0.1):
     # Create the output directory in case that it does not exist
     os.makedirs(output_folder, exist_ok=True)
 
-    # Save the splits to new CSV files
-    train_set.to_csv(os.path.join(output_folder,'train_annotations.csv'), index=False)
-    val_set.to_csv(os.path.join(output_folder,'val_annotations.csv'), index=False)
-    test_set.to_csv(os.path.join(output_folder,'test_annotations.csv'), index=False)
+    # Save the splits to new annotation files
+    write_annotations(train_set, annotation_file(os.path.join(output_folder, 'train_annotations'), fmt))
+    write_annotations(val_set, annotation_file(os.path.join(output_folder, 'val_annotations'), fmt))
+    write_annotations(test_set, annotation_file(os.path.join(output_folder, 'test_annotations'), fmt))
 
     # Return the dataframes
     return train_set, val_set, test_set
 
-def split_by_location(csv_path, output_folder, val_size=0.15, test_size=0.15, random_state=None):
+def split_by_location(csv_path, output_folder, val_size=0.15, test_size=0.15, random_state=None, fmt='csv'):
     """
     Splits the dataset into train, validation, and test sets based on location, ensuring that:
     1. All images from the same location are in the same split.
     2. The split is random among the locations.
-    3. Saves the split datasets into CSV files.
+    3. Saves the split datasets into CSV (or Parquet) files.
     
     Parameters:
-    - csv_path: Path to the csv containing the annotations.
+    - csv_path: Path to the csv (or parquet) file containing the annotations.
     - train_size, val_size, test_size: float, proportions of the dataset to include in the train, validation, and test splits.
     - random_state: int, random state for reproducibility.
+    - fmt: str, format of the split files, csv or parquet.
     """
-    # Load the data from the csv file
-    data = pd.read_csv(csv_path)
+    # Load the data from the annotation file
+    data = read_annotations(csv_path)
 
     # Calculate train size based on val and test size
     train_size = 1.0 - val_size - test_size
     
-    # Get unique locations
-    unique_locations = data['Location'].unique()
+    # Get unique locations (as a plain array, Location may be categorical)
+    unique_locations = np.asarray(data['Location'].unique())
 
     # Split locations into train and temp (temporary holding for val and test)
     train_locs, temp_locs = train_test_split(unique_locations, train_size=train_size, random_state=random_state)
@@ -83,29 +88,31 @@ def split_by_location(csv_path, output_folder, val_size=0.15, test_size=0.15, ra
     val_data = data[data['Location'].isin(val_locs)]
     test_data = data[data['Location'].isin(test_locs)]
     
-    # Save the datasets to CSV files
-    train_data.to_csv(os.path.join(output_folder,'train_annotations.csv'), index=False)
-    val_data.to_csv(os.path.join(output_folder,'val_annotations.csv'), index=False)
-    test_data.to_csv(os.path.join(output_folder,'test_annotations.csv'), index=False)
+    # Save the datasets to annotation files
+    write_annotations(train_data, annotation_file(os.path.join(output_folder, 'train_annotations'), fmt))
+    write_annotations(val_data, annotation_file(os.path.join(output_folder, 'val_annotations'), fmt))
+    write_annotations(test_data, annotation_file(os.path.join(output_folder, 'test_annotations'), fmt))
     
     # Return the split datasets
     return train_data, val_data, test_data
 
 
-def split_by_seq(csv_path, output_folder, val_size=0.15, test_size=0.15, random_state=None):
+def split_by_seq(csv_path, output_folder, val_size=0.15, test_size=0.15, random_state=None, gap=30, fmt='csv'):
     """
     Splits the dataset into train, validation, and test sets based on sequence ID, ensuring that:
-    1. All images from the same sequence are in the same split.
+    1. All images from the same sequence (same Location, at most `gap` seconds apart) are in the same split.
     2. The split is random among the sequences.
-    3. Saves the split datasets into CSV files.
+    3. Saves the split datasets into CSV (or Parquet) files.
     
     Parameters:
-    - csv_path: Path to the csv containing the annotations.
+    - csv_path: Path to the csv (or parquet) file containing the annotations.
     - train_size, val_size, test_size: float, proportions of the dataset to include in the train, validation, and test splits.
     - random_state: int, random state for reproducibility.
+    - gap: float, maximum time in seconds between consecutive photos of a sequence.
+    - fmt: str, format of the split files, csv or parquet.
     """
-    # Load the data from the csv file
-    data = pd.read_csv(csv_path)
+    # Load the data from the annotation file
+    data = read_annotations(csv_path)
 
     # Convert 'Photo_Time' from string to datetime
     data['Photo_Time'] = pd.to_datetime(data['Photo_Time'])
@@ -116,12 +123,8 @@ def split_by_seq(csv_path, output_folder, val_size=0.15, test_size=0.15, random_
     # Sort by 'Photo_Time' to ensure chronological order
     data = data.sort_values(by=['Photo_Time']).reset_index(drop=True)
 
-    # Group photos into sequences based on a 30-second interval
-    time_groups = data.groupby(pd.Grouper(key='Photo_Time', freq='30S'))
-
-    # Assign unique sequence IDs to each group
-    for s, i in tqdm(enumerate(time_groups.indices.values())):
-        data.loc[i, 'Seq_ID'] = int(s)
+    # Group photos of each camera into sequences separated by more than `gap` seconds
+    data['Seq_ID'] = assign_sequences(data, 'Photo_Time', 'Location', gap)
 
     # Get unique sequence IDs
     unique_seq_ids = data['Seq_ID'].unique()
@@ -138,10 +141,10 @@ def split_by_seq(csv_path, output_folder, val_size=0.15, test_size=0.15, random_
     val_data = data[data['Seq_ID'].isin(val_seq_ids)]
     test_data = data[data['Seq_ID'].isin(test_seq_ids)]
     
-    # Save the datasets to CSV files
-    train_data.to_csv(os.path.join(output_folder,'train_annotations.csv'), index=False)
-    val_data.to_csv(os.path.join(output_folder,'val_annotations.csv'), index=False)
-    test_data.to_csv(os.path.join(output_folder,'test_annotations.csv'), index=False)
+    # Save the datasets to annotation files
+    write_annotations(train_data, annotation_file(os.path.join(output_folder, 'train_annotations'), fmt))
+    write_annotations(val_data, annotation_file(os.path.join(output_folder, 'val_annotations'), fmt))
+    write_annotations(test_data, annotation_file(os.path.join(output_folder, 'test_annotations'), fmt))
 
     # Return the split datasets
     return train_data, val_data, test_data
@@ -0,0 +1,150 @@
+import os
+from types import SimpleNamespace
+import numpy as np
+import torch
+
+from src.datasets.feature_store import file_digest
+
+
+def content_digest(path):
+    """
+    SHA-1 of the content of a file, so renamed or copied images keep their cache entry.
+
+    Args:
+        path (str): Path to the file.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    return file_digest(path)
+
+
+class DetectionCache:
+    """
+    On-disk cache of detector outputs keyed by image content hash and detector version.
+
+    Every image is stored as cache_dir/<version>/<hash[:2]>/<hash>.npz with the arrays xyxy (N, 4), confidence (N,)
+    and class_id (N,) in original image coordinates, so cropping and classification can be re-run with other
+    margins, classifiers or thresholds without running the detector again.
+    """
+
+    def __init__(self, cache_dir, detector_version):
+        """
+        Initialize the DetectionCache.
+
+        Args:
+            cache_dir (str): Root directory of the cache.
+            detector_version (str): Detector version (e.g. the DETECTORS value), part of the key.
+        """
+        self.root = os.path.join(str(cache_dir), detector_version)
+        self.hits = 0
+        self.misses = 0
+        self.digests = {}
+
+    def entry_path(self, image_path):
+        image_path = str(image_path)
+        if image_path not in self.digests:
+            self.digests[image_path] = content_digest(image_path)
+        digest = self.digests[image_path]
+        return os.path.join(self.root, digest[:2], digest + '.npz')
+
+    def get(self, image_path):
+        """
+        Look up the detections of an image.
+
+        Args:
+            image_path (str): Path to the image.
+
+        Returns:
+            dict: Arrays xyxy, confidence and class_id, or None if the image is not cached.
+        """
+        path = self.entry_path(image_path)
+        if not os.path.exists(path):
+            self.misses += 1
+            return None
+        self.hits += 1
+        with np.load(path) as data:
+            return {k: data[k] for k in ('xyxy', 'confidence', 'class_id')}
+
+    def put(self, image_path, xyxy, confidence, class_id):
+        """
+        Store the detections of an image (atomically, so interrupted runs never leave partial entries).
+
+        Args:
+            image_path (str): Path to the image.
+            xyxy (np.ndarray): Boxes (x1, y1, x2, y2) of shape (N, 4) in original image coordinates.
+            confidence (np.ndarray): Detection confidences of shape (N,).
+            class_id (np.ndarray): Detection categories of shape (N,).
+        """
+        path = self.entry_path(image_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.{}.tmp'.format(os.getpid())
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, xyxy=np.asarray(xyxy, dtype=np.float32).reshape(-1, 4),
+                     confidence=np.asarray(confidence, dtype=np.float32).reshape(-1),
+                     class_id=np.asarray(class_id, dtype=np.int64).reshape(-1))
+        os.replace(tmp_path, path)
+
+    def get_results(self, image_path, image):
+        """
+        Look up the detections of an image as detector.predictor results.
+
+        Args:
+            image_path (str): Path to the image.
+            image (np.ndarray): Decoded image, returned as orig_img.
+
+        Returns:
+            list: One result with boxes.xyxy, boxes.conf, boxes.cls and orig_img, or None if not cached.
+        """
+        entry = self.get(image_path)
+        if entry is None:
+            return None
+        boxes = SimpleNamespace(xyxy=torch.from_numpy(entry['xyxy']), conf=torch.from_numpy(entry['confidence']),
+                                cls=torch.from_numpy(entry['class_id']))
+        return [SimpleNamespace(boxes=boxes, orig_img=image)]
+
+    def put_results(self, image_path, results):
+        """
+        Store the detector.predictor results of an image.
+
+        Args:
+            image_path (str): Path to the image.
+            results (list): Results of detector.predictor for the image.
+        """
+        self.put(image_path,
+                 np.concatenate([r.boxes.xyxy.cpu().numpy() for r in results]) if results else np.zeros((0, 4)),
+                 np.concatenate([r.boxes.conf.cpu().numpy() for r in results]) if results else np.zeros(0),
+                 np.concatenate([r.boxes.cls.cpu().numpy() for r in results]) if results else np.zeros(0))
+
+    def summary(self):
+        return 'Detection cache {}: {} hits, {} misses.'.format(self.root, self.hits, self.misses)
+
+
+def detect_images(detector, image_paths, images, cache=None):
+    """
+    Detect a group of images, reading the ones already detected with the same detector from the cache.
+
+    The missing images are detected in one batched predictor call (or a single call if there is only one) and
+    stored in the cache. The predictor (MegaDetectorV6) letterboxes every image of a list to the model input and
+    maps the boxes back to the original image coordinates.
+
+    Args:
+        detector: Detection model (with a .predictor method).
+        image_paths (list): Paths to the images (the cache keys on their content).
+        images (list): Decoded images.
+        cache (DetectionCache, optional): Cache of detections. Default: None (no cache).
+
+    Returns:
+        list: Results of every image, with the same layout as detector.predictor(image).
+    """
+    results = [cache.get_results(p, image) if cache is not None else None for p, image in zip(image_paths, images)]
+    missing = [k for k, r in enumerate(results) if r is None]
+    if len(missing) == 1:
+        results[missing[0]] = detector.predictor(images[missing[0]])
+    elif missing:
+        for k, result in zip(missing, detector.predictor([images[k] for k in missing])):
+            results[k] = [result]
+    if cache is not None:
+        for k in missing:
+            cache.put_results(image_paths[k], results[k])
+    return results
@@ -0,0 +1,170 @@
+import os
+import csv
+import numpy as np
+import torch
+from PIL import Image
+from torchvision.ops import roi_align
+
+from src.models.export import load_classifier
+from src.utils.detection_cache import detect_images
+
+# Normalization of the classifier inputs (same as data_transforms['val'])
+mean = [0.485, 0.456, 0.406]
+std = [0.229, 0.224, 0.225]
+
+
+def crop_resize(image, boxes, margin=0, size=224):
+    """
+    Cut and resize the detections of an image in one batched operation on its device.
+
+    The boxes are enlarged by the margin and clipped to the image, as crop_with_margin does, and each crop is
+    resampled to size x size with roi_align. The number of bilinear samples per output pixel adapts to the
+    downscale factor of each box, so large boxes are averaged like the PIL resize used in training instead of
+    aliasing.
+
+    Args:
+        image (torch.Tensor): Decoded image of shape (3, H, W), uint8 or float.
+        boxes (torch.Tensor): Boxes (x1, y1, x2, y2) of shape (K, 4) in pixels.
+        margin (int): Margin in pixels around each box (the training crops of save_crop_images have none).
+        size (int): Side of the resized crops.
+
+    Returns:
+        torch.Tensor: Float crops in [0, 255] of shape (K, 3, size, size).
+    """
+    _, height, width = image.shape
+    boxes = boxes.to(image.device, dtype=torch.float32)
+    boxes = torch.stack([(boxes[:, 0] - margin).clamp(min=0), (boxes[:, 1] - margin).clamp(min=0),
+                         (boxes[:, 2] + margin).clamp(max=width), (boxes[:, 3] + margin).clamp(max=height)], dim=1)
+    rois = torch.cat([torch.zeros((len(boxes), 1), device=image.device), boxes], dim=1)
+    return roi_align(image.unsqueeze(0).float(), rois, output_size=(size, size), spatial_scale=1.0,
+                     sampling_ratio=-1, aligned=True)
+
+
+class FusedCattlePipeline:
+    """
+    Streaming detect -> crop -> classify pipeline, without intermediate crop files.
+
+    Every image is decoded once; the detections are cut and resized straight from the decoded image tensor,
+    batched across images into the PlainResNetClassifier and written as per-detection cattle probabilities.
+    Writing the crops to disk is optional.
+    """
+
+    fields = ['image', 'detection', 'x1', 'y1', 'x2', 'y2', 'det_confidence', 'det_class', 'cattle_prob']
+
+    def __init__(self, detector, checkpoint, device='cpu', batch_size=64, margin=0, cattle_class=1, crops_dir=None,
+                 det_batch_size=1, cache=None):
+        """
+        Initialize the FusedCattlePipeline.
+
+        Args:
+            detector (Any): Detection model (with a .predictor method).
+            checkpoint (str): Path to the Lightning checkpoint of the Plain learner.
+            device (str): Device of the classifier and of the crop resampling.
+            batch_size (int): Number of crops per classifier forward pass.
+            margin (int): Margin in pixels around each box. Default 0, as the training crops.
+            cattle_class (int): Index of the cattle class in the classifier outputs.
+            crops_dir (str, optional): If given, the crops are also saved there as JPEG.
+            det_batch_size (int): Number of images per detector call.
+            cache (DetectionCache, optional): Cache of detector outputs; cached images skip the detector.
+        """
+        self.detector = detector
+        self.device = torch.device(device)
+        self.net = load_classifier(checkpoint).to(self.device)
+        self.batch_size = batch_size
+        self.margin = margin
+        self.cattle_class = cattle_class
+        self.crops_dir = crops_dir
+        self.det_batch_size = det_batch_size
+        self.cache = cache
+        self.mean = torch.tensor(mean, device=self.device).view(1, 3, 1, 1) * 255
+        self.std = torch.tensor(std, device=self.device).view(1, 3, 1, 1) * 255
+        self.pending_crops = []
+        self.pending_rows = []
+
+    @torch.inference_mode()
+    def flush(self, writer):
+        """
+        Classify the pending crops in one forward pass and write their rows.
+
+        Args:
+            writer (csv.DictWriter): Writer of the output CSV.
+        """
+        if not self.pending_crops:
+            return
+        crops = (torch.cat(self.pending_crops) - self.mean) / self.std
+        logits = self.net.classifier(self.net.feature(crops))
+        probs = torch.softmax(logits, dim=1)[:, self.cattle_class].cpu().numpy()
+        for row, prob in zip(self.pending_rows, probs):
+            row['cattle_prob'] = float(prob)
+            writer.writerow(row)
+        self.pending_crops = []
+        self.pending_rows = []
+
+    def process_image(self, image_path, writer, image=None, results=None):
+        """
+        Detect, crop and queue the detections of one image for classification.
+
+        Args:
+            image_path (str): Path to the image.
+            writer (csv.DictWriter): Writer of the output CSV.
+            image (np.ndarray, optional): Already decoded image.
+            results (list, optional): Already computed detector results of the image.
+        """
+        if image is None:
+            image = np.array(Image.open(image_path).convert('RGB'))
+        if results is None:
+            results = detect_images(self.detector, [image_path], [image], self.cache)[0]
+        if not results:
+            return
+        boxes = torch.cat([r.boxes.xyxy for r in results]).cpu()
+        confs = torch.cat([r.boxes.conf for r in results]).cpu().numpy()
+        classes = torch.cat([r.boxes.cls for r in results]).cpu().numpy()
+        if len(boxes) == 0:
+            return
+
+        image_t = torch.from_numpy(image).to(self.device).permute(2, 0, 1)
+        crops = crop_resize(image_t, boxes, margin=self.margin)
+        self.pending_crops.append(crops)
+
+        for j, box in enumerate(boxes.numpy()):
+            self.pending_rows.append({'image': str(image_path), 'detection': j,
+                                      'x1': float(box[0]), 'y1': float(box[1]), 'x2': float(box[2]), 'y2': float(box[3]),
+                                      'det_confidence': float(confs[j]), 'det_class': int(classes[j])})
+            if self.crops_dir is not None:
+                x1, y1, x2, y2 = box.astype(int)
+                h, w, _ = image.shape
+                cropped = image[max(0, y1 - self.margin):min(h, y2 + self.margin),
+                                max(0, x1 - self.margin):min(w, x2 + self.margin)]
+                name = '{}_det{}.jpg'.format(os.path.splitext(os.path.basename(image_path))[0], j)
+                Image.fromarray(cropped).save(os.path.join(self.crops_dir, name))
+
+        if sum(len(c) for c in self.pending_crops) >= self.batch_size:
+            self.flush(writer)
+
+    def run(self, image_paths, output_csv):
+        """
+        Run the pipeline over a list of images.
+
+        Args:
+            image_paths (list): Paths to the images.
+            output_csv (str): Path to the CSV with one row per detection and its cattle probability.
+
+        Returns:
+            str: Path to the output CSV.
+        """
+        if self.crops_dir is not None:
+            os.makedirs(self.crops_dir, exist_ok=True)
+        with open(output_csv, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=self.fields)
+            writer.writeheader()
+            for start in range(0, len(image_paths), self.det_batch_size):
+                batch_paths = image_paths[start:start + self.det_batch_size]
+                images = [np.array(Image.open(image_path).convert('RGB')) for image_path in batch_paths]
+                batch_results = detect_images(self.detector, batch_paths, images, self.cache)
+                for image_path, image, results in zip(batch_paths, images, batch_results):
+                    self.process_image(image_path, writer, image=image, results=results)
+            self.flush(writer)
+        print('Detections saved to {}.'.format(output_csv))
+        if self.cache is not None:
+            print(self.cache.summary())
+        return output_csv
@@ -0,0 +1,89 @@
+import numpy as np
+import torch
+from sklearn.metrics import confusion_matrix
+
+def acc(preds, labels):
+    """
+    Calculate the accuracy metrics based on predictions and true labels.
+
+    This function computes the confusion matrix and derives three types of accuracies:
+    class-wise accuracy (cls_acc), micro accuracy (mic_acc), and macro accuracy (mac_acc).
+
+    Args:
+        preds (array-like): Predicted labels.
+        labels (array-like): True labels.
+
+    Returns:
+        tuple: A tuple containing:
+            - cls_acc (ndarray): Class-wise accuracy.
+            - mac_acc (float): Macro accuracy (average of class-wise accuracies).
+            - mic_acc (float): Micro accuracy (overall accuracy).
+    """
+    # Compute the confusion matrix from true labels and predictions
+    matrix = confusion_matrix(labels, preds)
+
+    # Calculate class-wise accuracy (accuracy for each class)
+    cls_acc = matrix.diagonal() / matrix.sum(axis=1)
+
+    # Calculate micro accuracy (overall accuracy)
+    mic_acc = matrix.diagonal().sum() / matrix.sum()
+
+    # Calculate macro accuracy (mean of class-wise accuracies)
+    mac_acc = cls_acc.mean()
+
+    return cls_acc, mac_acc, mic_acc
+
+
+def update_confusion(matrix, preds, labels):
+    """
+    Accumulate a batch into a running confusion matrix, on the device of the matrix.
+
+    Samples with a negative label (unlabeled) are ignored.
+
+    Args:
+        matrix (Tensor): Confusion matrix of shape (num_classes, num_classes), rows are true labels.
+        preds (Tensor): Predicted labels of the batch.
+        labels (Tensor): True labels of the batch.
+
+    Returns:
+        Tensor: The updated confusion matrix (updated in place).
+    """
+    num_classes = matrix.shape[0]
+    valid = labels >= 0
+    idx = labels[valid] * num_classes + preds[valid]
+    matrix += torch.bincount(idx, minlength=num_classes ** 2).view(num_classes, num_classes)
+    return matrix
+
+
+def acc_from_confusion(matrix):
+    """
+    Calculate the same accuracy metrics as acc from an accumulated confusion matrix.
+
+    As with sklearn's confusion_matrix, only the classes that appear in the labels or the predictions
+    are taken into account.
+
+    Args:
+        matrix (array-like): Confusion matrix of shape (num_classes, num_classes), rows are true labels.
+
+    Returns:
+        tuple: A tuple containing:
+            - cls_acc (ndarray): Class-wise accuracy.
+            - mac_acc (float): Macro accuracy (average of class-wise accuracies).
+            - mic_acc (float): Micro accuracy (overall accuracy).
+    """
+    matrix = np.asarray(matrix)
+
+    # Keep only the classes present in the labels or the predictions
+    present = (matrix.sum(axis=0) + matrix.sum(axis=1)) > 0
+    matrix = matrix[present][:, present]
+
+    # Calculate class-wise accuracy (accuracy for each class)
+    cls_acc = matrix.diagonal() / matrix.sum(axis=1)
+
+    # Calculate micro accuracy (overall accuracy)
+    mic_acc = matrix.diagonal().sum() / matrix.sum()
+
+    # Calculate macro accuracy (mean of class-wise accuracies)
+    mac_acc = cls_acc.mean()
+
+    return cls_acc, mac_acc, mic_acc
@@ -0,0 +1,178 @@
+import os
+from datetime import datetime
+import numpy as np
+import pandas as pd
+from PIL import Image
+
+from src.utils.sequences import assign_sequences
+
+# EXIF tags with the capture time (DateTimeOriginal lives in the Exif sub-IFD)
+EXIF_IFD = 0x8769
+DATETIME_ORIGINAL = 36867
+DATETIME = 306
+
+
+def frame_time(path):
+    """
+    Capture time of a frame from its EXIF data, falling back to the file modification time.
+
+    Args:
+        path (str): Path to the image.
+
+    Returns:
+        float: POSIX timestamp in seconds.
+    """
+    try:
+        with Image.open(path) as img:
+            exif = img.getexif()
+            value = exif.get_ifd(EXIF_IFD).get(DATETIME_ORIGINAL) or exif.get(DATETIME)
+        if value:
+            return datetime.strptime(str(value).strip('\x00 '), '%Y:%m:%d %H:%M:%S').timestamp()
+    except (OSError, ValueError):
+        pass
+    return os.path.getmtime(path)
+
+
+def group_sequences(paths, gap=30):
+    """
+    Group frames into sequences: frames of the same camera (parent directory) taken at most gap seconds
+    after the previous one belong to the same sequence (see sequences.assign_sequences).
+
+    Args:
+        paths (list): Paths to the frames.
+        gap (float): Maximum time in seconds between consecutive frames of a sequence.
+
+    Returns:
+        list: Sequences, each a list of paths in chronological order.
+    """
+    if len(paths) == 0:
+        return []
+    frames = pd.DataFrame({'path': list(paths), 'camera': [os.path.dirname(str(p)) for p in paths],
+                           'time': [frame_time(p) for p in paths]})
+    frames['seq'] = assign_sequences(frames, 'time', 'camera', gap)
+    frames = frames.sort_values(['seq', 'time'], kind='stable')
+    starts = np.flatnonzero(np.diff(frames['seq'].to_numpy())) + 1
+    return [list(seq) for seq in np.split(frames['path'].to_numpy(dtype=object), starts)]
+
+
+def thumbnail(path, size=(64, 48)):
+    """
+    Decode a small grayscale version of a frame. JPEG draft mode decodes directly at a reduced scale.
+
+    Args:
+        path (str): Path to the image.
+        size (tuple): Size (width, height) of the thumbnail.
+
+    Returns:
+        np.ndarray: Thumbnail of shape (height, width) as float32, with its mean brightness removed.
+    """
+    with Image.open(path) as img:
+        img.draft('L', (size[0] * 2, size[1] * 2))
+        thumb = np.asarray(img.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+    # Removing the mean makes the difference robust to exposure changes between frames of a burst
+    return thumb - thumb.mean()
+
+
+def motion_scores(sequence, size=(64, 48), pixel_threshold=25):
+    """
+    Motion score of every frame of a sequence: the largest fraction of thumbnail pixels that change by more than
+    pixel_threshold against the previous or the next frame.
+
+    Args:
+        sequence (list): Paths to the frames of a sequence, in chronological order.
+        size (tuple): Size (width, height) of the thumbnails.
+        pixel_threshold (float): Minimum gray-level difference for a pixel to count as changed.
+
+    Returns:
+        np.ndarray: Scores in [0, 1]. Frames without neighbours get inf, since they cannot be compared.
+    """
+    if len(sequence) < 2:
+        return np.full(len(sequence), np.inf)
+    thumbs = np.stack([thumbnail(p, size) for p in sequence])
+    changed = (np.abs(np.diff(thumbs, axis=0)) > pixel_threshold).mean(axis=(1, 2))
+    scores = np.zeros(len(sequence))
+    scores[1:] = changed
+    scores[:-1] = np.maximum(scores[:-1], changed)
+    return scores
+
+
+class MotionFilter:
+    """
+    Empty-frame pre-filter ahead of the detector: frames whose motion score against their neighbours in the same
+    sequence is below threshold are considered static (vegetation or light changes) and can be skipped.
+    """
+
+    def __init__(self, threshold=0.02, pixel_threshold=25, gap=30, size=(64, 48)):
+        """
+        Initialize the MotionFilter.
+
+        Args:
+            threshold (float): Minimum fraction of changed pixels for a frame to be kept.
+            pixel_threshold (float): Minimum gray-level difference for a pixel to count as changed.
+            gap (float): Maximum time in seconds between consecutive frames of a sequence.
+            size (tuple): Size (width, height) of the thumbnails.
+        """
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.gap = gap
+        self.size = size
+        self.scores = {}
+
+    def score(self, paths):
+        """
+        Compute the motion score of every frame.
+
+        Args:
+            paths (list): Paths to the frames.
+
+        Returns:
+            dict: Motion score per path.
+        """
+        # Scores are kept, so splitting and reporting the same frames decode them only once
+        missing = [p for p in paths if p not in self.scores]
+        for sequence in group_sequences(missing, self.gap):
+            self.scores.update(zip(sequence, motion_scores(sequence, self.size, self.pixel_threshold)))
+        return {p: self.scores[p] for p in paths}
+
+    def split(self, paths):
+        """
+        Split frames into the ones with motion and the static ones, keeping the input order.
+
+        Args:
+            paths (list): Paths to the frames.
+
+        Returns:
+            tuple: (kept, skipped) lists of paths.
+        """
+        scores = self.score(paths)
+        kept = [p for p in paths if scores[p] >= self.threshold]
+        skipped = [p for p in paths if scores[p] < self.threshold]
+        return kept, skipped
+
+    def report(self, paths, has_animal=None):
+        """
+        Report the detector calls avoided and, on a labeled set, the recall cost of the filter.
+
+        Args:
+            paths (list): Paths to the frames.
+            has_animal (dict, optional): Ground truth per path (True if the frame contains an animal).
+
+        Returns:
+            dict: frames, skipped, skipped_ratio and, with labels, positives, positives_skipped and recall.
+        """
+        kept, skipped = self.split(paths)
+        report = {'frames': len(paths), 'skipped': len(skipped), 'skipped_ratio': len(skipped) / max(len(paths), 1)}
+        if has_animal is not None:
+            positives = [p for p in paths if has_animal.get(p, False)]
+            lost = [p for p in skipped if has_animal.get(p, False)]
+            report.update(positives=len(positives), positives_skipped=len(lost),
+                          recall=1.0 - len(lost) / max(len(positives), 1))
+        return report
+
+    def summary(self, report):
+        text = 'Motion filter: {} of {} frames skipped ({:.1%} detector calls avoided)'.format(
+            report['skipped'], report['frames'], report['skipped_ratio'])
+        if 'recall' in report:
+            text += ', recall {:.2%} ({} of {} frames with animals skipped)'.format(
+                report['recall'], report['positives_skipped'], report['positives'])
+        return text + '.'
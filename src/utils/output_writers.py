@@ -0,0 +1,477 @@
+import os
+import json
+import shutil
+import struct
+import zipfile
+from collections import defaultdict
+import numpy as np
+
+
+def prediction_records(file_ids, preds, probs):
+    """
+    Build the JSON records of the predictions of a batch.
+
+    Args:
+        file_ids (list): Paths to the predicted images.
+        preds (array-like): Predicted class of each image.
+        probs (array-like): Confidence (softmax probability) of each prediction.
+
+    Returns:
+        list: One record per image.
+    """
+    return [{
+        "marker_id": "",
+        "survey_pic_id": file_ids[i],
+        "marker_confidence": float(probs[i]),
+        "marker_gear_type": "ghostnet" if preds[i] == 1 else "neg",
+        "marker_bounding_polygon": "",
+        "marker_status": "unverified",
+        "marker_ai_model": ""
+    } for i in range(len(preds))]
+
+
+class FeatureEncoder:
+    """
+    Storage policy of the feature column of the predict/test outputs.
+
+    Policies:
+        - fp32: features stored as they are.
+        - fp16: features stored as float16.
+        - int8: features quantized to int8 with one float32 scale per row (column ``<name>_scale``),
+          x ~= q * scale.
+        - pca: features projected to ``dim`` dimensions with a PCA fitted on the first flushed chunk; the
+          projection is saved as ``<name>_pca_mean`` and ``<name>_pca_components``, x ~= y @ components + mean.
+
+    The ``none`` policy (no features at all) is handled by the caller, which simply does not pass the column.
+    """
+
+    policies = ('none', 'fp32', 'fp16', 'int8', 'pca')
+
+    def __init__(self, policy='fp32', dim=128):
+        """
+        Initialize the FeatureEncoder.
+
+        Args:
+            policy (str): One of fp32, fp16, int8 or pca.
+            dim (int): Number of dimensions kept by the pca policy.
+        """
+        if policy not in self.policies:
+            raise ValueError('Invalid feature output policy: {}. Available options: {}.'.format(policy, ', '.join(self.policies)))
+        self.policy = policy
+        self.dim = dim
+        self.mean = None
+        self.components = None
+
+    def encode(self, name, feats):
+        """
+        Encode a chunk of features.
+
+        Args:
+            name (str): Name of the feature column.
+            feats (np.ndarray): Features of shape (N, D).
+
+        Returns:
+            dict: Mapping of the output column names to their arrays.
+        """
+        if self.policy == 'fp16':
+            return {name: feats.astype(np.float16)}
+        if self.policy == 'int8':
+            feats = feats.astype(np.float32)
+            scale = np.abs(feats).max(axis=1, keepdims=True) / 127
+            scale[scale == 0] = 1
+            return {name: np.round(feats / scale).astype(np.int8), name + '_scale': scale[:, 0]}
+        if self.policy == 'pca':
+            feats = feats.astype(np.float32)
+            if self.components is None:
+                # Fit the projection on the first chunk
+                self.mean = feats.mean(axis=0)
+                _, _, vt = np.linalg.svd(feats - self.mean, full_matrices=False)
+                self.components = vt[:self.dim]
+            return {name: (feats - self.mean) @ self.components.T}
+        return {name: feats}
+
+    def extras(self, name):
+        """
+        Arrays describing the encoding, saved once next to the columns.
+
+        Args:
+            name (str): Name of the feature column.
+
+        Returns:
+            dict: Mapping of the array names to their arrays.
+        """
+        if self.policy == 'pca' and self.components is not None:
+            return {name + '_pca_mean': self.mean, name + '_pca_components': self.components}
+        return {}
+
+    def restore(self, name, extras):
+        """
+        Restore the state saved by extras, so a resumed writer keeps encoding with the same projection.
+
+        Args:
+            name (str): Name of the feature column.
+            extras (dict): Mapping of the array names to their arrays.
+        """
+        if self.policy == 'pca' and name + '_pca_components' in extras:
+            self.mean = extras[name + '_pca_mean']
+            self.components = extras[name + '_pca_components']
+
+
+class ChunkedArrayWriter:
+    """
+    Streaming writer of named array columns into a .npz file.
+
+    Rows are appended batch by batch and flushed to ``.npy`` part files every ``chunk_rows`` rows, so
+    memory use does not grow with the dataset size and the rows written so far survive a crash (in the
+    ``<output_path>.parts`` directory). Every flush is committed by rewriting ``index.json`` in that directory,
+    and a new writer over the same output resumes after the committed parts unless ``overwrite`` is set.
+    On close, the parts are streamed one at a time into an uncompressed .npz with the same layout as
+    ``np.savez``, and the parts are removed.
+
+    Outputs that must stay in step with the arrays (e.g. a JsonLinesWriter) register their flush in
+    ``on_flush``: it runs after the parts of a chunk are written and before the chunk is committed.
+    """
+
+    def __init__(self, output_path, chunk_rows=8192, encoders=None, overwrite=False, key=None):
+        """
+        Initialize the ChunkedArrayWriter.
+
+        Args:
+            output_path (str): Path to the final .npz file.
+            chunk_rows (int): Number of rows buffered in memory before they are flushed to disk.
+            encoders (dict, optional): Mapping of column names to the FeatureEncoder applied when they are flushed.
+            overwrite (bool): Discard the parts of a previous run instead of resuming after them.
+            key (str, optional): Identifier of the run (e.g. the checkpoint). Parts committed with another key
+                are not resumed.
+        """
+        self.output_path = output_path
+        self.parts_dir = output_path + '.parts'
+        self.index_path = os.path.join(self.parts_dir, 'index.json')
+        self.chunk_rows = chunk_rows
+        self.encoders = encoders or {}
+        self.key = key
+        self.on_flush = []
+        self.buffers = defaultdict(list)
+        self.buffered_rows = 0
+        self.num_parts = 0
+        self.num_rows = 0
+        self.dtypes = {}
+        self.row_shapes = {}
+
+        if overwrite and os.path.exists(self.parts_dir):
+            shutil.rmtree(self.parts_dir)
+        os.makedirs(self.parts_dir, exist_ok=True)
+        self.resume()
+
+    def resume(self):
+        """
+        Load the state of the parts committed by a previous run, so new rows are appended after them.
+        """
+        index = read_parts_index(self.output_path)
+        if index is None:
+            return
+        if index['key'] != self.key:
+            raise ValueError('{} holds the outputs of another run. Remove it or open the writer with overwrite '
+                             'to discard them.'.format(self.parts_dir))
+        self.num_parts = index['num_parts']
+        self.num_rows = index['num_rows']
+        for name, column in index['columns'].items():
+            self.dtypes[name] = np.lib.format.descr_to_dtype(column['descr'])
+            self.row_shapes[name] = tuple(column['shape'])
+        extras = {name: np.load(os.path.join(self.parts_dir, name + '.npy')) for name in index['extras']}
+        for k, encoder in self.encoders.items():
+            encoder.restore(k, extras)
+        print('Resuming {} rows already written to {}.'.format(self.num_rows, self.parts_dir))
+
+    def append(self, **columns):
+        """
+        Append a batch of rows. All columns must have the same number of rows.
+
+        Args:
+            **columns: Arrays (or sequences) of rows, one per column name.
+        """
+        num_rows = None
+        for k, v in columns.items():
+            v = np.asarray(v)
+            num_rows = len(v) if num_rows is None else num_rows
+            self.buffers[k].append(v)
+        self.buffered_rows += num_rows or 0
+        if self.buffered_rows >= self.chunk_rows:
+            self.flush()
+
+    def flush(self):
+        """
+        Write the buffered rows to a new set of part files.
+        """
+        if self.buffered_rows == 0:
+            return
+        for k, v in self.buffers.items():
+            col = np.concatenate(v, axis=0)
+            cols = self.encoders[k].encode(k, col) if k in self.encoders else {k: col}
+            for name, col in cols.items():
+                np.save(os.path.join(self.parts_dir, '{}.{:05d}.npy'.format(name, self.num_parts)), col)
+                # String columns can get wider in later chunks, so keep the widest dtype
+                self.dtypes[name] = np.promote_types(self.dtypes[name], col.dtype) if name in self.dtypes else col.dtype
+                self.row_shapes[name] = col.shape[1:]
+        extras = {}
+        for k, encoder in self.encoders.items():
+            extras.update(encoder.extras(k))
+        for name, arr in extras.items():
+            np.save(os.path.join(self.parts_dir, name + '.npy'), arr)
+        for callback in self.on_flush:
+            callback()
+        self.num_rows += self.buffered_rows
+        self.num_parts += 1
+        self.buffers = defaultdict(list)
+        self.buffered_rows = 0
+
+        # Commit the chunk: parts beyond num_parts (from an interrupted flush) are ignored when resuming
+        index = {'key': self.key, 'num_parts': self.num_parts, 'num_rows': self.num_rows, 'extras': list(extras),
+                 'columns': {name: {'descr': np.lib.format.dtype_to_descr(dtype), 'shape': list(self.row_shapes[name])}
+                             for name, dtype in self.dtypes.items()}}
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        """
+        Flush the remaining rows and consolidate the part files into the final .npz.
+        """
+        self.flush()
+        tmp_path = self.output_path + '.tmp'
+        with zipfile.ZipFile(tmp_path, 'w', compression=zipfile.ZIP_STORED, allowZip64=True) as zf:
+            for name, dtype in self.dtypes.items():
+                header = {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                          'shape': (self.num_rows,) + tuple(self.row_shapes[name])}
+                with zf.open(name + '.npy', 'w', force_zip64=True) as fh:
+                    np.lib.format.write_array_header_1_0(fh, header)
+                    for p in range(self.num_parts):
+                        part = np.load(os.path.join(self.parts_dir, '{}.{:05d}.npy'.format(name, p)), mmap_mode='r')
+                        fh.write(np.ascontiguousarray(part, dtype=dtype).tobytes())
+            for k, encoder in self.encoders.items():
+                for name, arr in encoder.extras(k).items():
+                    with zf.open(name + '.npy', 'w', force_zip64=True) as fh:
+                        np.lib.format.write_array(fh, np.asarray(arr))
+        os.replace(tmp_path, self.output_path)
+        shutil.rmtree(self.parts_dir)
+
+
+class JsonLinesWriter:
+    """
+    Streaming writer of JSON records.
+
+    Records are appended to ``<output_path>l`` (JSON Lines), so the records flushed so far survive a crash.
+    Next to a ChunkedArrayWriter, its flush is registered in the writer's on_flush, so both outputs reach the
+    disk at the same boundaries, and a resumed run keeps as many lines as the writer has committed rows.
+    On close, the records are converted line by line into a JSON list at ``output_path``, with one record per
+    line.
+    """
+
+    def __init__(self, output_path, keep_lines=None):
+        """
+        Initialize the JsonLinesWriter.
+
+        Args:
+            output_path (str): Path to the final .json file.
+            keep_lines (int, optional): Resume the existing JSON Lines file after its first keep_lines records,
+                dropping the ones written after the last commit. Default: start a new file.
+        """
+        self.output_path = output_path
+        self.lines_path = output_path + 'l'
+        if keep_lines:
+            self.fh = open(self.lines_path, 'r+b')
+            for _ in range(keep_lines):
+                if not self.fh.readline().endswith(b'\n'):
+                    raise ValueError('{} has fewer than {} records, it does not match the outputs being '
+                                     'resumed.'.format(self.lines_path, keep_lines))
+            self.fh.truncate()
+            self.fh.close()
+            self.fh = open(self.lines_path, 'a')
+        else:
+            self.fh = open(self.lines_path, 'w')
+
+    def write(self, records):
+        """
+        Append a batch of records.
+
+        Args:
+            records (list): JSON-serializable records.
+        """
+        for r in records:
+            self.fh.write(json.dumps(r) + '\n')
+
+    def flush(self):
+        """
+        Write the appended records to disk.
+        """
+        self.fh.flush()
+
+    def close(self):
+        """
+        Convert the JSON Lines file into the final JSON list.
+        """
+        self.fh.close()
+        with open(self.lines_path) as fin, open(self.output_path, 'w') as fout:
+            fout.write('[')
+            for i, line in enumerate(fin):
+                fout.write((',\n' if i > 0 else '\n') + line.rstrip('\n'))
+            fout.write('\n]\n')
+        os.remove(self.lines_path)
+
+
+def load_npz_mmap(npz_path):
+    """
+    Load the arrays of an uncompressed .npz (np.savez or ChunkedArrayWriter) as read-only memory maps.
+
+    Compressed members cannot be memory-mapped and are loaded in memory instead.
+
+    Args:
+        npz_path (str): Path to the .npz file.
+
+    Returns:
+        dict: Mapping of the array names to their (memory-mapped) arrays.
+    """
+    arrays = {}
+    with zipfile.ZipFile(npz_path) as zf, open(npz_path, 'rb') as f:
+        for info in zf.infolist():
+            name = info.filename[:-len('.npy')]
+            if info.compress_type != zipfile.ZIP_STORED:
+                arrays[name] = np.load(zf.open(info))
+                continue
+            # Skip the local file header to get to the .npy content of the member
+            f.seek(info.header_offset + 26)
+            name_len, extra_len = struct.unpack('<HH', f.read(4))
+            f.seek(info.header_offset + 30 + name_len + extra_len)
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            if np.prod(shape) == 0:
+                arrays[name] = np.empty(shape, dtype=dtype)
+            else:
+                arrays[name] = np.memmap(npz_path, dtype=dtype, mode='r', offset=f.tell(), shape=shape,
+                                         order='F' if fortran_order else 'C')
+    return arrays
+
+
+def read_parts_index(output_path):
+    """
+    Read the commit index of the parts of a ChunkedArrayWriter.
+
+    Args:
+        output_path (str): Path to the final .npz file of the writer.
+
+    Returns:
+        dict: The index (key, num_parts, num_rows, columns and extras), or None if nothing was committed.
+    """
+    index_path = os.path.join(output_path + '.parts', 'index.json')
+    if not os.path.exists(index_path):
+        return None
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def read_committed(output_path, name, key=None):
+    """
+    Read a column of the parts committed by a ChunkedArrayWriter that was not closed.
+
+    Args:
+        output_path (str): Path to the final .npz file of the writer.
+        name (str): Name of the column.
+        key (str, optional): Identifier of the run. Parts committed with another key are ignored.
+
+    Returns:
+        np.ndarray: The committed rows of the column (empty if there are none).
+    """
+    index = read_parts_index(output_path)
+    if index is None or index['key'] != key or name not in index['columns']:
+        return np.zeros(0)
+    return np.concatenate([np.load(os.path.join(output_path + '.parts', '{}.{:05d}.npy'.format(name, p)))
+                           for p in range(index['num_parts'])])
+
+
+def close_committed(output_path, json_path, key=None):
+    """
+    Close the outputs of a ChunkedArrayWriter and its JsonLinesWriter left open by an interrupted run.
+
+    The committed parts are consolidated into the .npz and the JSON Lines file is truncated to as many
+    records before it is converted. If the run was interrupted after closing the arrays, only the JSON
+    records are closed.
+
+    Args:
+        output_path (str): Path to the final .npz file of the writer.
+        json_path (str): Path to the final .json file of the JSON writer.
+        key (str, optional): Identifier of the run. Parts committed with another key are left untouched.
+    """
+    index = read_parts_index(output_path)
+    if index is not None:
+        if index['key'] == key:
+            ChunkedArrayWriter(output_path, key=key).close()
+            JsonLinesWriter(json_path, keep_lines=index['num_rows']).close()
+    elif os.path.exists(output_path) and os.path.exists(json_path + 'l'):
+        with open(json_path + 'l', 'rb') as f:
+            num_lines = sum(1 for line in f if line.endswith(b'\n'))
+        JsonLinesWriter(json_path, keep_lines=num_lines).close()
+
+
+def iter_json_records(json_path):
+    """
+    Iterate over the records of a prediction JSON list.
+
+    Files written by JsonLinesWriter (one record per line) are streamed; other JSON lists are loaded whole.
+
+    Args:
+        json_path (str): Path to the .json file.
+
+    Yields:
+        dict: The records of the list.
+    """
+    with open(json_path) as f:
+        if f.readline().strip() != '[':
+            f.seek(0)
+            yield from json.load(f)
+            return
+        for line in f:
+            line = line.strip().rstrip(',')
+            if line and line != ']':
+                yield json.loads(line)
+
+
+def merge_outputs(old_npz, new_npz, output_npz, old_json, new_json, output_json, chunk_rows=8192):
+    """
+    Merge the outputs of an incremental prediction run into the outputs of the previous runs.
+
+    Rows of the previous outputs whose file_ids were scored again are replaced by the new ones. Both the
+    arrays and the JSON records are streamed, so memory use does not grow with the size of the outputs.
+    Both outputs must have the same columns, and features projected with a fitted PCA cannot be merged.
+
+    Args:
+        old_npz (str): Path to the .npz of the previous runs.
+        new_npz (str): Path to the .npz of the current run.
+        output_npz (str): Path to the merged .npz. Can be the same as old_npz.
+        old_json (str): Path to the .json of the previous runs.
+        new_json (str): Path to the .json of the current run.
+        output_json (str): Path to the merged .json. Can be the same as old_json.
+        chunk_rows (int): Number of rows processed at a time.
+    """
+    old = load_npz_mmap(old_npz)
+    new = load_npz_mmap(new_npz)
+    if new and set(old) != set(new):
+        raise ValueError('Cannot merge {} into {}: the outputs have different columns '
+                         '(was the feature output policy changed?).'.format(new_npz, old_npz))
+    new_ids = set(new['file_ids'].tolist()) if 'file_ids' in new else set()
+
+    writer = ChunkedArrayWriter(output_npz, chunk_rows=chunk_rows, overwrite=True)
+    for arrays, replaced in ((old, new_ids), (new, set())):
+        for start in range(0, len(arrays['file_ids']) if 'file_ids' in arrays else 0, chunk_rows):
+            file_ids = np.asarray(arrays['file_ids'][start:start + chunk_rows])
+            keep = np.fromiter((f not in replaced for f in file_ids.tolist()), dtype=bool, count=len(file_ids))
+            writer.append(**{k: np.asarray(v[start:start + chunk_rows])[keep] for k, v in arrays.items()})
+    writer.close()
+
+    json_writer = JsonLinesWriter(output_json)
+    json_writer.write(r for r in iter_json_records(old_json) if r['survey_pic_id'] not in new_ids)
+    json_writer.write(iter_json_records(new_json))
+    json_writer.close()
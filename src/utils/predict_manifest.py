@@ -0,0 +1,162 @@
+import os
+import pandas as pd
+
+from src.utils.output_writers import close_committed, merge_outputs, read_committed
+
+
+def checkpoint_id(ckpt_path):
+    """
+    Identify a checkpoint by its path, size and modification time.
+
+    Args:
+        ckpt_path (str): Path to the checkpoint.
+
+    Returns:
+        str: Identifier that changes whenever the checkpoint file is replaced.
+    """
+    st = os.stat(ckpt_path)
+    return '{}:{}:{}'.format(os.path.abspath(ckpt_path), st.st_size, st.st_mtime_ns)
+
+
+class PredictManifest:
+    """
+    Persistent record of the files already scored in predict mode.
+
+    Every scored file is stored with its size, modification time and the checkpoint that scored it, so a new
+    run over the same predict_root only needs to score new or changed files (or all of them if the
+    checkpoint changed).
+
+    The CSV is append-only while a run is in progress: save() appends the files recorded since the previous
+    save, and later rows of a file replace the earlier ones. compact() rewrites it with one row per file.
+    """
+
+    columns = ['path', 'size', 'mtime', 'checkpoint']
+
+    def __init__(self, manifest_path, ckpt_path):
+        """
+        Initialize the PredictManifest, loading the existing records if any.
+
+        Args:
+            manifest_path (str): Path to the manifest CSV.
+            ckpt_path (str): Path to the checkpoint used for the current run.
+        """
+        self.manifest_path = manifest_path
+        self.checkpoint = checkpoint_id(ckpt_path)
+        self.records = {}
+        # Rows recorded since the last save
+        self.unsaved = []
+        # (size, mtime) of the pending files, taken by pending() so add() does not stat them again
+        self.stats = {}
+        if os.path.exists(manifest_path):
+            # Read as strings: a row cut short by a crash is dropped instead of turning mtime into a float
+            df = pd.read_csv(manifest_path, dtype=str).dropna()
+            df = df.astype({'size': 'int64', 'mtime': 'int64'})
+            self.records = {p: (s, m, c) for p, s, m, c in zip(df['path'], df['size'], df['mtime'], df['checkpoint'])}
+
+    def pending(self, paths):
+        """
+        Select the files that still need to be scored by the current checkpoint.
+
+        Args:
+            paths (list): Paths to the files found in predict_root.
+
+        Returns:
+            list: Paths that are new, changed since they were scored, or scored by another checkpoint.
+        """
+        pending = []
+        for p in paths:
+            st = os.stat(p)
+            if self.records.get(p) != (st.st_size, st.st_mtime_ns, self.checkpoint):
+                pending.append(p)
+                self.stats[p] = (st.st_size, st.st_mtime_ns)
+        return pending
+
+    def add(self, paths):
+        """
+        Record files as scored by the current checkpoint.
+
+        Args:
+            paths (list): Paths to the scored files.
+        """
+        for p in paths:
+            stat = self.stats.pop(p, None)
+            if stat is None:
+                st = os.stat(p)
+                stat = (st.st_size, st.st_mtime_ns)
+            self.records[p] = stat + (self.checkpoint,)
+            self.unsaved.append((p,) + self.records[p])
+
+    def recover(self, paths):
+        """
+        Record the files whose outputs an interrupted run committed after it last saved the manifest.
+
+        Args:
+            paths (list): Paths to the files in the committed outputs of the interrupted run.
+        """
+        self.add([p for p in paths if (p not in self.records or self.records[p][2] != self.checkpoint)
+                  and os.path.exists(p)])
+
+    def save(self):
+        """
+        Append the files recorded since the last save to the manifest on disk.
+        """
+        if not self.unsaved:
+            return
+        df = pd.DataFrame(self.unsaved, columns=self.columns)
+        df.to_csv(self.manifest_path, mode='a', header=not os.path.exists(self.manifest_path), index=False)
+        self.unsaved = []
+
+    def compact(self):
+        """
+        Rewrite the manifest with one row per file, replacing the previous one atomically.
+        """
+        df = pd.DataFrame([(p,) + r for p, r in self.records.items()], columns=self.columns)
+        tmp_path = self.manifest_path + '.tmp'
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, self.manifest_path)
+        self.unsaved = []
+
+
+def merge_predict_outputs(ckpt_path):
+    """
+    Merge the outputs of an incremental prediction run (_predict_new) into the outputs of the previous runs, if any.
+
+    Args:
+        ckpt_path (str): Path to the checkpoint; the outputs are named after it.
+    """
+    new_path_full = ckpt_path.replace('.ckpt', '_predict_new.npz')
+    new_path_json = ckpt_path.replace('.ckpt', '_predict_new.json')
+    output_path_full = ckpt_path.replace('.ckpt', '_predict.npz')
+    output_path_json = ckpt_path.replace('.ckpt', '_predict.json')
+    if not (os.path.exists(new_path_full) and os.path.exists(new_path_json)):
+        return
+    if os.path.exists(output_path_full) and os.path.exists(output_path_json):
+        merge_outputs(output_path_full, new_path_full, output_path_full,
+                      output_path_json, new_path_json, output_path_json)
+        os.remove(new_path_full)
+        os.remove(new_path_json)
+    else:
+        os.replace(new_path_full, output_path_full)
+        os.replace(new_path_json, output_path_json)
+
+
+def recover_predict_outputs(manifest, ckpt_path):
+    """
+    Finish the outputs left by an interrupted incremental prediction run with the same checkpoint.
+
+    The files of the rows it committed are recorded as scored, its outputs are closed and merged into the
+    outputs of the previous runs. This runs before the predict loop, since Lightning skips the predict hooks
+    when no file is pending (e.g. when the interrupted run had already scored every file).
+
+    Args:
+        manifest (PredictManifest): Manifest of the current checkpoint.
+        ckpt_path (str): Path to the checkpoint; the outputs are named after it.
+    """
+    new_path_full = ckpt_path.replace('.ckpt', '_predict_new.npz')
+    new_path_json = ckpt_path.replace('.ckpt', '_predict_new.json')
+    # Files committed after the last manifest save of the interrupted run
+    manifest.recover(read_committed(new_path_full, 'file_ids', key=manifest.checkpoint).tolist())
+    close_committed(new_path_full, new_path_json, key=manifest.checkpoint)
+    manifest.save()
+    merge_predict_outputs(ckpt_path)
+    manifest.compact()
@@ -0,0 +1,32 @@
+import numpy as np
+import pandas as pd
+
+
+def assign_sequences(data, time_col='Photo_Time', camera_col='Location', gap=30):
+    """
+    Assign sequence IDs: photos of the same camera taken at most `gap` seconds after the previous one belong to
+    the same sequence. Vectorized (one sort, a diff and a cumsum), so it scales to millions of rows.
+    
+    Args:
+    - data (DataFrame): Annotations (or frames) to group.
+    - time_col (str): Column with the capture time, as datetimes (or strings) or as numeric seconds.
+    - camera_col (str): Column identifying the camera. If it is missing, all rows are treated as one camera.
+    - gap (float): Maximum time in seconds between consecutive photos of a sequence.
+    
+    Returns:
+    - A Series of integer sequence IDs aligned with data, numbered by camera and then chronologically.
+    """
+    times = data[time_col]
+    if pd.api.types.is_numeric_dtype(times):
+        seconds = times.to_numpy(dtype=float)
+    else:
+        seconds = pd.to_datetime(times).to_numpy(dtype='datetime64[ns]').astype(np.int64) / 1e9
+    cameras = pd.factorize(data[camera_col])[0] if camera_col in data else np.zeros(len(data), dtype=np.int64)
+
+    # Sort by camera and time, and start a new sequence where the camera changes or the gap is exceeded
+    order = np.lexsort((seconds, cameras))
+    new_seq = np.ones(len(data), dtype=bool)
+    new_seq[1:] = (np.diff(cameras[order]) != 0) | (np.diff(seconds[order]) > gap)
+    seq_ids = np.empty(len(data), dtype=np.int64)
+    seq_ids[order] = np.cumsum(new_seq) - 1
+    return pd.Series(seq_ids, index=data.index, name='Seq_ID')
@@ -4,8 +4,12 @@ import cv2
 import supervision as sv
 from PIL import Image 
 import numpy as np
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
-def save_crop_images(results, output_dir, original_csv_path, overwrite=False):
+from .annotations import read_annotations, write_annotations
+
+def save_crop_images(results, output_dir, original_csv_path, overwrite=False, num_workers=8):
     """
     Save cropped images based on the detection bounding boxes.
 
@@ -15,57 +19,66 @@ def save_crop_images(results, output_dir, original_csv_path, overwrite=False):
         output_dir (str):
             Directory to save the cropped images.
         original_csv_path (str):
-            Path to the original CSV file.
+            Path to the original CSV (or Parquet) annotation file.
         overwrite (bool):
             Whether overwriting existing image folders. Default to False.
+        num_workers (int):
+            Number of threads encoding and writing the crops. Default to 8.
     Return:
         new_csv_path (str):
-            Path to the new CSV file.
+            Path to the new annotation file, in the same format as the original.
     """
     assert isinstance(results, list)
 
-    # Read the original CSV file
-    original_df = pd.read_csv(original_csv_path)
+    # Read only the needed columns and index them by file name once (first row wins, as the previous lookup did)
+    original_df = read_annotations(original_csv_path, columns=['path', 'classification', 'label']).drop_duplicates('path')
+    annotations = dict(zip(original_df['path'], zip(original_df['classification'], original_df['label'])))
 
     # Prepare a list to store new records for the new CSV
     new_records = []
-    
+
     os.makedirs(output_dir, exist_ok=True)
-    with sv.ImageSink(target_dir_path=output_dir, overwrite=overwrite) as sink:
+    with sv.ImageSink(target_dir_path=output_dir, overwrite=overwrite) as sink, \
+            ThreadPoolExecutor(max_workers=num_workers) as executor:
+        futures = deque()
         for entry in results:
             # Process the data if the name of the file is in the dataframe
-            if os.path.basename(entry["img_id"]) in original_df['path'].values:
-                for i, (xyxy, cat) in enumerate(zip(entry["detections"].xyxy, entry["detections"].class_id)):
-                    cropped_img = sv.crop_image(
-                        image=np.array(Image.open(entry["img_id"]).convert("RGB")), xyxy=xyxy
-                    )
-                    new_img_name = "{}_{}_{}".format(
-                            int(cat), i, entry["img_id"].rsplit(os.sep, 1)[1])
-                    sink.save_image(
-                        image=cv2.cvtColor(cropped_img, cv2.COLOR_RGB2BGR),
-                        image_name=new_img_name
-                        ),
-                    
-                    # Save the crop into a new csv
-                    image_name = entry['img_id']
-                    
-                    classification_id = original_df[original_df['path'].str.endswith(image_name.split(os.sep)[-1])]['classification'].values[0]
-                    classification_name = original_df[original_df['path'].str.endswith(image_name.split(os.sep)[-1])]['label'].values[0]
-                    # Add record to the new CSV data
-                    new_records.append({
+            image_name = os.path.basename(entry["img_id"])
+            if image_name not in annotations or len(entry["detections"]) == 0:
+                continue
+            classification_id, classification_name = annotations[image_name]
+
+            # Decode the original once for all its detections
+            image = np.array(Image.open(entry["img_id"]).convert("RGB"))
+            for i, (xyxy, cat) in enumerate(zip(entry["detections"].xyxy, entry["detections"].class_id)):
+                cropped_img = sv.crop_image(image=image, xyxy=xyxy)
+                new_img_name = "{}_{}_{}".format(int(cat), i, image_name)
+                # JPEG encoding and writing release the GIL, so they run in the pool
+                futures.append(executor.submit(
+                    sink.save_image, image=cv2.cvtColor(cropped_img, cv2.COLOR_RGB2BGR), image_name=new_img_name
+                ))
+                # Bound the crops waiting in memory
+                while len(futures) > 16 * num_workers:
+                    futures.popleft().result()
+
+                # Add record to the new CSV data
+                new_records.append({
                     'path': new_img_name,
                     'classification': classification_id,
                     'label': classification_name
-                    })
+                })
+
+        for future in futures:
+            future.result()
 
     # Create a DataFrame from the new records
-    new_df = pd.DataFrame(new_records)
+    new_df = pd.DataFrame(new_records, columns=['path', 'classification', 'label'])
 
-    # Define the path for the new CSV file
-    new_file_name = "{}_cropped.csv".format(original_csv_path.split(os.sep)[-1].split('.')[0])
-    new_csv_path = os.path.join(output_dir, new_file_name)
+    # Define the path for the new annotation file, keeping the format of the original
+    name, ext = os.path.splitext(os.path.basename(original_csv_path))
+    new_csv_path = os.path.join(output_dir, "{}_cropped{}".format(name, ext))
 
-    # Save the new DataFrame to CSV
-    new_df.to_csv(new_csv_path, index=False)
+    # Save the new DataFrame (label as categorical)
+    write_annotations(new_df, new_csv_path)
 
     return new_csv_path
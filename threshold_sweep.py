@@ -0,0 +1,156 @@
+import time
+from argparse import ArgumentParser
+import numpy as np
+import pandas as pd
+
+from filter_predictions import cattle_probabilities
+from src.utils.output_writers import load_npz_mmap
+
+
+def threshold_curve(scores: np.ndarray, num_thresholds: int = 10001, positives: np.ndarray = None,
+                    focus: np.ndarray = None) -> pd.DataFrame:
+    """
+    Computes the confusion counts of the rule score >= threshold at every threshold of a uniform grid in [0, 1]
+    with a single sort and cumulative sums, instead of thresholding the scores once per value.
+
+    Args:
+        scores (np.ndarray): Probability of the positive (Cattle) class of each image.
+        num_thresholds (int): Number of thresholds of the grid.
+        positives (np.ndarray, optional): Ground truth of each image (True for Cattle). Without it, only the
+            number of images above each threshold is computed.
+        focus (np.ndarray, optional): Mask of the negatives of a label of interest (e.g. puma), whose false
+            positives are counted separately.
+
+    Returns:
+        pd.DataFrame: One row per threshold with the predicted positives and, with labels, tp, fp, fn, tn,
+            precision, recall, fpr, f1 and focus_fp.
+    """
+    order = np.argsort(scores, kind="stable")
+    sorted_scores = scores[order]
+    thresholds = np.linspace(0.0, 1.0, num_thresholds)
+    # Number of images with score >= threshold: the ones after the insertion point in the ascending order
+    start = np.searchsorted(sorted_scores, thresholds, side="left")
+    predicted = len(scores) - start
+    curve = {"threshold": thresholds, "predicted_positive": predicted}
+    if positives is None:
+        return pd.DataFrame(curve)
+
+    # Suffix sums over the ascending order: counts of the images at or above each insertion point
+    def above(mask):
+        cum = np.concatenate([[0], np.cumsum(mask[order][::-1])])
+        return cum[predicted]
+
+    tp = above(positives)
+    fp = predicted - tp
+    num_pos = int(positives.sum())
+    num_neg = len(scores) - num_pos
+    fn = num_pos - tp
+    tn = num_neg - fp
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, tp / predicted, 1.0)
+        recall = tp / max(num_pos, 1)
+        fpr = fp / max(num_neg, 1)
+        f1 = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), 0.0)
+    curve.update(tp=tp, fp=fp, fn=fn, tn=tn, precision=precision, recall=recall, fpr=fpr, f1=f1)
+    if focus is not None:
+        curve["focus_fp"] = above(focus)
+    return pd.DataFrame(curve)
+
+
+def operating_points(curve: pd.DataFrame, target_recall: float = 0.95, target_precision: float = 0.95) -> pd.DataFrame:
+    """
+    Recommended operating points of a labeled threshold curve.
+
+    - max_f1: threshold with the best F1.
+    - recall>=target: highest threshold that keeps the target recall, i.e. the fewest false positives (overall
+      and of the focus label) at that recall.
+    - precision>=target: lowest threshold that reaches the target precision, i.e. the best recall at that precision.
+    - zero_focus_fp: lowest threshold without false positives of the focus label.
+
+    Args:
+        curve (pd.DataFrame): Output of threshold_curve with labels.
+        target_recall (float): Minimum recall of the Cattle class.
+        target_precision (float): Minimum precision of the Cattle class.
+
+    Returns:
+        pd.DataFrame: One row per operating point found.
+    """
+    points = {"max_f1": curve["f1"].idxmax()}
+    meets_recall = curve.index[curve["recall"] >= target_recall]
+    if len(meets_recall):
+        points[f"recall>={target_recall}"] = meets_recall.max()
+    meets_precision = curve.index[(curve["precision"] >= target_precision) & (curve["predicted_positive"] > 0)]
+    if len(meets_precision):
+        points[f"precision>={target_precision}"] = meets_precision.min()
+    if "focus_fp" in curve:
+        zero_focus = curve.index[curve["focus_fp"] == 0]
+        if len(zero_focus):
+            points["zero_focus_fp"] = zero_focus.min()
+    table = curve.loc[list(points.values())].copy()
+    table.insert(0, "operating_point", list(points.keys()))
+    return table.reset_index(drop=True)
+
+
+def sweep(npz_file_path: str, output_csv: str = None, num_thresholds: int = 10001, positive_class: int = 1,
+          focus_label: str = None, target_recall: float = 0.95, target_precision: float = 0.95) -> None:
+    """
+    Sweeps the decision threshold of filter_predictions.py over the logits of a _predict.npz or eval.npz file.
+
+    The arrays are memory-mapped, not copied. With labels (eval.npz), the precision/recall/FPR curve and the
+    recommended operating points are reported; without labels, only the number of images above each threshold.
+
+    Args:
+        npz_file_path (str): Path to the .npz file containing 'logits' (and 'label_ids'/'labels' for eval.npz).
+        output_csv (str): Path to save the curve. Default: next to the .npz file with suffix _thresholds.csv.
+        num_thresholds (int): Number of thresholds of the grid in [0, 1].
+        positive_class (int): Label id of the Cattle class, both the logit column scored and the ground truth.
+        focus_label (str): Label name whose false positives are tracked (e.g. puma).
+        target_recall (float): Minimum recall of the recall operating point.
+        target_precision (float): Minimum precision of the precision operating point.
+    """
+    start = time.perf_counter()
+    data = load_npz_mmap(npz_file_path)
+    scores = cattle_probabilities(data["logits"], positive_class)
+
+    positives, focus = None, None
+    if "label_ids" in data:
+        label_ids = np.asarray(data["label_ids"])
+        # Unlabeled samples (negative ids) are left out, as in the confusion matrices
+        labeled = label_ids >= 0
+        scores = scores[labeled]
+        positives = label_ids[labeled] == positive_class
+        if focus_label is not None and "labels" in data:
+            focus = (np.asarray(data["labels"])[labeled] == focus_label) & ~positives
+
+    curve = threshold_curve(scores, num_thresholds, positives, focus)
+    elapsed = time.perf_counter() - start
+
+    output_csv = output_csv or npz_file_path.replace(".npz", "_thresholds.csv")
+    curve.to_csv(output_csv, index=False)
+    print(f"{len(scores)} images, {num_thresholds} thresholds in {elapsed:.3f} s. Curve saved to {output_csv}")
+
+    if positives is None:
+        print("No labels found: only the number of images above each threshold was computed.")
+        return
+    if focus is not None:
+        print(f"Focus label '{focus_label}': {int(focus.sum())} images (false positives in column focus_fp).")
+    with pd.option_context("display.width", 200, "display.max_columns", 20):
+        print(operating_points(curve, target_recall, target_precision).to_string(index=False, float_format="%.4f"))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        prog="threshold_sweep",
+        description="Sweeps the decision threshold of filter_predictions.py over saved logits and recommends operating points."
+    )
+    parser.add_argument("npz", help="Path to a _predict.npz or eval.npz file")
+    parser.add_argument("--output", default=None, help="Path of the curve CSV (default: <npz>_thresholds.csv)")
+    parser.add_argument("--num-thresholds", type=int, default=10001, help="Number of thresholds in [0, 1]")
+    parser.add_argument("--positive-class", type=int, default=1, help="Label id of the Cattle class")
+    parser.add_argument("--focus-label", default=None, help="Label whose false positives are tracked (e.g. puma)")
+    parser.add_argument("--target-recall", type=float, default=0.95, help="Minimum recall of the recall operating point")
+    parser.add_argument("--target-precision", type=float, default=0.95, help="Minimum precision of the precision operating point")
+    args = parser.parse_args()
+
+    sweep(args.npz, args.output, args.num_thresholds, args.positive_class, args.focus_label,
+          args.target_recall, args.target_precision)
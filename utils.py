@@ -1,7 +1,13 @@
-from pathlib import Path 
-from typing import Any
-import numpy as np 
-from PIL import Image 
+from pathlib import Path
+from typing import Any, Iterable, Iterator, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import torch
+from PIL import Image
+
+from src.utils.detection_cache import DetectionCache, detect_images
+from src.utils.motion_filter import MotionFilter
 
 
 def crop_with_margin(image: np.ndarray, box: np.ndarray, margin: int = 5) -> np.ndarray:
@@ -10,12 +16,12 @@ def crop_with_margin(image: np.ndarray, box: np.ndarray, margin: int = 5) -> np.
     Args:
         image (np.ndarray): Array de la imagen.
         box (np.ndarray[int]): Coordenadas de la caja para el recorte. Se asegura de tomar solo los primeros 4 valores.
-		margin (int): Tamaño en Pixeles del margen alredor de la caja. Default: 5.
+        margin (int): Tamaño en Pixeles del margen alredor de la caja. Default: 5.
 
     Returns:
         np.ndarray: Array de la imagen recortada
     """
-	box = box[:4]
+    box = box[:4]
     x1, y1, x2, y2 = box.astype(int)
     height, width, _ = image.shape
     x1 = max(0, x1 - margin)
@@ -24,104 +30,356 @@ def crop_with_margin(image: np.ndarray, box: np.ndarray, margin: int = 5) -> np.
     y2 = min(height, y2 + margin)
     return image[y1:y2, x1:x2]
 
-def process_image(image_path: Path, output_folder: Path, detector: Any, classifier: Any, margin: int = 5) -> None:
+def load_image(image_path: Path) -> np.ndarray:
+    """
+    Decodifica una imagen a un array RGB.
+
+    Args:
+        image_path (Path): Ruta al archivo de la imagen.
+
+    Returns:
+        np.ndarray: Array de la imagen (H, W, 3).
+    """
+    return np.array(Image.open(image_path).convert("RGB"))
+
+def prefetch_images(image_paths: Iterable[Path], num_workers: int = 4, prefetch: int = 16) -> Iterator[Tuple[Path, np.ndarray]]:
+    """
+    Decodifica las imágenes por adelantado en un pool de hilos y las entrega en orden.
+    Como máximo hay `prefetch` imágenes decodificadas (o en decodificación) esperando al modelo.
+    Las imágenes que no se pueden decodificar se reportan y se omiten.
+
+    Args:
+        image_paths (Iterable[Path]): Rutas de las imágenes.
+        num_workers (int, optional): Hilos de decodificación. Default: 4.
+        prefetch (int, optional): Máximo de imágenes adelantadas. Default: 16.
+
+    Yields:
+        Tuple[Path, np.ndarray]: Ruta y array de cada imagen.
+    """
+    with ThreadPoolExecutor(max_workers=num_workers) as executor:
+        pending = deque()
+        paths = iter(image_paths)
+        for image_path in paths:
+            pending.append((image_path, executor.submit(load_image, image_path)))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            image_path, future = pending.popleft()
+            next_path = next(paths, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(load_image, next_path)))
+            try:
+                image = future.result()
+            except Exception as e:
+                print(f"Error procesando {image_path.name}: {e}")
+                continue
+            yield image_path, image
+
+class CropWriter:
+    """
+    Escribe los recortes en un pool de hilos separado del modelo. Si hay más de `max_pending` recortes
+    esperando a escribirse, save() espera (back-pressure) para acotar la memoria.
+    Un error de escritura se reporta con el nombre de su recorte y no interrumpe los demás.
+    """
+
+    def __init__(self, num_workers: int = 4, max_pending: int = 64):
+        """
+        Args:
+            num_workers (int, optional): Hilos de codificación y escritura. Default: 4.
+            max_pending (int, optional): Máximo de recortes pendientes en memoria. Default: 64.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.pending = deque()
+        self.max_pending = max_pending
+
+    def save(self, cropped: np.ndarray, output_name: Path) -> None:
+        """
+        Encola la codificación y escritura de un recorte.
+
+        Args:
+            cropped (np.ndarray): Array del recorte.
+            output_name (Path): Ruta del archivo de salida.
+        """
+        self.pending.append((output_name, self.executor.submit(lambda: Image.fromarray(cropped).save(output_name))))
+        while len(self.pending) > self.max_pending:
+            self._wait()
+
+    def _wait(self) -> None:
+        """
+        Espera la escritura más antigua y reporta su error, si lo hubo.
+        """
+        output_name, future = self.pending.popleft()
+        try:
+            future.result()
+        except Exception as e:
+            print(f"Error guardando {output_name.name}: {e}")
+
+    def close(self) -> None:
+        """
+        Espera a que se escriban todos los recortes pendientes.
+        """
+        while self.pending:
+            self._wait()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+def batched(items: Iterable, batch_size: int) -> Iterator[list]:
+    """
+    Agrupa un iterable en listas de hasta batch_size elementos.
+
+    Args:
+        items (Iterable): Elementos a agrupar.
+        batch_size (int): Tamaño máximo de cada grupo.
+
+    Yields:
+        list: Grupo de elementos.
+    """
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def save_crop(cropped: np.ndarray, output_name: Path, writer: Optional[CropWriter] = None) -> None:
+    """
+    Guarda un recorte, en el pool de escritura si se da uno o de forma síncrona si no.
+
+    Args:
+        cropped (np.ndarray): Array del recorte.
+        output_name (Path): Ruta del archivo de salida.
+        writer (CropWriter, optional): Pool de escritura. Default: None.
+    """
+    if writer is None:
+        Image.fromarray(cropped).save(output_name)
+    else:
+        writer.save(cropped, output_name)
+
+def collect_crops(image_path: Path, image: np.ndarray, detector: Any, margin: int = 5,
+                  results: Optional[list] = None, cache: Optional[DetectionCache] = None) -> List[Tuple[str, np.ndarray]]:
     """
-    Procesa una imagen individual: detecta objetos, los recorta y clasifica su especie. 
-	
+    Detecta objetos en una imagen y regresa sus recortes, sin clasificarlos.
+
     Args:
         image_path (Path): Ruta al archivo de la imagen original.
-        output_folder (Path): Carpeta donde se guardarán los recortes procesados.
+        image (np.ndarray): Imagen decodificada.
         detector (Any): Modelo de detección (debe tener método .predictor).
-        classifier (Any): Modelo del clasificador (debe tener método .single_image_classification).
-        margin (int, optional):  Tamaño en pixeles del margen alredor de la caja. Default: 5
+        margin (int, optional): Tamaño en pixeles del margen alredor de la caja. Default: 5
+        results (list, optional): Detecciones ya calculadas (por ejemplo con detect_images). Default: se detecta la imagen.
+        cache (DetectionCache, optional): Cache de detecciones. Default: None (sin cache).
+
+    Returns:
+        List[Tuple[str, np.ndarray]]: Prefijo del nombre de salida (Original_det[NumDeteccion]_[NumCaja]) y recorte.
     """
-    image = np.array(Image.open(image_path).convert("RGB"))
-    results = detector.predictor(image)
+    if results is None:
+        results = detect_images(detector, [image_path], [image], cache)[0]
 
+    crops = []
     for i, result in enumerate(results):
         boxes = result.boxes.xyxy.cpu().numpy()
-		
-		for j, box in enumerate(boxes):
-            # Recortar y clasificar
-            cropped = crop_with_margin(result.orig_img, box, margin)
-            predicted_species = classifier.single_image_classification(cropped)
-            species_name = predicted_species['prediction']
+        for j, box in enumerate(boxes):
+            # Copia: el recorte se acumula hasta clasificarse y una vista mantendría viva la imagen completa
+            crops.append((f"{image_path.stem}_det{i+1}_{j+1}", crop_with_margin(result.orig_img, box, margin).copy()))
+    return crops
 
-            #Nombre de archivo y guardar
-            # Estructura: Original_det[NumDeteccion]_[NumCaja]_[Especie].jpg
-            output_name = output_folder / f"{image_path.stem}_det{i+1}_{j+1}_{species_name}.jpg"
-            Image.fromarray(cropped).save(output_name)
+def classify_crops(classifier: Any, crops: List[np.ndarray], batch_size: int = 64) -> List[str]:
+    """
+    Clasifica recortes en lotes de hasta batch_size con una sola pasada del modelo por lote.
+    Si el clasificador no expone transform/forward/results_generation se usa single_image_classification por recorte.
 
+    Args:
+        classifier (Any): Modelo del clasificador de PyTorch Wildlife.
+        crops (List[np.ndarray]): Recortes a clasificar.
+        batch_size (int, optional): Recortes por pasada del modelo. Default: 64.
 
-def process_folder(folder_path: Path, detector: Any, classifier: Any, margin: int = 5) -> None:
+    Returns:
+        List[str]: Especie predicha de cada recorte.
+    """
+    if not all(hasattr(classifier, attr) for attr in ("transform", "forward", "results_generation")):
+        return [classifier.single_image_classification(cropped)['prediction'] for cropped in crops]
+
+    species = []
+    for batch in batched(crops, batch_size):
+        images = torch.stack([classifier.transform(Image.fromarray(cropped)) for cropped in batch])
+        with torch.no_grad():
+            logits = classifier.forward(images.to(classifier.device))
+        results = classifier.results_generation(logits.cpu(), [None] * len(batch))
+        species.extend(result['prediction'] for result in results)
+    return species
+
+def save_classified_crops(crops: List[Tuple[str, np.ndarray]], output_folder: Path, classifier: Any,
+                          writer: Optional[CropWriter] = None, batch_size: int = 64) -> None:
+    """
+    Clasifica los recortes por lotes y los guarda con la especie en el nombre.
+
+    Args:
+        crops (List[Tuple[str, np.ndarray]]): Prefijos de nombre y recortes, como los regresa collect_crops.
+        output_folder (Path): Carpeta donde se guardarán los recortes procesados.
+        classifier (Any): Modelo del clasificador.
+        writer (CropWriter, optional): Pool de escritura de los recortes. Default: escritura síncrona.
+        batch_size (int, optional): Recortes por pasada del clasificador. Default: 64.
+    """
+    species = classify_crops(classifier, [cropped for _, cropped in crops], batch_size)
+    for (prefix, cropped), species_name in zip(crops, species):
+        # Estructura: Original_det[NumDeteccion]_[NumCaja]_[Especie].jpg
+        save_crop(cropped, output_folder / f"{prefix}_{species_name}.jpg", writer)
+
+def process_image(image_path: Path, output_folder: Path, detector: Any, classifier: Any, margin: int = 5,
+                  image: Optional[np.ndarray] = None, writer: Optional[CropWriter] = None,
+                  results: Optional[list] = None, classify_batch_size: int = 64,
+                  cache: Optional[DetectionCache] = None) -> None:
+    """
+    Procesa una imagen individual: detecta objetos, los recorta y clasifica su especie.
+    Todos los recortes de la imagen se clasifican juntos en lotes.
+
+    Args:
+        image_path (Path): Ruta al archivo de la imagen original.
+        output_folder (Path): Carpeta donde se guardarán los recortes procesados.
+        detector (Any): Modelo de detección (debe tener método .predictor).
+        classifier (Any): Modelo del clasificador (con transform/forward/results_generation o .single_image_classification).
+        margin (int, optional):  Tamaño en pixeles del margen alredor de la caja. Default: 5
+        image (np.ndarray, optional): Imagen ya decodificada. Default: se decodifica image_path.
+        writer (CropWriter, optional): Pool de escritura de los recortes. Default: escritura síncrona.
+        results (list, optional): Detecciones ya calculadas (por ejemplo con detect_images). Default: se detecta la imagen.
+        classify_batch_size (int, optional): Recortes por pasada del clasificador. Default: 64.
+        cache (DetectionCache, optional): Cache de detecciones. Default: None (sin cache).
+    """
+    if image is None:
+        image = load_image(image_path)
+    crops = collect_crops(image_path, image, detector, margin, results, cache)
+    save_classified_crops(crops, output_folder, classifier, writer, classify_batch_size)
+
+
+def process_folder(folder_path: Path, detector: Any, classifier: Any, margin: int = 5,
+                   num_workers: int = 4, prefetch: int = 16, batch_size: int = 1, classify_batch_size: int = 64,
+                   cache: Optional[DetectionCache] = None) -> None:
     """
     Procesa todas las imágenes dentro de un directorio. Crea una subcarpeta 'recortes' (si no existe) e itera sobre todos los archivos
-    con extensión .jpg encontrados aplicando la función process_image.
+    con extensión .jpg encontrados, detectando y recortando cada imagen como process_image.
+    La decodificación se adelanta en un pool de hilos y los recortes se escriben en otro, mientras el modelo procesa la imagen actual.
+    Los recortes de varias imágenes se acumulan y se clasifican juntos en lotes de classify_batch_size.
 
     Args:
         folder_path (Path): Ruta del directorio que contiene las imágenes.
         detector (Any): Modelo de detección.
         classifier (Any): Modelo de clasificación.
         margin (int, optional):  Tamaño en Pixeles del margen alredor de la caja. Default: 5.
+        num_workers (int, optional): Hilos de decodificación y de escritura. Default: 4.
+        prefetch (int, optional): Máximo de imágenes decodificadas por adelantado. Default: 16.
+        batch_size (int, optional): Imágenes por llamada al detector. Default: 1.
+        classify_batch_size (int, optional): Recortes por pasada del clasificador. Default: 64.
+        cache (DetectionCache, optional): Cache de detecciones; las imágenes ya detectadas no pasan por el detector. Default: None.
     """
     output_folder = folder_path / "recortes"
     output_folder.mkdir(exist_ok=True)
 
     # Iterar sobre imágenes ordenadas alfabéticamente
-    for image_path in sorted(folder_path.glob("*.jpg")):
-        process_image(image_path, output_folder, detector, classifier, margin)
+    image_paths = sorted(folder_path.glob("*.jpg"))
+    pending = []
+    with CropWriter(num_workers=num_workers, max_pending=4 * prefetch) as writer:
+        for batch in batched(prefetch_images(image_paths, num_workers, max(prefetch, 2 * batch_size)), batch_size):
+            batch_results = detect_images(detector, [p for p, _ in batch], [image for _, image in batch], cache)
+            for (image_path, image), results in zip(batch, batch_results):
+                pending.extend(collect_crops(image_path, image, detector, margin, results))
+            if len(pending) >= classify_batch_size:
+                save_classified_crops(pending, output_folder, classifier, writer, classify_batch_size)
+                pending = []
+        save_classified_crops(pending, output_folder, classifier, writer, classify_batch_size)
+    if cache is not None:
+        print(cache.summary())
 
-def process_detection_only(image_path: Path, output_folder: Path, detector: Any, margin: int = 5) -> None:
+def process_detection_only(image_path: Path, output_folder: Path, detector: Any, margin: int = 5,
+                           image: Optional[np.ndarray] = None, writer: Optional[CropWriter] = None,
+                           results: Optional[list] = None, cache: Optional[DetectionCache] = None) -> None:
     """
     Realiza la detección de objetos y guarda los recortes sin clasificarlos.
     Nos ayudará para analizar la calidad del detector.
-	Args:
+    Args:
         image_path (Path): Ruta del archivo de imagen individual a procesar.
         output_folder (Path): Carpeta donde se guardarán los archivos recortados.
         detector (Any): Modelo de detección (con método .predictor).
         margin (int, optional): Tamaño en Pixeles del margen alredor de la caja. Default: 5.
+        image (np.ndarray, optional): Imagen ya decodificada. Default: se decodifica image_path.
+        writer (CropWriter, optional): Pool de escritura de los recortes. Default: escritura síncrona.
+        results (list, optional): Detecciones ya calculadas (por ejemplo con detect_images). Default: se detecta la imagen.
+        cache (DetectionCache, optional): Cache de detecciones. Default: None (sin cache).
     """
     try:
-        image = np.array(Image.open(image_path).convert("RGB"))
-        results = detector.predictor(image) 
-		found_animal = False
+        if image is None:
+            image = load_image(image_path)
+        if results is None:
+            results = detect_images(detector, [image_path], [image], cache)[0]
+        found_animal = False
         for i, result in enumerate(results):
-            boxes = result.boxes.xyxy.cpu().numpy()   
+            boxes = result.boxes.xyxy.cpu().numpy()
             if len(boxes) > 0:
-                found_animal = True    
+                found_animal = True
             for j, box in enumerate(boxes):
                 cropped = crop_with_margin(image, box, margin)
                 # Guardar como: NombreOriginal_crop_ÍndiceDetección_ÍndiceCaja.jpg
                 output_name = output_folder / f"{image_path.stem}_crop_{i}_{j}.jpg"
-                Image.fromarray(cropped).save(output_name)
+                save_crop(cropped, output_name, writer)
 
         if not found_animal:
             print(f" Imagen vacía -> {image_path.name}")
-            
+
     except Exception as e:
         print(f"Error procesando {image_path.name}: {e}")
-def process_folder_detection_only(folder_path: Path, detector: Any, margin: int = 5) -> None:
+def process_folder_detection_only(folder_path: Path, detector: Any, margin: int = 5,
+                                  num_workers: int = 4, prefetch: int = 16, batch_size: int = 1,
+                                  cache: Optional[DetectionCache] = None, motion_filter: Optional[MotionFilter] = None,
+                                  motion_mode: str = "skip") -> None:
     """
-	Procesa un folder completo solo con detección.
-	Args:
+    Procesa un folder completo solo con detección.
+    La decodificación se adelanta en un pool de hilos y los recortes se escriben en otro, mientras el modelo procesa la imagen actual.
+    Args:
         folder_path (Path): Ruta del directorio que contiene las imágenes originales.
         detector (Any): Modelo de detección.
         margin (int, optional): Tamaño en Pixeles del margen alredor de la caja. Default: 5.
-		
-	"""
+        num_workers (int, optional): Hilos de decodificación y de escritura. Default: 4.
+        prefetch (int, optional): Máximo de imágenes decodificadas por adelantado. Default: 16.
+        batch_size (int, optional): Imágenes por llamada al detector. Default: 1.
+        cache (DetectionCache, optional): Cache de detecciones; las imágenes ya detectadas no pasan por el detector. Default: None.
+        motion_filter (MotionFilter, optional): Pre-filtro de imágenes sin movimiento dentro de su secuencia. Default: None.
+        motion_mode (str, optional): "skip" omite las imágenes estáticas, "last" las procesa al final. Default: "skip".
+    """
     output_folder =folder_path.parent / (folder_path.name + "_recortes")
     output_folder.mkdir(exist_ok=True)
-	print(f"Procesando directorio: {folder_path}")
+    print(f"Procesando directorio: {folder_path}")
     print(f"Directorio de salida: {output_folder}")
     images = get_images_from_folder(folder_path)
-    print(f"Se encontraron {len(images)} imágenes para procesar."
+    print(f"Se encontraron {len(images)} imágenes para procesar.")
 
-    for image_path in sorted(folder_path.glob("*.jpg")):
-        process_detection_only(image_path, output_folder, detector, margin)
+    image_paths = sorted(folder_path.glob("*.jpg"))
+    if motion_filter is not None:
+        kept, skipped = motion_filter.split(image_paths)
+        print(motion_filter.summary(motion_filter.report(image_paths)))
+        image_paths = kept + skipped if motion_mode == "last" else kept
+    with CropWriter(num_workers=num_workers, max_pending=4 * prefetch) as writer:
+        for batch in batched(prefetch_images(image_paths, num_workers, max(prefetch, 2 * batch_size)), batch_size):
+            batch_results = [None] * len(batch)
+            if batch_size > 1:
+                try:
+                    batch_results = detect_images(detector, [p for p, _ in batch], [image for _, image in batch], cache)
+                except Exception as e:
+                    # Si falla el lote, cada imagen se detecta por separado para aislar la que falla
+                    print(f"Error en el lote de {batch[0][0].name}: {e}")
+            for (image_path, image), results in zip(batch, batch_results):
+                process_detection_only(image_path, output_folder, detector, margin, image=image, writer=writer,
+                                       results=results, cache=cache)
+    if cache is not None:
+        print(cache.summary())
 
 def get_images_from_folder(folder_path: Path) -> List[Path]:
     """
-    Busca  imágenes con extensiones comunes (.jpg, .png, etc.) 
+    Busca  imágenes con extensiones comunes (.jpg, .png, etc.)
     en una carpeta, sin distinguir entre mayúsculas y minúsculas.
 
     Args: